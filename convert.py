@@ -1,20 +1,46 @@
 import argparse 
+import glob
+import os
+import time
+
 import mmd.converter as converter
 
 # python3 convert.py dist/miku/Lat式ミクVer2.31_Normal.pmd dist/test.egg
 # python3 convert.py dist/alicia/Alicia_solid.pmx dist/test.egg
+# ディレクトリ、globや複数ファイルを指定するとまとめて変換する
+# python3 convert.py dist 'models/**/*.pmx' dist/egg
 
-def main(mmd_file, egg_file):
-    egg = converter.convert(mmd_file)
-    if not egg:
-        return
-
-    with open(egg_file, 'w') as f:
-        f.write(egg)
+def main(mmd_file, egg_file, precision=6):
+    converter.convert_file(mmd_file, egg_file, precision)
 
     print('convert end %s to %s.' % (mmd_file, egg_file))
 
 
+def batch(mmd_files, output_dir, precision=6, workers=None, force=False):
+    def report(result):
+        if result['status'] == 'error':
+            print('%-7s %7.2fs %s: %s' % (result['status'], result['time'], result['file'], result['error']))
+        else:
+            print('%-7s %7.2fs %10d -> %10d %s' % (
+                result['status'], result['time'], result['size'], result['eggSize'], result['file']))
+
+    start = time.perf_counter()
+    results = converter.convert_batch(mmd_files, output_dir, precision, workers, force, report)
+
+    counts = {'convert': 0, 'skip': 0, 'error': 0}
+    for result in results:
+        counts[result['status']] += 1
+
+    print('convert %d, skip %d, error %d files in %.2fs to %s.' % (
+        counts['convert'], counts['skip'], counts['error'], time.perf_counter() - start, output_dir))
+
+
+def is_batch(mmd_files):
+    if len(mmd_files) > 1:
+        return True
+    return os.path.isdir(mmd_files[0]) or glob.has_magic(mmd_files[0])
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         prog='pmd/pmx to egg converter',
@@ -24,13 +50,34 @@ if __name__ == '__main__':
         'mmd_file',
         metavar='input pmd/pmx file',
         type=str,
-        help='変換するpmd/pmxのファイルパスを指定'
+        nargs='+',
+        help='変換するpmd/pmxのファイルパスを指定。ディレクトリ、globを指定するとまとめて変換'
     )
     parser.add_argument(
         'egg_file',
         metavar='output egg file',
         type=str,
-        help='変換後のeggファイルの出力先パスを指定'
+        help='変換後のeggファイルの出力先パスを指定。まとめて変換する場合は出力先ディレクトリ'
+    )
+    parser.add_argument(
+        '--precision',
+        type=int,
+        default=6,
+        help='頂点座標を出力する小数点以下の桁数を指定'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='まとめて変換する際のプロセス数を指定'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='変更されていないファイルも変換する'
     )
     args = parser.parse_args()
-    main(args.mmd_file, args.egg_file)
\ No newline at end of file
+    if is_batch(args.mmd_file):
+        batch(args.mmd_file, args.egg_file, args.precision, args.workers, args.force)
+    else:
+        main(args.mmd_file[0], args.egg_file, args.precision)
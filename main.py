@@ -1,9 +1,7 @@
-import os
 from direct.showbase.ShowBase import ShowBase
 import panda3d.core as p3d
 
-import mmd.loader
-import mmd.converter
+import mmd.assets
 
 class App(ShowBase):
     # コンストラクタ
@@ -30,46 +28,39 @@ class App(ShowBase):
         self.axis.setScale(2)
         self.axis.reparentTo(self.render)
 
-        mmd_model = mmd.loader.load('dist/miku/Lat式ミクVer2.31_Normal.pmd')
-        #mmd_model = mmd.loader.load('dist/miku2/miku.pmd')
-        #mmd_model = mmd.loader.load('dist/chihaya/chihaya.pmd')
-        #mmd_model = mmd.loader.load('dist/alicia/Alicia_solid.pmx')
-        #mmd_model = mmd.loader.load('dist/luka/luka.pmx')
-        mmd_egg = mmd.converter.convert_model(mmd_model)
+        # モデルの読み込みはスレッドで行い、その間も描画を続ける
+        self.assets_loader = mmd.assets.AssetLoader()
+        self.loading = self.assets_loader.load('dist/miku/Lat式ミクVer2.31_Normal.pmd')
+        #self.loading = self.assets_loader.load('dist/miku2/miku.pmd')
+        #self.loading = self.assets_loader.load('dist/chihaya/chihaya.pmd')
+        #self.loading = self.assets_loader.load('dist/alicia/Alicia_solid.pmx')
+        #self.loading = self.assets_loader.load('dist/luka/luka.pmx')
+        self.taskMgr.add(self.wait_assets, 'wait_assets')
 
-        stream = p3d.StringStream()
-        mf = p3d.Multifile()
-        mf.openReadWrite(stream)
+    # 読み込みが終わるまで毎フレーム確認する
+    def wait_assets(self, task):
+        if not self.loading.done():
+            return task.cont
 
-        # 変換した内容を登録
-        egg_bytes = p3d.StringStream(mmd_egg.encode('utf-8'))
-        mf.addSubfile('model.egg', egg_bytes, 1)
-        # flushを実行してバッファーの内容を確定させる
-        mf.flush()
-
-        # モデルで使用している画像をメモリーに転送
-        registed = set()
-        for material in mmd_model.materials:
-            if not material.fileName:
-                continue
-            
-            fileNames = material.fileName.split('*')
-            for fileName in fileNames:
-                if fileName in registed:
-                    continue
-                registed.add(fileName)
-                texture = os.path.join(mmd_model.metadata.base, fileName)
-                texture_bytes = p3d.StringStream(open(texture, 'rb').read())
-                mf.addSubfile(fileName, texture_bytes, 1)
-                mf.flush()
+        try:
+            self.assets = self.loading.result()
+        except Exception as e:
+            print('load error %s' % (e))
+            return task.done
 
         # 仮想ファイルに/mfでマウント
-        vfs = p3d.VirtualFileSystem.getGlobalPtr()
-        if not vfs.mount(mf, '/mf', p3d.VirtualFileSystem.MFReadOnly):
-            print('vfs mount error')
-            return
+        try:
+            egg_file = self.assets.mount('/mf')
+        except IOError as e:
+            print(e)
+            return task.done
+
+        # eggの読み込みもpanda3dの非同期読み込みで行う
+        self.loader.loadModel(egg_file, callback=self.attach_model)
+        return task.done
 
-        self.model = self.loader.loadModel('/mf/model.egg')
+    def attach_model(self, model):
+        self.model = model
 
         # 奥向になるので180度回転し、手前(yマイナス)に向ける
         self.model.setH(self.model, 180)
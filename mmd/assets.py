@@ -0,0 +1,243 @@
+import collections
+import concurrent.futures
+import hashlib
+import os
+import threading
+
+from . import converter
+from . import loader
+
+# panda3d is imported where the vfs and multifiles are used, so the
+# loading and the store bookkeeping also run without it
+
+
+# file names of the textures used by the materials of model
+def texture_names(model):
+    names = []
+    if model.metadata.format == 'pmx':
+        names.extend(model.textures)
+    else:
+        for material in model.materials:
+            if material.fileName:
+                names.extend(material.fileName.split('*'))
+
+    # 重複を除いて順番を保つ
+    return list(dict.fromkeys(names))
+
+def texture_file(model, name):
+    return os.path.join(model.metadata.base, name)
+
+
+# textures shared by every model, each content is kept once in a ramdisk
+# mounted to the vfs at mount_point and named by its hash.
+# textures no model refers to any more stay until the total size goes
+# over budget, then the least recently used of them are removed.
+#   vfs: file system the textures are written to, the global vfs with a
+#        ramdisk mounted at mount_point when None
+class TextureStore(object):
+    def __init__(self, mount_point='/mmd/textures', budget=256 << 20, vfs=None):
+        self.mount_point = mount_point
+        self.budget = budget
+        self.size = 0
+        # hash -> entry, in the order they were last used
+        self.entries = collections.OrderedDict()
+        # (path, size, mtime) -> hash, a file already read is not read again
+        self.files = {}
+        self.lock = threading.Lock()
+        self.vfs = vfs
+
+    def mount(self):
+        if self.vfs is None:
+            import panda3d.core as p3d
+            self.vfs = p3d.VirtualFileSystem.getGlobalPtr()
+            if not self.vfs.mount(p3d.VirtualFileMountRamdisk(), self.mount_point, 0):
+                raise IOError('vfs mount error %s' % (self.mount_point))
+
+    # take a reference to the texture of file, returns its entry
+    def acquire(self, file):
+        stat = os.stat(file)
+        key = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(self.files.get(key))
+            if entry:
+                return self.use(entry)
+
+        with open(file, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+
+        with self.lock:
+            self.files[key] = digest
+            entry = self.entries.get(digest)
+            if entry is None:
+                self.mount()
+                entry = loader.ddict(
+                    hash=digest,
+                    path='%s/%s%s' % (self.mount_point, digest, os.path.splitext(file)[1].lower()),
+                    size=len(data),
+                    refs=0
+                )
+                self.vfs.writeFile(entry.path, data, False)
+                self.entries[digest] = entry
+                self.size += entry.size
+
+            self.use(entry)
+            self.evict()
+            return entry
+
+    def use(self, entry):
+        entry.refs += 1
+        self.entries.move_to_end(entry.hash)
+        return entry
+
+    def release(self, digest):
+        with self.lock:
+            self.entries[digest].refs -= 1
+            self.evict()
+
+    def evict(self):
+        for entry in list(self.entries.values()):
+            if self.size <= self.budget:
+                break
+            if entry.refs > 0:
+                continue
+
+            self.vfs.deleteFile(entry.path)
+            del self.entries[entry.hash]
+            self.size -= entry.size
+
+        # drop the files whose texture is gone
+        if len(self.files) > len(self.entries) * 2:
+            self.files = { key: digest for key, digest in self.files.items() if digest in self.entries }
+
+
+# store used when none is given to AssetLoader
+shared_textures = TextureStore()
+
+
+# model converted to egg in memory, ready to be mounted to the vfs.
+# the textures are in the store, the egg refers to their store paths.
+class ModelAssets(object):
+    def __init__(self, model, egg, textures, store):
+        self.model = model
+        self.egg = egg
+        self.textures = textures
+        self.store = store
+        self.stream = None
+        self.multifile = None
+        self.mount_point = None
+
+    # multifile with the egg as model.egg, flushed once
+    def make_multifile(self):
+        import panda3d.core as p3d
+        self.stream = p3d.StringStream()
+        self.multifile = p3d.Multifile()
+        self.multifile.openReadWrite(self.stream)
+
+        self.multifile.addSubfile('model.egg', p3d.StringStream(self.egg.encode('utf-8')), 1)
+        self.multifile.flush()
+
+        return self.multifile
+
+    # mount to the global vfs, the egg is then found at mount_point/model.egg
+    def mount(self, mount_point):
+        import panda3d.core as p3d
+        vfs = p3d.VirtualFileSystem.getGlobalPtr()
+        if not vfs.mount(self.multifile, mount_point, p3d.VirtualFileSystem.MFReadOnly):
+            raise IOError('vfs mount error %s' % (mount_point))
+
+        self.mount_point = mount_point
+        return mount_point + '/model.egg'
+
+    # unmount and give back the textures to the store
+    def release(self):
+        if self.mount_point:
+            import panda3d.core as p3d
+            p3d.VirtualFileSystem.getGlobalPtr().unmountPoint(self.mount_point)
+            self.mount_point = None
+
+        for entry in self.textures.values():
+            self.store.release(entry.hash)
+        self.textures = {}
+
+
+# loads models on a thread pool while the render loop keeps running.
+# the model is parsed first, then its textures are read into the store
+# at the same time, then the egg referring to them is made.
+# the returned future gives a ModelAssets whose multifile is already
+# built, mount it from the main thread.
+#   assets: class of the results, made as ModelAssets is
+class AssetLoader(object):
+    def __init__(self, workers=4, store=None, assets=ModelAssets):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.store = store or shared_textures
+        self.assets = assets
+
+    def load(self, file, callback=None):
+        result = concurrent.futures.Future()
+        if callback:
+            result.add_done_callback(callback)
+
+        def parsed(future):
+            try:
+                model = future.result()
+                entries = { name: self.executor.submit(self.store.acquire, texture_file(model, name)) for name in texture_names(model) }
+            except Exception as e:
+                result.set_exception(e)
+                return
+
+            def fail(e, acquired):
+                for entry in acquired.values():
+                    self.store.release(entry.hash)
+                result.set_exception(e)
+
+            def read():
+                acquired = { name: f.result() for name, f in entries.items() if not f.exception() }
+                errors = [ f.exception() for f in entries.values() if f.exception() ]
+                if errors:
+                    fail(errors[0], acquired)
+                    return
+
+                def done(f):
+                    try:
+                        assets = self.assets(model, f.result(), acquired, self.store)
+                        assets.make_multifile()
+                        result.set_result(assets)
+                    except Exception as e:
+                        fail(e, acquired)
+
+                paths = { name: entry.path for name, entry in acquired.items() }
+                self.executor.submit(converter.convert_model, model, textures=paths).add_done_callback(done)
+
+            gather(list(entries.values()), read)
+
+        self.executor.submit(load_model, file).add_done_callback(parsed)
+        return result
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+
+def load_model(file):
+    model = loader.load(file)
+    converter.check_model(model)
+    return model
+
+# call done once every future is finished
+def gather(futures, done):
+    if not futures:
+        done()
+        return
+
+    lock = threading.Lock()
+    pending = [len(futures)]
+
+    def finished(future):
+        with lock:
+            pending[0] -= 1
+            last = pending[0] == 0
+        if last:
+            done()
+
+    for future in futures:
+        future.add_done_callback(finished)
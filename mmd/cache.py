@@ -0,0 +1,180 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+
+import numpy as np
+
+from . import loader
+
+
+# on-disk cache of parsed models.
+# each entry is a pair of files named by the source path and load options
+#   <key>.npz   numpy arrays of the model and the pickled rest of it
+#   <key>.json  source file size, mtime and content hash
+# entries are validated against the source file when read, and the least
+# recently used ones are removed when the cache grows over max_size.
+class ModelCache(object):
+    def __init__(self, directory, max_size=1 << 30):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    # cached model of file, parsed and stored when missing or outdated
+    def load(self, file, **options):
+        model = self.get(file, **options)
+        if model is None:
+            model = loader.load(file, **options)
+            self.put(file, model, **options)
+        return model
+
+    def get(self, file, **options):
+        path = self.path(file, options)
+        try:
+            with open(path + '.json') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        mtime = info['mtime']
+        if not file_unchanged(file, info):
+            self.remove(path)
+            return None
+        if info['mtime'] != mtime:
+            write_json(path + '.json', info)
+
+        try:
+            with np.load(path + '.npz') as npz:
+                arrays = dict(npz.items())
+        except (OSError, ValueError):
+            self.remove(path)
+            return None
+
+        # access time for the lru eviction
+        os.utime(path + '.json')
+        return ArrayUnpickler(io.BytesIO(arrays.pop('model').tobytes()), arrays).load()
+
+    def put(self, file, model, **options):
+        path = self.path(file, options)
+        stat = os.stat(file)
+
+        f = io.BytesIO()
+        pickler = ArrayPickler(f)
+        pickler.dump(model)
+        arrays = pickler.arrays
+        arrays['model'] = np.frombuffer(f.getbuffer(), np.uint8)
+
+        # write under a temporary name so a broken entry is never read
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path + '.npz')
+
+        write_json(path + '.json', {
+            'file': os.path.abspath(file),
+            'options': repr(sorted(options.items())),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': file_hash(file)
+        })
+
+        self.evict()
+
+    def path(self, file, options):
+        key = repr((os.path.abspath(file), sorted(options.items())))
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def remove(self, path):
+        for ext in ('.json', '.npz'):
+            try:
+                os.remove(path + ext)
+            except OSError:
+                pass
+
+    # remove least recently used entries until the cache fits max_size
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+
+            path = os.path.join(self.directory, name[:-5])
+            try:
+                used = os.stat(path + '.json').st_mtime
+                size = os.stat(path + '.json').st_size + os.stat(path + '.npz').st_size
+            except OSError:
+                continue
+
+            entries.append((used, size, path))
+            total += size
+
+        entries.sort()
+        for used, size, path in entries:
+            if total <= self.max_size:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                self.remove(os.path.join(self.directory, name[:-5]))
+
+
+# pickler that keeps numpy arrays out of the pickle stream,
+# they are collected in arrays and saved to the npz file
+class ArrayPickler(pickle.Pickler):
+    def __init__(self, f):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays = {}
+        self.names = {}
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject:
+            return None
+
+        if id(obj) not in self.names:
+            name = 'a%d' % len(self.arrays)
+            self.names[id(obj)] = name
+            self.arrays[name] = obj
+        return self.names[id(obj)]
+
+
+class ArrayUnpickler(pickle.Unpickler):
+    def __init__(self, f, arrays):
+        super().__init__(f)
+        self.arrays = arrays
+
+    def persistent_load(self, name):
+        return self.arrays[name]
+
+
+# whether file is still the one info ('size', 'mtime', 'hash') was taken
+# from. a file touched but not modified is found by its contents, its new
+# mtime is then set in info.
+def file_unchanged(file, info):
+    stat = os.stat(file)
+    if stat.st_size != info['size']:
+        return False
+
+    if stat.st_mtime_ns != info['mtime']:
+        # touched but maybe not modified, compare the contents
+        if file_hash(file) != info['hash']:
+            return False
+        info['mtime'] = stat.st_mtime_ns
+
+    return True
+
+def file_hash(file):
+    h = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
@@ -1,63 +1,273 @@
+import concurrent.futures
+import glob
 import io
+import json
+import os
+import time
+
+import numpy as np
+
+from . import cache
 from . import loader
 
-def convert(file):
-    model = loader.load(file)
-    return convert_model(model)
+def convert(file, precision=6):
+    # only geometry and materials are used, the other sections are skipped
+    model = loader.load(file, lazy=True)
+    return convert_model(model, precision)
+
+# convert file and write the egg straight to egg_file
+def convert_file(file, egg_file, precision=6):
+    model = loader.load(file, lazy=True)
+    check_model(model)
+    with open(egg_file, 'w') as f:
+        write_egg(model, f, precision=precision)
 
-def convert_model(model):
+def convert_model(model, precision=6, textures=None):
+    f = io.StringIO()
+    write_egg(model, f, precision=precision, textures=textures)
+    return f.getvalue()
+
+def check_model(model):
     if not model:
         raise ValueError('ファイル変換エラー')
 
     if not model.metadata.format in ['pmd', 'pmx']:
         raise ValueError('ファイルがpmd、pmx形式ではありません')
 
-    f = io.StringIO()
+
+# collects written strings and passes them to f in large chunks
+class ChunkWriter(object):
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+
+    def write(self, s):
+        self.chunks.append(s)
+        self.size += len(s)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.f.write(''.join(self.chunks))
+        self.chunks = []
+        self.size = 0
+
+
+# egg text of one vertex / polygon, %(f)s is replaced by the float format
+VERTEX = (
+    '  <Vertex> %%d {\n'
+    '    %(f)s %(f)s %(f)s\n'
+    '    <Normal> { %(f)s %(f)s %(f)s }\n'
+    '    <UV> { %(f)s %(f)s }\n'
+    '  }\n'
+)
+
+POLYGON = '    <Polygon> { %s<VertexRef> { %%d %%d %%d <Ref> { mmd } } }\n'
+
+# texture file name of every material, None for the untextured ones.
+# pmd names the texture (and the sphere map after *) in the material,
+# pmx refers to model.textures by index.
+def material_textures(model):
+    names = []
+    for material in model.materials:
+        if model.metadata.format == 'pmx':
+            index = material.textureIndex
+            names.append(model.textures[index] if 0 <= index < len(model.textures) else None)
+        else:
+            names.append((material.fileName or '').split('*')[0] or None)
+    return names
+
+# [start, end) face range of every material, from the face counts
+def face_ranges(materials):
+    counts = np.array([ material.faceCount for material in materials ], np.int64)
+    ends = np.cumsum(counts)
+    return np.stack([ends - counts, ends], axis=1)
+
+# format the rows of values with template, many rows per % operation
+def write_rows(f, template, values, batch=4096):
+    for start in range(0, len(values), batch):
+        rows = values[start:start + batch]
+        f.write((template * len(rows)) % tuple(rows.ravel().tolist()))
+
+
+# write model as egg text to the file object f
+#   precision: digits after the decimal point of the vertex values
+#   textures: path written to the egg for each texture file name
+def write_egg(model, f, chunk_size=1 << 20, precision=6, textures=None):
+    check_model(model)
+
+    f = ChunkWriter(f, chunk_size)
     f.write('<CoordinateSystem> { y-up }\n')
 
-    materials_list = []
-    for i, material in enumerate(model.materials):
-        tref = -1
-        if material.fileName:
-            fileName = material.fileName.split('*')[0]
+    names = material_textures(model)
+    for i, fileName in enumerate(names):
+        if fileName:
+            if textures:
+                fileName = textures.get(fileName, fileName)
             f.write('<Texture> %d { "%s"' % (i, fileName))
             f.write('}\n')
-            tref = i
 
-        materials_list.append({'tref': tref, 'faceCount':material.faceCount})
+    vertices = model.vertices
+    values = np.empty((len(vertices), 9))
+    values[:, 0] = np.arange(len(vertices))
+    values[:, 1:4] = vertices.positions
+    values[:, 4:7] = vertices.normals
+    values[:, 7] = vertices.uvs[:, 0]
+    values[:, 8] = 1 - vertices.uvs[:, 1]
 
     f.write('<VertexPool> mmd {\n')
-    for i, vertex in enumerate(model.vertices):
-        f.write('  <Vertex> %d {\n' % (i))
-        f.write('    %.11f %.11f %.11f\n' % (vertex.position[0], vertex.position[1], vertex.position[2]))
-        f.write('    <Normal> { %.11f %.11f %.11f }\n' % (vertex.normal[0], vertex.normal[1], vertex.normal[2]))
-        f.write('    <UV> { %.11f %.11f }\n' % (vertex.uv[0], 1-vertex.uv[1]))
-        f.write('  }\n')
-    
+    write_rows(f, VERTEX % {'f': '%%.%df' % precision}, values)
     f.write('}\n')
 
+    # one group per material holding all of its triangles
+    indices = model.faces.indices
+    ranges = face_ranges(model.materials)
+    total = ranges[-1, 1] if len(ranges) else 0
+    if total > len(indices):
+        raise ValueError('材質の面数が面の数より多くなっています')
+    if total < len(indices):
+        raise ValueError('材質の面数が面の数より少なくなっています')
+
     f.write('<Group> mmd {\n')
-    current_tref = -1
-    for face in model.faces:
-        tref = materials_list[0]['tref']
-        materials_list[0]['faceCount'] -= 1
-        if not materials_list[0]['faceCount']:
-            del materials_list[0]
-
-        if tref != -1:
-            current_tref = tref
-
-        f.write('  <Polygon> {\n')
-        if current_tref != -1:
-            f.write('    <TRef> { %d }\n' % (current_tref))
-        f.write('    <BFace> { 0 }\n')
-        f.write('    <VertexRef> { %s <Ref> { mmd } }\n' % (' '.join([str(i) for i in face.indices])))
+    for i, material in enumerate(model.materials):
+        start, end = ranges[i]
+        if start == end:
+            continue
+
+        tref = '<TRef> { %d } ' % (i) if names[i] else ''
+        f.write('  <Group> material%d {\n' % (i))
+        write_rows(f, POLYGON % (tref), indices[start:end])
         f.write('  }\n')
 
     f.write('}\n')
-    
-    f.seek(0)
-    return f.read()
+    f.flush()
+
+
+# record of the converted files kept in the output directory of a batch
+MANIFEST = '.convert-manifest.json'
+
+# pmd/pmx files of a batch as (root, file).
+# directories are searched recursively, other patterns are globs.
+# root is the directory the output tree is built from.
+def find_inputs(patterns, formats=('PMD', 'PMX')):
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, names in os.walk(pattern):
+                dirs.sort()
+                for name in sorted(names):
+                    if loader.file_format(name) in formats:
+                        inputs.append((pattern, os.path.join(root, name)))
+            continue
+
+        files = [ file for file in sorted(glob.glob(pattern, recursive=True)) if loader.file_format(file) in formats ]
+        if files:
+            root = os.path.commonpath([ os.path.dirname(os.path.abspath(file)) for file in files ])
+            inputs.extend([ (root, file) for file in files ])
+
+    return inputs
+
+# convert one file of a batch, run in the worker processes
+def convert_job(job):
+    file, egg_file, precision = job
+    result = {'file': file, 'egg': egg_file, 'status': 'convert'}
+
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(egg_file) or '.', exist_ok=True)
+        convert_file(file, egg_file, precision)
+
+        stat = os.stat(file)
+        result['size'] = stat.st_size
+        result['mtime'] = stat.st_mtime_ns
+        result['hash'] = cache.file_hash(file)
+        result['eggSize'] = os.path.getsize(egg_file)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        # do not leave a broken egg behind
+        if os.path.exists(egg_file):
+            os.remove(egg_file)
+
+    result['time'] = time.perf_counter() - start
+    return result
+
+# convert every pmd/pmx file matched by patterns to output_dir
+#   the directory layout under each input root is kept, the egg of
+#   m.pmx is m.pmx.egg so m.pmd and m.pmx of one directory do not clash.
+#   files of different roots that still map to the same egg are errors.
+#   files unchanged since the last run (size, mtime or content hash in
+#   the manifest of output_dir) are skipped unless force is set.
+#   report is called with the result of each file as it is done.
+def convert_batch(patterns, output_dir, precision=6, workers=None, force=False, report=None):
+    manifest_file = os.path.join(output_dir, MANIFEST)
+    try:
+        with open(manifest_file, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    results = []
+    def done(result):
+        results.append(result)
+        if report:
+            report(result)
+
+    jobs = []
+    names = {}
+    for root, file in find_inputs(patterns):
+        name = os.path.relpath(file, root) + '.egg'
+        egg_file = os.path.join(output_dir, name)
+
+        if name in names:
+            done({'file': file, 'egg': egg_file, 'status': 'error', 'time': 0.0,
+                  'error': 'ValueError: %s is also the output of %s' % (name, names[name])})
+            continue
+        names[name] = file
+
+        entry = manifest.get(name)
+        if not force and entry and is_unchanged(file, egg_file, entry, precision):
+            done(dict(entry, egg=egg_file, status='skip', time=0.0))
+            continue
+
+        manifest.pop(name, None)
+        jobs.append((file, egg_file, precision))
+
+    def finish(result):
+        if result['status'] == 'convert':
+            name = os.path.relpath(result['egg'], output_dir)
+            manifest[name] = {
+                'file': result['file'],
+                'size': result['size'],
+                'mtime': result['mtime'],
+                'hash': result['hash'],
+                'eggSize': result['eggSize'],
+                'precision': precision
+            }
+        done(result)
+
+    try:
+        if workers == 1 or len(jobs) <= 1:
+            for job in jobs:
+                finish(convert_job(job))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [ executor.submit(convert_job, job) for job in jobs ]
+                for future in concurrent.futures.as_completed(futures):
+                    finish(future.result())
+    finally:
+        # kept also when interrupted, the finished files are not converted again
+        os.makedirs(output_dir, exist_ok=True)
+        cache.write_json(manifest_file, manifest)
+
+    return results
+
+def is_unchanged(file, egg_file, entry, precision):
+    if entry.get('precision') != precision or not os.path.exists(egg_file):
+        return False
+    return cache.file_unchanged(file, entry)
 
 
 '''
@@ -0,0 +1,269 @@
+import numpy as np
+
+from . import loader
+from . import quaternion
+from . import skeleton
+
+
+# a chain is solved when the effector is this close to the ik bone
+TOLERANCE = 1e-4
+
+# pmd links of knee bones (ひざ) bend only backwards around x
+KNEE_LIMITS = ((-np.pi, 0.0, 0.0), (-0.5 * np.pi / 180, 0.0, 0.0))
+
+# axes of the plane of rotation around x, y and z
+PLANES = ((1, 2), (2, 0), (0, 1))
+
+
+# ccd ik of the chains of a model on a skeleton.Skeleton.
+# the chains are compiled once into arrays and solved for a whole batch of
+# poses at a time, after the forward kinematics of the stage of their ik bone.
+# the solution is kept as state.ikRotations on top of the motion rotations.
+class IKSolver(object):
+    def __init__(self, model, sk):
+        self.skeleton = sk
+        self.chains = []
+
+        if model.metadata.format == 'pmd':
+            for ik in model.iks:
+                links = [ link.index for link in ik.links ]
+                limits = [ KNEE_LIMITS if 'ひざ' in sk.names[i] else None for i in links ]
+                # the pmd angle unit is a quarter of the angle per step
+                self.add_chain(ik.target, ik.effector, links, limits, ik.iteration, ik.maxAngle * 4)
+        else:
+            for i, bone in enumerate(model.bones):
+                ik = bone.get('ik')
+                if not ik:
+                    continue
+
+                links = [ link.index for link in ik.links ]
+                limits = [
+                    (link.lowerLimitationAngle, link.upperLimitationAngle) if link.angleLimitation else None
+                    for link in ik.links
+                ]
+                self.add_chain(i, ik.effector, links, limits, ik.iteration, ik.maxAngle)
+
+        # chains by the stage of their ik bone, in bone order.
+        # bones of other stages moved by a chain are left to their stage.
+        self.stages = {}
+        for stage in sk.stages:
+            chains = [ chain for chain in self.chains if chain.goal in stage.bones ]
+            for chain in chains:
+                bones = np.intersect1d(chain.moved, stage.bones)
+                chain.levels = skeleton.group_by(bones, sk.depths[bones])
+            self.stages[(stage.afterPhysics, stage.layer)] = chains
+
+        # grants of the stage taken from the chain links are evaluated
+        # before the ik, they are run again after it with the bones below
+        self.regrants = {}
+        for stage in sk.stages:
+            chains = self.stages[(stage.afterPhysics, stage.layer)]
+            if chains:
+                regrant = self.compile_regrant(stage, np.concatenate([ chain.links for chain in chains ]))
+                if regrant:
+                    self.regrants[(stage.afterPhysics, stage.layer)] = regrant
+
+    def __len__(self):
+        return len(self.chains)
+
+    # chain arrays:
+    #   path: bones from the farthest link down to the effector
+    #   links: link bones from the effector side, steps: their place in path
+    #   lower, upper: angle limits (L, 3), axes: the only limited axis or -1
+    #   moved: bones moved by the chain, levels: those of its stage by tree depth
+    def add_chain(self, goal, effector, links, limits, iteration, max_angle):
+        sk = self.skeleton
+        count = len(sk)
+        if not (0 <= goal < count and 0 <= effector < count) or not links:
+            return
+        if any([ not 0 <= link < count for link in links ]):
+            return
+
+        # the links have to be ancestors of the effector
+        path = [effector]
+        while path[-1] != links[-1] and sk.parents[path[-1]] >= 0 and len(path) <= count:
+            path.append(sk.parents[path[-1]])
+        if path[-1] != links[-1] or any([ link not in path for link in links ]):
+            return
+        path.reverse()
+
+        chain = loader.ddict()
+        chain.goal = goal
+        chain.effector = effector
+        chain.iteration = iteration
+        chain.maxAngle = max_angle
+        chain.path = np.array(path, np.int64)
+        chain.links = np.array(links, np.int64)
+        chain.steps = [ path.index(link) for link in links ]
+
+        chain.limited = np.array([ limit is not None for limit in limits ])
+        chain.lower = np.zeros((len(links), 3), np.float32)
+        chain.upper = np.zeros((len(links), 3), np.float32)
+        chain.axes = np.full(len(links), -1, np.int64)
+        for k, limit in enumerate(limits):
+            if limit is None:
+                continue
+            chain.lower[k] = limit[0]
+            chain.upper[k] = limit[1]
+            ranges = np.flatnonzero(chain.upper[k] - chain.lower[k])
+            if len(ranges) == 1 and not np.any(np.delete(chain.lower[k], ranges)):
+                chain.axes[k] = ranges[0]
+
+        moved = np.zeros(count, bool)
+        moved[path[0]] = True
+        for bone in np.argsort(sk.depths, kind='stable'):
+            if sk.parents[bone] >= 0 and moved[sk.parents[bone]]:
+                moved[bone] = True
+        chain.moved = np.flatnonzero(moved)
+
+        self.chains.append(chain)
+
+    # grant bones of stage following links through their grant parents,
+    #   grants: them by grant depth, bones / levels: them and the bones
+    #   of the stage below them, levels by tree depth
+    def compile_regrant(self, stage, links):
+        sk = self.skeleton
+        following = np.zeros(len(sk), bool)
+        following[links] = True
+        granted = np.zeros(len(sk), bool)
+        for bone in np.argsort(sk.grantDepths, kind='stable'):
+            parent = sk.grantParents[bone]
+            if parent >= 0 and following[parent]:
+                following[bone] = True
+                granted[bone] = True
+
+        inside = np.zeros(len(sk), bool)
+        inside[stage.bones] = True
+        granted &= inside
+        if not np.any(granted):
+            return None
+
+        moved = granted.copy()
+        for bone in np.argsort(sk.depths, kind='stable'):
+            if sk.parents[bone] >= 0 and moved[sk.parents[bone]]:
+                moved[bone] = True
+        moved &= inside
+
+        regrant = loader.ddict()
+        bones = np.flatnonzero(granted)
+        regrant.grants = skeleton.group_by(bones, sk.grantDepths[bones])
+        regrant.bones = bones
+        bones = np.flatnonzero(moved)
+        regrant.levels = skeleton.group_by(bones, sk.depths[bones])
+        return regrant
+
+    # solve the chains of stage on state of skeleton.Skeleton.pose,
+    # the globals of the bones they move are updated
+    def solve(self, state, stage):
+        key = (stage.afterPhysics, stage.layer)
+        for chain in self.stages.get(key, []):
+            self.solve_chain(state, chain)
+
+            self.skeleton.update_locals(state, chain.links)
+            for bones in chain.levels:
+                self.skeleton.update_globals(state, bones)
+
+        regrant = self.regrants.get(key)
+        if regrant:
+            for bones in regrant.grants:
+                self.skeleton.update_grants(state, bones)
+            self.skeleton.update_locals(state, regrant.bones)
+            for bones in regrant.levels:
+                self.skeleton.update_globals(state, bones)
+
+    def solve_chain(self, state, chain):
+        links = chain.links
+        # rotations of the links apart from the ik, (P, L, 4)
+        base = quaternion.multiply(state.rotations[:, links], state.grantRotations[:, links])
+        local = quaternion.multiply(state.ikRotations[:, links], base)
+
+        goal = state.globals[:, chain.goal, :3, 3]
+        for i in range(chain.iteration):
+            if self.reached(state, chain, goal):
+                break
+
+            for k, link in enumerate(links):
+                g = state.globals[:, link]
+                effector = state.globals[:, chain.effector, :3, 3]
+
+                # effector and goal seen from the link
+                r = g[:, :3, :3]
+                e = np.einsum('pji,pj->pi', r, effector - g[:, :3, 3])
+                t = np.einsum('pji,pj->pi', r, goal - g[:, :3, 3])
+
+                if chain.axes[k] >= 0:
+                    q = self.rotate_axis(local[:, k], e, t, chain, k)
+                else:
+                    q = quaternion.multiply(local[:, k], self.rotation_between(e, t, chain.maxAngle))
+                    if chain.limited[k]:
+                        q = limit_euler(q, chain.lower[k], chain.upper[k])
+
+                local[:, k] = q
+                state.locals[:, link, :3, :3] = quaternion.to_matrix(q)
+                self.update_path(state, chain.path[chain.steps[k]:])
+
+        state.ikRotations[:, links] = quaternion.multiply(local, conjugate(base))
+
+    def reached(self, state, chain, goal):
+        distance = np.linalg.norm(state.globals[:, chain.effector, :3, 3] - goal, axis=-1)
+        return np.all(distance < TOLERANCE)
+
+    # rotation (P, 4) turning direction e to t, by max_angle at most
+    def rotation_between(self, e, t, max_angle):
+        e = quaternion.normalize(e)
+        t = quaternion.normalize(t)
+        axis = np.cross(e, t)
+        sin = np.linalg.norm(axis, axis=-1, keepdims=True)
+        angle = np.arctan2(sin, np.sum(e * t, axis=-1, keepdims=True))
+        angle = np.minimum(angle, max_angle)
+
+        # parallel directions do not rotate
+        axis = np.where(sin > 1e-8, axis / np.maximum(sin, 1e-8), 0.0)
+        return np.concatenate([axis * np.sin(angle * 0.5), np.cos(angle * 0.5)], axis=-1)
+
+    # link limited to one axis (a knee): e and t are projected on the plane of
+    # the axis and the angle around it is kept inside the limits
+    def rotate_axis(self, q, e, t, chain, k):
+        axis = chain.axes[k]
+        u, v = PLANES[axis]
+        delta = np.arctan2(e[:, u] * t[:, v] - e[:, v] * t[:, u], e[:, u] * t[:, u] + e[:, v] * t[:, v])
+        delta = np.minimum(np.maximum(delta, -chain.maxAngle), chain.maxAngle)
+
+        current = 2 * np.arctan2(q[:, axis], q[:, 3])
+        current = (current + np.pi) % (2 * np.pi) - np.pi
+        angle = np.minimum(np.maximum(current + delta, chain.lower[k, axis]), chain.upper[k, axis])
+
+        result = np.zeros(q.shape, np.float32)
+        result[:, axis] = np.sin(angle * 0.5)
+        result[:, 3] = np.cos(angle * 0.5)
+        return result
+
+    # globals of the bones of path from their parents, in order
+    def update_path(self, state, path):
+        for bone in path:
+            parent = self.skeleton.parents[bone]
+            if parent < 0:
+                state.globals[:, bone] = state.locals[:, bone]
+            else:
+                state.globals[:, bone] = state.globals[:, parent] @ state.locals[:, bone]
+
+
+def conjugate(q):
+    return q * np.array([-1, -1, -1, 1], np.float32)
+
+# rotations q (..., 4) with the euler angles (x, y, z) clamped to the
+# limits, q = rx * ry * rz
+def limit_euler(q, lower, upper):
+    m = quaternion.to_matrix(q)
+    x = np.arctan2(-m[..., 1, 2], m[..., 2, 2])
+    y = np.arcsin(np.minimum(np.maximum(m[..., 0, 2], -1.0), 1.0))
+    z = np.arctan2(-m[..., 0, 1], m[..., 0, 0])
+
+    angles = np.stack([x, y, z], axis=-1)
+    angles = np.minimum(np.maximum(angles, lower), upper) * 0.5
+
+    half = np.zeros(angles.shape[:-1] + (3, 4), np.float32)
+    for i in range(3):
+        half[..., i, i] = np.sin(angles[..., i])
+        half[..., i, 3] = np.cos(angles[..., i])
+    return quaternion.multiply(quaternion.multiply(half[..., 0, :], half[..., 1, :]), half[..., 2, :])
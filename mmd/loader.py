@@ -1,100 +1,307 @@
-import io
+import concurrent.futures
+import mmap
 import os
 import struct
 
+import numpy as np
+
 class ddict(dict): 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.__dict__ = self
 
+    # rebuild through __init__ so that __dict__ is the dict itself again
+    def __reduce__(self):
+        return (self.__class__, (), None, None, iter(self.items()))
+
+# compact record with a fixed set of attributes (__slots__) used for the
+# parsed entities. attributes not present in the file are left unset.
+# attributes can also be read like the items of a ddict.
+class Entity(object):
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def keys(self):
+        return [ name for name in self.__slots__ if hasattr(self, name) ]
+
+    def items(self):
+        return [ (name, getattr(self, name)) for name in self.keys() ]
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return hasattr(self, name)
+
+    def __eq__(self, other):
+        if isinstance(other, (Entity, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join([ '%s=%r' % item for item in self.items() ]))
+
+
+class Vertex(Entity):
+    __slots__ = (
+        'position', 'normal', 'uv', 'auvs', 'type',
+        'skinIndices', 'skinWeights', 'skinC', 'skinR0', 'skinR1',
+        'edgeRatio', 'edgeFlag'
+    )
+
+class Face(Entity):
+    __slots__ = ('indices',)
+
+class Material(Entity):
+    __slots__ = (
+        'name', 'englishName', 'diffuse', 'specular', 'shininess', 'ambient',
+        'flag', 'edgeColor', 'edgeSize', 'textureIndex', 'envTextureIndex',
+        'envFlag', 'toonFlag', 'toonIndex', 'edgeFlag', 'comment',
+        'faceCount', 'fileName'
+    )
+
+class Bone(Entity):
+    __slots__ = (
+        'name', 'englishName', 'position', 'parentIndex', 'tailIndex',
+        'type', 'ikIndex', 'transformationClass', 'flag', 'connectIndex',
+        'offsetPosition', 'grant', 'fixAxis', 'localXVector', 'localZVector',
+        'key', 'ik'
+    )
+
+class Grant(Entity):
+    __slots__ = ('isLocal', 'affectRotation', 'affectPosition', 'parentIndex', 'ratio')
+
+class IK(Entity):
+    __slots__ = ('target', 'effector', 'linkCount', 'iteration', 'maxAngle', 'links')
+
+class IKLink(Entity):
+    __slots__ = ('index', 'angleLimitation', 'lowerLimitationAngle', 'upperLimitationAngle')
+
+class Morph(Entity):
+    __slots__ = ('name', 'englishName', 'panel', 'type', 'elementCount', 'elements')
+
+class MorphElement(Entity):
+    __slots__ = (
+        'index', 'ratio', 'position', 'rotation', 'uv', 'type',
+        'diffuse', 'specular', 'shininess', 'ambient', 'edgeColor', 'edgeSize',
+        'textureColor', 'sphereTextureColor', 'toonColor',
+        'isLocal', 'velocity', 'torque'
+    )
+
+class RigidBody(Entity):
+    __slots__ = (
+        'name', 'englishName', 'boneIndex', 'groupIndex', 'groupTarget',
+        'shapeType', 'width', 'height', 'depth', 'position', 'rotation',
+        'weight', 'positionDamping', 'rotationDamping', 'restitution',
+        'friction', 'type'
+    )
+
+class Constraint(Entity):
+    __slots__ = (
+        'name', 'englishName', 'type', 'rigidBodyIndex1', 'rigidBodyIndex2',
+        'position', 'rotation', 'translationLimitation1',
+        'translationLimitation2', 'rotationLimitation1', 'rotationLimitation2',
+        'springPosition', 'springRotation'
+    )
+
+class MotionKeyframe(Entity):
+    __slots__ = ('boneName', 'frameNum', 'position', 'rotation', 'interpolation')
+
+class MorphKeyframe(Entity):
+    __slots__ = ('morphName', 'frameNum', 'weight')
+
+class CameraKeyframe(Entity):
+    __slots__ = (
+        'frameNum', 'distance', 'position', 'rotation', 'interpolation',
+        'fov', 'perspective'
+    )
+
+
+# model whose sections are parsed when they are first accessed.
+# get and in see the sections not parsed yet, iterating the model
+# parses all of them.
+class LazyModel(ddict):
+    __slots__ = ('sections',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sections = {}
+
+    def defer(self, name, dv, parse):
+        self.sections[name] = (dv, dv.offset, parse)
+
+    def __missing__(self, name):
+        if name not in self.sections:
+            raise KeyError(name)
+
+        dv, offset, parse = self.sections.pop(name)
+        dv.seek(offset)
+        parse()
+        return dict.__getitem__(self, name)
+
+    def __getattr__(self, name):
+        if name == 'sections':
+            raise AttributeError(name)
+
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.sections
+
+    def __len__(self):
+        return dict.__len__(self) + len(self.sections)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return dict.keys(self.resolve())
+
+    def values(self):
+        return dict.values(self.resolve())
+
+    def items(self):
+        return dict.items(self.resolve())
+
+    # a pickled lazy model is fully parsed, the mapped file is not kept
+    def __reduce__(self):
+        self.resolve()
+        return super().__reduce__()
+
+    # parse every remaining section
+    def resolve(self):
+        for name in list(self.sections):
+            self[name]
+        return self
+
+INT8 = struct.Struct('<b')
+UINT8 = struct.Struct('<B')
+INT16 = struct.Struct('<h')
+UINT16 = struct.Struct('<H')
+INT32 = struct.Struct('<i')
+UINT32 = struct.Struct('<I')
+FLOAT32 = struct.Struct('<f')
+FLOAT64 = struct.Struct('<d')
+
+# reads values straight out of a bytes-like buffer (bytes, mmap, ...)
+# at an integer cursor, without copying the data
 class DataView(object):
     def __init__(self, data):
-        self.length = len(data)
-        self.buffer = io.BytesIO(data)
+        self.data = data
+        self.buffer = memoryview(data)
+        self.offset = 0
+
+    @classmethod
+    def from_file(cls, file):
+        with open(file, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # empty file can not be mapped
+                data = b''
+
+        return cls(data)
+
+    def close(self):
+        # arrays returned by get_records may still refer to the buffer.
+        # in that case the mapping is released when they are collected.
+        try:
+            self.buffer.release()
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
+        except BufferError:
+            pass
+
+    @property
+    def length(self):
+        return len(self.buffer) - self.offset
 
     def read(self, size):
-        self.length -= size
-        return self.buffer.read(size)
+        if size > self.length:
+            raise ValueError('read %d bytes over the end of data.' % (size))
+
+        v = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return v
+
+    def unpack(self, st):
+        v = st.unpack_from(self.buffer, self.offset)
+        self.offset += st.size
+        return v
+
+    def unpack_array(self, type, size):
+        st = struct.Struct('<%d%s' % (size, type))
+        return list(self.unpack(st))
 
     def get_int8(self):
-        v = struct.unpack_from('b', self.read(1))
-        return v[0]
+        return self.unpack(INT8)[0]
 
     def get_int8_array(self, size):
-        a = []
-        for i in range(size):
-            a.append(self.get_int8())
-        return a
+        return self.unpack_array('b', size)
 
     def get_uint8(self):
-        v = struct.unpack_from('B', self.read(1))
-        return v[0]
+        return self.unpack(UINT8)[0]
 
     def get_uint8_array(self, size):
-        a = []
-        for i in range(size):
-            a.append(self.get_uint8())
-        return a
+        return self.unpack_array('B', size)
 
     def get_int16(self):
-        v = struct.unpack_from('h', self.read(2))
-        return v[0]
+        return self.unpack(INT16)[0]
 
     def get_int16_array(self, size):
-        a = []
-        for i in range(size):
-            a.append(self.get_int16())
-        return a
+        return self.unpack_array('h', size)
 
     def get_uint16(self):
-        v = struct.unpack_from('H', self.read(2))
-        return v[0]
+        return self.unpack(UINT16)[0]
 
     def get_uint16_array(self, size):
-        a = []
-        for i in range(size):
-            a.append(self.get_uint16())
-        return a
+        return self.unpack_array('H', size)
 
     def get_int32(self):
-        v = struct.unpack_from('i', self.read(4))
-        return v[0]
+        return self.unpack(INT32)[0]
 
     def get_int32_array(self, size):
-        a = []
-        for i in range(size):
-            a.append(self.get_int32())
-        return a
+        return self.unpack_array('i', size)
 
     def get_uint32(self):
-        v = struct.unpack_from('I', self.read(4))
-        return v[0]
+        return self.unpack(UINT32)[0]
 
     def get_uint32_array(self, size):
-        a = []
-        for i in range(size):
-            a.append(self.get_uint32())
-        return a
+        return self.unpack_array('I', size)
 
     def get_float32(self):
-        v = struct.unpack_from('f', self.read(4))
-        return v[0]
+        return self.unpack(FLOAT32)[0]
 
     def get_float32_array(self, size):
-        a = []
-        for i in range(size):
-            a.append(self.get_float32())
-        return a
+        return self.unpack_array('f', size)
 
     def get_float64(self):
-        v = struct.unpack_from('d', self.read(8))
-        return v[0]
+        return self.unpack(FLOAT64)[0]
 
     def get_float64_array(self, size):
-        a = []
-        for i in range(size):
-            a.append(self.get_float64())
-        return a
+        return self.unpack_array('d', size)
 
     def get_index(self, itype, unsigned=False):
         if itype ==1:
@@ -105,7 +312,7 @@ class DataView(object):
             if unsigned:
                 return self.get_uint16()
             return self.get_int16()
-        elif itype ==3:
+        elif itype ==4:
             return self.get_int32()
         
         raise KeyError('unknown number type %d exception.!' % itype)
@@ -117,47 +324,22 @@ class DataView(object):
         return a
 
     def get_chars(self, size):
-        str = ''
-        while (size > 0):
-            value = self.get_uint8()
-            size -= 1
-            if not value:
-                break
-            str += chr(value)
-
-        while (size > 0):
-            self.get_uint8()
-            size -= 1
-        
-        return str
+        chars = bytes(self.read(size))
+        return chars.split(b'\0', 1)[0].decode('latin-1')
 
     def get_sjis_strings(self, size):
-        chars = b''
-        while (size > 0):
-            value = self.get_uint8()
-            size -= 1
-            if not value:
-                break
-            chars += value.to_bytes(1, 'little')
-
-        while (size > 0):
-            self.get_uint8()
-            size -= 1
-
-        return chars.decode('cp932')
+        return decode_sjis(bytes(self.read(size)))
 
     def get_unicode_strings(self, size):
-        chars = b''
-        while (size > 0):
-            value = self.get_uint16()
-            size -= 2
-            if not value:
-                break
-            chars += value.to_bytes(2, 'little')
-
-        while (size > 0):
-            self.get_uint8()
-            size -= 1
+        chars = bytes(self.read(size))
+        end = chars.find(b'\0\0')
+        while end >= 0 and end % 2:
+            end = chars.find(b'\0\0', end + 1)
+
+        if end >= 0:
+            chars = chars[:end]
+        elif len(chars) % 2:
+            chars = chars[:-1]
 
         return chars.decode('utf-16')
 
@@ -165,13 +347,276 @@ class DataView(object):
         size = self.get_uint32()
         return self.get_unicode_strings(size)
 
+    def get_record(self, record):
+        return record.make(self.unpack(record.struct))
+
+    def get_record_array(self, record, count):
+        data = self.read(record.size * count)
+        return [ record.make(v) for v in record.struct.iter_unpack(data) ]
+
+    def get_records(self, dtype, count):
+        dtype = np.dtype(dtype)
+        self.read(dtype.itemsize * count)
+        return np.frombuffer(self.buffer, dtype, count, self.offset - dtype.itemsize * count)
+
+    def peek(self):
+        # 読み込み位置を進めずに残りのデータを参照する
+        return self.buffer[self.offset:]
+
+    def skip(self, size):
+        self.read(size)
+
+    def seek(self, offset):
+        self.offset = offset
+
     def is_empty(self):
         return self.length == 0
 
 
+# fixed layout record declared once and decoded with a single struct
+#   cls: class of the decoded records (an Entity subclass or ddict)
+#   fields: (name, format) or (name, format, count)
+#   format 'sjis' is a zero terminated cp932 string of count bytes,
+#   format 'bytes' keeps count bytes as they are
+class Record(object):
+    def __init__(self, cls, *fields):
+        self.cls = cls
+        self.fields = []
+        format = '<'
+        pos = 0
+        for field in fields:
+            name, type = field[0], field[1]
+            count = field[2] if len(field) > 2 else 1
+
+            if type == 'sjis':
+                format += '%ds' % count
+                self.fields.append((name, pos, None, decode_sjis))
+                pos += 1
+            elif type == 'bytes':
+                format += '%ds' % count
+                self.fields.append((name, pos, None, None))
+                pos += 1
+            elif count == 1:
+                format += type
+                self.fields.append((name, pos, None, None))
+                pos += 1
+            else:
+                format += '%d%s' % (count, type)
+                self.fields.append((name, pos, pos + count, None))
+                pos += count
+
+        self.struct = struct.Struct(format)
+        self.size = self.struct.size
+
+    def make(self, values):
+        p = self.cls()
+        for name, start, end, decode in self.fields:
+            if end is not None:
+                setattr(p, name, list(values[start:end]))
+            elif decode:
+                setattr(p, name, decode(values[start]))
+            else:
+                setattr(p, name, values[start])
+        return p
+
+
+def decode_sjis(chars):
+    return chars.split(b'\0', 1)[0].decode('cp932')
+
+
+def index_format(size, unsigned=False):
+    if size == 1:
+        return 'B' if unsigned else 'b'
+    elif size == 2:
+        return 'H' if unsigned else 'h'
+    elif size == 4:
+        return 'i'
+
+    raise KeyError('unknown number type %d exception.!' % size)
+
+
+# records held as contiguous arrays, indexing and iteration give a
+# ddict per record on top of them
+class ArrayRecords(object):
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('record index out of range')
+
+        return self.record(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.record(i)
+
+
+class VertexArrays(ArrayRecords):
+    # bone weight count for each pmx skinning type (BDEF1, BDEF2, BDEF4, SDEF)
+    SKIN_COUNTS = (1, 2, 4, 2)
+
+    def __init__(self, format, **arrays):
+        self.format = format
+        self.__dict__.update(arrays)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def record(self, i):
+        p = Vertex()
+        p.position = self.positions[i].tolist()
+        p.normal = self.normals[i].tolist()
+        p.uv = self.uvs[i].tolist()
+
+        if self.format == 'pmd':
+            p.skinIndices = self.skinIndices[i].tolist()
+            p.skinWeights = self.skinWeights[i].tolist()
+            p.edgeFlag = int(self.edgeFlags[i])
+            return p
+
+        p.auvs = self.auvs[i].tolist()
+        p.type = int(self.types[i])
+        count = self.SKIN_COUNTS[p.type]
+        p.skinIndices = self.skinIndices[i, :count].tolist()
+        p.skinWeights = self.skinWeights[i, :count].tolist()
+
+        if p.type == 3:
+            p.skinC = self.skinC[i].tolist()
+            p.skinR0 = self.skinR0[i].tolist()
+            p.skinR1 = self.skinR1[i].tolist()
+
+        p.edgeRatio = float(self.edgeRatios[i])
+        return p
+
+
+class FaceArrays(ArrayRecords):
+    def __init__(self, indices):
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def record(self, i):
+        p = Face()
+        p.indices = self.indices[i].tolist()
+        return p
+
+
+# pmd vertex record (38 bytes)
+PMD_VERTEX = np.dtype([
+    ('position', '<f4', 3),
+    ('normal', '<f4', 3),
+    ('uv', '<f4', 2),
+    ('skinIndices', '<u2', 2),
+    ('skinWeight', 'u1'),
+    ('edgeFlag', 'u1')
+])
+
+PMD_FACE_INDEX = np.dtype('<u2')
+
+PMD_MATERIAL = Record(
+    Material,
+    ('diffuse', 'f', 4),
+    ('shininess', 'f'),
+    ('specular', 'f', 3),
+    ('ambient', 'f', 3),
+    ('toonIndex', 'b'),
+    ('edgeFlag', 'B'),
+    ('faceCount', 'I'),
+    ('fileName', 'sjis', 20)
+)
+
+PMD_BONE = Record(
+    Bone,
+    ('name', 'sjis', 20),
+    ('parentIndex', 'h'),
+    ('tailIndex', 'h'),
+    ('type', 'B'),
+    ('ikIndex', 'h'),
+    ('position', 'f', 3)
+)
+
+PMD_IK = Record(
+    IK,
+    ('target', 'H'),
+    ('effector', 'H'),
+    ('linkCount', 'B'),
+    ('iteration', 'H'),
+    ('maxAngle', 'f')
+)
+
+PMD_IK_LINK = Record(IKLink, ('index', 'H'))
+
+PMD_MORPH = Record(
+    Morph,
+    ('name', 'sjis', 20),
+    ('elementCount', 'I'),
+    ('type', 'B')
+)
+
+PMD_MORPH_ELEMENT = Record(
+    MorphElement,
+    ('index', 'I'),
+    ('position', 'f', 3)
+)
+
+PMD_MORPH_FRAME = Record(ddict, ('index', 'H'))
+
+PMD_BONE_FRAME = Record(
+    ddict,
+    ('boneIndex', 'h'),
+    ('frameIndex', 'B')
+)
+
+PMD_NAME = Record(ddict, ('name', 'sjis', 20))
+
+PMD_FRAME_NAME = Record(ddict, ('name', 'sjis', 50))
+
+PMD_TOON_TEXTURE = Record(ddict, ('fileName', 'sjis', 100))
+
+PMD_RIGID_BODY = Record(
+    RigidBody,
+    ('name', 'sjis', 20),
+    ('boneIndex', 'h'),
+    ('groupIndex', 'B'),
+    ('groupTarget', 'H'),
+    ('shapeType', 'B'),
+    ('width', 'f'),
+    ('height', 'f'),
+    ('depth', 'f'),
+    ('position', 'f', 3),
+    ('rotation', 'f', 3),
+    ('weight', 'f'),
+    ('positionDamping', 'f'),
+    ('rotationDamping', 'f'),
+    ('restitution', 'f'),
+    ('friction', 'f'),
+    ('type', 'B')
+)
+
+PMD_CONSTRAINT = Record(
+    Constraint,
+    ('name', 'sjis', 20),
+    ('rigidBodyIndex1', 'I'),
+    ('rigidBodyIndex2', 'I'),
+    ('position', 'f', 3),
+    ('rotation', 'f', 3),
+    ('translationLimitation1', 'f', 3),
+    ('translationLimitation2', 'f', 3),
+    ('rotationLimitation1', 'f', 3),
+    ('rotationLimitation2', 'f', 3),
+    ('springPosition', 'f', 3),
+    ('springRotation', 'f', 3)
+)
+
 # parse pmd format file
-def parse_pmd(dv):
-    pmd = ddict()
+#   lazy: sections are only located here and parsed when first accessed
+#   header_only: only the header and the section counts are read
+def parse_pmd(dv, lazy=False, header_only=False):
+    pmd = LazyModel() if lazy else ddict()
     metadata = ddict()
     pmd.metadata = metadata
     pmd.metadata.format = 'pmd'
@@ -190,83 +635,44 @@ def parse_pmd(dv):
 
     
     def parse_vertices():
-        def parse_vertex():
-            p = ddict()
-            p.position = dv.get_float32_array(3)
-            p.normal = dv.get_float32_array(3)
-            p.uv = dv.get_float32_array(2)
-            p.skinIndices = dv.get_uint16_array(2)
-            p.skinWeights = [ dv.get_uint8() / 100 ]
-            p.skinWeights.append( 1.0 - p.skinWeights[0] )
-            p.edgeFlag = dv.get_uint8()
-            return p
-        
         metadata.vertexCount = dv.get_uint32()
-        pmd.vertices = []
-        for i in range(metadata.vertexCount):
-            pmd.vertices.append( parse_vertex() )
+        records = dv.get_records(PMD_VERTEX, metadata.vertexCount)
+
+        skinWeights = np.empty((metadata.vertexCount, 2), np.float32)
+        skinWeights[:, 0] = records['skinWeight'] / 100
+        skinWeights[:, 1] = 1.0 - skinWeights[:, 0]
+
+        pmd.vertices = VertexArrays(
+            'pmd',
+            positions=np.ascontiguousarray(records['position']),
+            normals=np.ascontiguousarray(records['normal']),
+            uvs=np.ascontiguousarray(records['uv']),
+            skinIndices=np.ascontiguousarray(records['skinIndices']),
+            skinWeights=skinWeights,
+            edgeFlags=np.ascontiguousarray(records['edgeFlag'])
+        )
         
     
     def parse_faces():
-        def parse_face():
-            p = ddict()
-            p.indices = dv.get_uint16_array(3)
-            return p
-        
         metadata.faceCount = int(dv.get_uint32() / 3)
-        pmd.faces = []
-        for i in range(metadata.faceCount):
-            pmd.faces.append( parse_face() )
+        indices = dv.get_records(PMD_FACE_INDEX, metadata.faceCount * 3)
+        pmd.faces = FaceArrays(indices.reshape(-1, 3).copy())
 
     def parse_materials():
-        def parse_material():
-            p = ddict()
-            p.diffuse = dv.get_float32_array(4)
-            p.shininess = dv.get_float32()
-            p.specular = dv.get_float32_array(3)
-            p.ambient = dv.get_float32_array(3)
-            p.toonIndex = dv.get_int8()
-            p.edgeFlag = dv.get_uint8()
-            p.faceCount = int(dv.get_uint32() / 3)
-            p.fileName = dv.get_sjis_strings(20)
-            return p
-
         metadata.materialCount = dv.get_uint32()
-        pmd.materials = []
-        for i in range(metadata.materialCount):
-            pmd.materials.append( parse_material() )
+        pmd.materials = dv.get_record_array(PMD_MATERIAL, metadata.materialCount)
+        for p in pmd.materials:
+            p.faceCount = int(p.faceCount / 3)
 
     def parse_bones():
-        def parse_bone():
-            p = ddict()
-            p.name = dv.get_sjis_strings(20)
-            p.parentIndex = dv.get_int16()
-            p.tailIndex = dv.get_int16()
-            p.type = dv.get_uint8()
-            p.ikIndex = dv.get_int16()
-            p.position = dv.get_float32_array(3)
-            return p
-
         metadata.boneCount = dv.get_uint16()
-        pmd.bones = []
-        for i in range(metadata.boneCount):
-            pmd.bones.append( parse_bone() )
+        pmd.bones = dv.get_record_array(PMD_BONE, metadata.boneCount)
 
 
     def parse_iks():
         def parse_ik():
-            p = ddict()
-            p.target = dv.get_uint16()
-            p.effector = dv.get_uint16()
-            p.linkCount = dv.get_uint8()
-            p.iteration = dv.get_uint16()
-            p.maxAngle = dv.get_float32()
-
-            p.links = []
-            for i in range(p.linkCount):
-                link = ddict()
-                link.index = dv.get_uint16()
-                p.links.append(link)
+            p = dv.get_record(PMD_IK)
+            p.links = dv.get_record_array(PMD_IK_LINK, p.linkCount)
             return p
 
         metadata.ikCount = dv.get_uint16()
@@ -277,18 +683,8 @@ def parse_pmd(dv):
 
     def parse_morphs():
         def parse_morph():
-            p = ddict()
-            p.name = dv.get_sjis_strings(20)
-            p.elementCount = dv.get_uint32()
-            p.type = dv.get_uint8()
-
-            p.elements = []
-            for i in range(p.elementCount):
-                p.elements.append( ddict({
-                    'index': dv.get_uint32(),
-                    'position': dv.get_float32_array(3)
-                }) )
-
+            p = dv.get_record(PMD_MORPH)
+            p.elements = dv.get_record_array(PMD_MORPH_ELEMENT, p.elementCount)
             return p
 
         metadata.morphCount = dv.get_uint16()
@@ -298,40 +694,18 @@ def parse_pmd(dv):
 
 
     def parse_morph_frames():
-        def parse_morph_frame():
-            p = ddict()
-            p.index = dv.get_uint16()
-            return p
-
         metadata.morphFrameCount = dv.get_uint8()
-        pmd.morphFrames = []
-        for i in range(metadata.morphFrameCount):
-            pmd.morphFrames.append( parse_morph_frame() )
+        pmd.morphFrames = dv.get_record_array(PMD_MORPH_FRAME, metadata.morphFrameCount)
 
 
     def parse_bone_frame_names():
-        def parse_bone_frame_name():
-            p = ddict()
-            p.name = dv.get_sjis_strings(50)
-            return p
-        
         metadata.boneFrameNameCount = dv.get_uint8()
-        pmd.boneFrameNames = []
-        for i in range(metadata.boneFrameNameCount):
-            pmd.boneFrameNames.append( parse_bone_frame_name() )
+        pmd.boneFrameNames = dv.get_record_array(PMD_FRAME_NAME, metadata.boneFrameNameCount)
 
 
     def parse_bone_frames():
-        def parse_bone_frame():
-            p = ddict()
-            p.boneIndex = dv.get_int16()
-            p.frameIndex = dv.get_uint8()
-            return p
-
         metadata.boneFrameCount = dv.get_uint32()
-        pmd.boneFrames = []
-        for i in range(metadata.boneFrameCount):
-            pmd.boneFrames.append( parse_bone_frame() )
+        pmd.boneFrames = dv.get_record_array(PMD_BONE_FRAME, metadata.boneFrameCount)
 
     def parse_english_header():
         if dv.is_empty():
@@ -344,146 +718,145 @@ def parse_pmd(dv):
             metadata.englishComment = dv.get_sjis_strings(256)
 
     def parse_english_bone_names():
-        def parse_english_bone_name():
-            p = ddict()
-            p.name = dv.get_sjis_strings(20)
-            return p
-
         if not metadata.englishCompatibility:
             return
 
-        pmd.englishBoneNames = []
-        for i in range(metadata.boneCount):
-            pmd.englishBoneNames.append( parse_english_bone_name() )
+        pmd.englishBoneNames = dv.get_record_array(PMD_NAME, metadata.boneCount)
 
     
     def parse_english_morph_names():
-        def parse_english_morph_name():
-            p = ddict()
-            p.name = dv.get_sjis_strings(20)
-            return p
-
         if not metadata.englishCompatibility:
             return
 
-        pmd.englishMorphNames = []
-        for i in range(metadata.morphCount-1):
-            pmd.englishMorphNames.append( parse_english_morph_name() )
+        pmd.englishMorphNames = dv.get_record_array(PMD_NAME, max(metadata.morphCount - 1, 0))
 
 
     def parse_english_bone_frame_names():
-        def parse_english_bone_frame_name():
-            p = ddict()
-            p.name = dv.get_sjis_strings(50)
-            return p
-
         if not metadata.englishCompatibility:
             return
 
-        pmd.englishBoneFrameNames = []
-        for i in range(metadata.boneFrameNameCount):
-            pmd.englishBoneFrameNames.append( parse_english_bone_frame_name() )
+        pmd.englishBoneFrameNames = dv.get_record_array(PMD_FRAME_NAME, metadata.boneFrameNameCount)
 
 
     def parse_toon_textures():
-        def parse_toon_texture():
-            p = ddict()
-            p.fileName = dv.get_sjis_strings(100)
-            return p
-
         if dv.is_empty():
             return
 
-        pmd.toonTextures = []
-        for i in range(10):
-            pmd.toonTextures.append( parse_toon_texture() )
+        pmd.toonTextures = dv.get_record_array(PMD_TOON_TEXTURE, 10)
 
 
     def parse_rigid_bodies():
-        def parse_rigid_body():
-            p = ddict()
-            p.name = dv.get_sjis_strings(20)
-            p.boneIndex = dv.get_int16()
-            p.groupIndex = dv.get_uint8()
-            p.groupTarget = dv.get_uint16()
-            p.shapeType = dv.get_uint8()
-            p.width = dv.get_float32()
-            p.height = dv.get_float32()
-            p.depth = dv.get_float32()
-            p.position = dv.get_float32_array(3)
-            p.rotation = dv.get_float32_array(3)
-            p.weight = dv.get_float32()
-            p.positionDamping = dv.get_float32()
-            p.rotationDamping = dv.get_float32()
-            p.restitution = dv.get_float32()
-            p.friction = dv.get_float32()
-            p.type = dv.get_uint8()
-            return p
-
         if dv.is_empty():
             return
 
         metadata.rigidBodyCount = dv.get_uint32()
-        pmd.rigidBodies = []
-        for i in range(metadata.rigidBodyCount):
-            pmd.rigidBodies.append( parse_rigid_body() )
+        pmd.rigidBodies = dv.get_record_array(PMD_RIGID_BODY, metadata.rigidBodyCount)
 
 
     def parse_constraints():
-        def parse_constraint():
-            p = ddict()
-            p.name = dv.get_sjis_strings(20)
-            p.rigidBodyIndex1 = dv.get_uint32()
-            p.rigidBodyIndex2 = dv.get_uint32()
-            p.position = dv.get_float32_array(3)
-            p.rotation = dv.get_float32_array(3)
-            p.translationLimitation1 = dv.get_float32_array(3)
-            p.translationLimitation2 = dv.get_float32_array(3)
-            p.rotationLimitation1 = dv.get_float32_array(3)
-            p.rotationLimitation2 = dv.get_float32_array(3)
-            p.springPosition = dv.get_float32_array(3)
-            p.springRotation = dv.get_float32_array(3)
-            return p
-
         if dv.is_empty():
             return
 
         metadata.constraintCount = dv.get_uint32()
-        pmd.constraints = []
-        for i in range(metadata.constraintCount):
-            pmd.constraints.append( parse_constraint() )
+        pmd.constraints = dv.get_record_array(PMD_CONSTRAINT, metadata.constraintCount)
+
+    # skip a section without decoding it, only its count is kept
+    def skip_vertices():
+        metadata.vertexCount = dv.get_uint32()
+        dv.skip(PMD_VERTEX.itemsize * metadata.vertexCount)
+
+    def skip_faces():
+        metadata.faceCount = int(dv.get_uint32() / 3)
+        dv.skip(PMD_FACE_INDEX.itemsize * 3 * metadata.faceCount)
+
+    def skip_materials():
+        metadata.materialCount = dv.get_uint32()
+        dv.skip(PMD_MATERIAL.size * metadata.materialCount)
+
+    def skip_bones():
+        metadata.boneCount = dv.get_uint16()
+        dv.skip(PMD_BONE.size * metadata.boneCount)
+
+    def skip_iks():
+        metadata.ikCount = dv.get_uint16()
+        for i in range(metadata.ikCount):
+            p = dv.get_record(PMD_IK)
+            dv.skip(PMD_IK_LINK.size * p.linkCount)
+
+    def skip_morphs():
+        metadata.morphCount = dv.get_uint16()
+        for i in range(metadata.morphCount):
+            p = dv.get_record(PMD_MORPH)
+            dv.skip(PMD_MORPH_ELEMENT.size * p.elementCount)
+
+    def skip_morph_frames():
+        metadata.morphFrameCount = dv.get_uint8()
+        dv.skip(PMD_MORPH_FRAME.size * metadata.morphFrameCount)
+
+    def skip_bone_frame_names():
+        metadata.boneFrameNameCount = dv.get_uint8()
+        dv.skip(PMD_FRAME_NAME.size * metadata.boneFrameNameCount)
+
+    def skip_bone_frames():
+        metadata.boneFrameCount = dv.get_uint32()
+        dv.skip(PMD_BONE_FRAME.size * metadata.boneFrameCount)
+
+    def skip_rigid_bodies():
+        metadata.rigidBodyCount = dv.get_uint32()
+        dv.skip(PMD_RIGID_BODY.size * metadata.rigidBodyCount)
+
+    def skip_constraints():
+        metadata.constraintCount = dv.get_uint32()
+        dv.skip(PMD_CONSTRAINT.size * metadata.constraintCount)
+
+    def section(name, parse, skip):
+        if not lazy and not header_only:
+            parse()
+            return
+
+        # the physics sections are optional in old pmd files
+        if dv.is_empty():
+            return
+
+        if lazy:
+            pmd.defer(name, dv, parse)
+        skip()
 
 
     parse_header()
-    parse_vertices()
-    parse_faces()
-    parse_materials()
-    parse_bones()
-    parse_iks()
-    parse_morphs()
-    parse_morph_frames()
-    parse_bone_frame_names()
-    parse_bone_frames()
+    section('vertices', parse_vertices, skip_vertices)
+    section('faces', parse_faces, skip_faces)
+    section('materials', parse_materials, skip_materials)
+    section('bones', parse_bones, skip_bones)
+    section('iks', parse_iks, skip_iks)
+    section('morphs', parse_morphs, skip_morphs)
+    section('morphFrames', parse_morph_frames, skip_morph_frames)
+    section('boneFrameNames', parse_bone_frame_names, skip_bone_frame_names)
+    section('boneFrames', parse_bone_frames, skip_bone_frames)
     parse_english_header()
     parse_english_bone_names()
     parse_english_morph_names()
     parse_english_bone_frame_names()
     parse_toon_textures()
-    parse_rigid_bodies()
-    parse_constraints()
+    section('rigidBodies', parse_rigid_bodies, skip_rigid_bodies)
+    section('constraints', parse_constraints, skip_constraints)
 
     return pmd
     
 
 
 # parse pmx format file
-def parse_pmx(dv):
+#   lazy: sections are only located here and parsed when first accessed
+#   header_only: only the header and the vertex count are read, the other
+#                counts can not be reached without walking the records
+def parse_pmx(dv, lazy=False, header_only=False):
 
-    pmx = ddict()
+    pmx = LazyModel() if lazy else ddict()
     metadata = ddict()
     pmx.metadata = metadata
     pmx.metadata.format = 'pmx'
     pmx.metadata.coordinateSystem = 'left'
+    records = ddict()
 
     def parse_header():
         metadata.magic = dv.get_chars(4).strip()
@@ -509,68 +882,236 @@ def parse_pmx(dv):
         metadata.englishComment = dv.get_text_buffer()
 
 
-    def parse_vertices(): # Vertex
-        def parse_vertex():
-            p = ddict()
-            p.position = dv.get_float32_array(3)
-            p.normal = dv.get_float32_array(3)
-            p.uv = dv.get_float32_array(2)
-            
-            p.auvs = []
-            for i in range(metadata.additionalUvNum):
-                p.auvs.append( dv.get_float32_array(4) )
-
-            p.type = dv.get_uint8()
-            index_size = metadata.boneIndexSize
-            if p.type == 0: # BDEF1
-                p.skinIndices = dv.get_index_array(index_size, 1)
-                p.skinWeights = [ 1.0 ]
-
-            elif p.type == 1: # BDEF2
-                p.skinIndices = dv.get_index_array(index_size, 2 )
-                p.skinWeights = dv.get_float32_array(1)
-                p.skinWeights.append( 1.0 - p.skinWeights[0] )
-
-            elif p.type == 2: # BDEF4
-                p.skinIndices = dv.get_index_array(index_size, 4)
-                p.skinWeights = dv.get_float32_array(4)
+    # record layouts depend on the index sizes given in the header
+    def compile_records():
+        vertex_index = index_format(metadata.vertexIndexSize, True)
+        texture_index = index_format(metadata.textureIndexSize)
+        material_index = index_format(metadata.materialIndexSize)
+        bone_index = index_format(metadata.boneIndexSize)
+        morph_index = index_format(metadata.morphIndexSize)
+        rigid_body_index = index_format(metadata.rigidBodyIndexSize)
+
+        records.faceIndex = np.dtype('<' + vertex_index)
+
+        records.material = Record(
+            Material,
+            ('diffuse', 'f', 4),
+            ('specular', 'f', 3),
+            ('shininess', 'f'),
+            ('ambient', 'f', 3),
+            ('flag', 'B'),
+            ('edgeColor', 'f', 4),
+            ('edgeSize', 'f'),
+            ('textureIndex', texture_index),
+            ('envTextureIndex', texture_index),
+            ('envFlag', 'B'),
+            ('toonFlag', 'B')
+        )
+
+        records.bone = Record(
+            Bone,
+            ('position', 'f', 3),
+            ('parentIndex', bone_index),
+            ('transformationClass', 'I'),
+            ('flag', 'H')
+        )
+        records.ik = Record(
+            IK,
+            ('effector', bone_index),
+            ('iteration', 'I'),
+            ('maxAngle', 'f'),
+            ('linkCount', 'I')
+        )
+        records.link = Record(
+            IKLink,
+            ('index', bone_index),
+            ('angleLimitation', 'B')
+        )
+
+        uv = Record(MorphElement, ('index', vertex_index), ('uv', 'f', 4))
+        records.morphElements = {
+            # group morph
+            0: Record(MorphElement, ('index', morph_index), ('ratio', 'f')),
+            # vertex morph
+            1: Record(MorphElement, ('index', vertex_index), ('position', 'f', 3)),
+            # bone morph
+            2: Record(MorphElement, ('index', bone_index), ('position', 'f', 3), ('rotation', 'f', 4)),
+            # uv morph, additional uv1 - uv4 morph
+            3: uv,
+            4: uv,
+            5: uv,
+            6: uv,
+            7: uv,
+            # material morph
+            8: Record(
+                MorphElement,
+                ('index', material_index),
+                ('type', 'B'),
+                ('diffuse', 'f', 4),
+                ('specular', 'f', 3),
+                ('shininess', 'f'),
+                ('ambient', 'f', 3),
+                ('edgeColor', 'f', 4),
+                ('edgeSize', 'f'),
+                ('textureColor', 'f', 4),
+                ('sphereTextureColor', 'f', 4),
+                ('toonColor', 'f', 4)
+            ),
+            # flip morph (pmx 2.1)
+            9: Record(MorphElement, ('index', morph_index), ('ratio', 'f')),
+            # impulse morph (pmx 2.1)
+            10: Record(
+                MorphElement,
+                ('index', rigid_body_index),
+                ('isLocal', 'B'),
+                ('velocity', 'f', 3),
+                ('torque', 'f', 3)
+            )
+        }
+
+        records.rigidBody = Record(
+            RigidBody,
+            ('boneIndex', bone_index),
+            ('groupIndex', 'B'),
+            ('groupTarget', 'H'),
+            ('shapeType', 'B'),
+            ('width', 'f'),
+            ('height', 'f'),
+            ('depth', 'f'),
+            ('position', 'f', 3),
+            ('rotation', 'f', 3),
+            ('weight', 'f'),
+            ('positionDamping', 'f'),
+            ('rotationDamping', 'f'),
+            ('restitution', 'f'),
+            ('friction', 'f'),
+            ('type', 'B')
+        )
+
+        records.constraint = Record(
+            Constraint,
+            ('type', 'B'),
+            ('rigidBodyIndex1', rigid_body_index),
+            ('rigidBodyIndex2', rigid_body_index),
+            ('position', 'f', 3),
+            ('rotation', 'f', 3),
+            ('translationLimitation1', 'f', 3),
+            ('translationLimitation2', 'f', 3),
+            ('rotationLimitation1', 'f', 3),
+            ('rotationLimitation2', 'f', 3),
+            ('springPosition', 'f', 3),
+            ('springRotation', 'f', 3)
+        )
+
+    def morph_element(type):
+        if type not in records.morphElements:
+            raise ValueError('unknown morph type %d exception.' % (type))
+
+        return records.morphElements[type]
+
+
+    # skinning part size for BDEF1, BDEF2, BDEF4, SDEF
+    def skin_sizes():
+        index_size = metadata.boneIndexSize
+        return (
+            index_size,
+            index_size * 2 + 4,
+            index_size * 4 + 16,
+            index_size * 2 + 4 + 36
+        )
+
+    # vertex records are variable length, so only the type bytes are
+    # walked here to find every record offset
+    def walk_vertices(count):
+        data = dv.peek()
+        sizes = skin_sizes()
+        type_offset = 32 + 16 * metadata.additionalUvNum
+        offsets = [0] * count
+        types = bytearray(count)
+        offset = 0
+        for i in range(count):
+            t = data[offset + type_offset]
+            if t > 3:
+                raise ValueError('unsupport bone type %d exception.' % (t))
+
+            offsets[i] = offset
+            types[i] = t
+            offset += type_offset + 1 + sizes[t] + 4
+
+        return data, offsets, types, offset
 
-            elif p.type == 3: # SDEF
 
-                p.skinIndices = dv.get_index_array(index_size, 2)
-                p.skinWeights = dv.get_float32_array(1)
-                p.skinWeights.append( 1.0 - p.skinWeights[0] )
-
-                p.skinC = dv.get_float32_array(3)
-                p.skinR0 = dv.get_float32_array(3)
-                p.skinR1 = dv.get_float32_array(3)
-
-                # SDEF is not supported yet and is handled as BDEF2 so far.
-                # TODO: SDEF support
-                p.type = 1
-
-            else:
-                raise ValueError('unsupport bone type %d exception.' % (p.type))
+    def parse_vertices(): # Vertex
+        count = dv.get_uint32()
+        metadata.vertexCount = count
+        data, offsets, types, offset = walk_vertices(count)
+
+        index_size = metadata.boneIndexSize
+        type_offset = 32 + 16 * metadata.additionalUvNum
+        buf = np.frombuffer(data, np.uint8, offset)
+        offsets = np.array(offsets, np.int64)
+        types = np.frombuffer(bytes(types), np.uint8)
+
+        def gather(offsets, dtype, size):
+            dtype = np.dtype(dtype)
+            columns = offsets[:, None] + np.arange(dtype.itemsize * size)
+            return buf[columns].view(dtype).reshape(len(offsets), size)
+
+        index_type = '<' + index_format(index_size)
+        skinIndices = np.zeros((count, 4), np.int32)
+        skinWeights = np.zeros((count, 4), np.float32)
+        skinC = np.zeros((count, 3), np.float32)
+        skinR0 = np.zeros((count, 3), np.float32)
+        skinR1 = np.zeros((count, 3), np.float32)
+
+        for t, size in enumerate(VertexArrays.SKIN_COUNTS):
+            mask = types == t
+            if not mask.any():
+                continue
 
-            p.edgeRatio = dv.get_float32()
-            return p
-
-        metadata.vertexCount = dv.get_uint32()
-        pmx.vertices = []
-        for i in range(metadata.vertexCount):
-            pmx.vertices.append( parse_vertex() )
+            base = offsets[mask] + type_offset + 1
+            skinIndices[mask, :size] = gather(base, index_type, size)
+            base = base + index_size * size
+
+            if t == 0: # BDEF1
+                skinWeights[mask, 0] = 1.0
+
+            elif t == 2: # BDEF4
+                skinWeights[mask] = gather(base, '<f4', 4)
+
+            else: # BDEF2, SDEF
+                weight = gather(base, '<f4', 1)[:, 0]
+                skinWeights[mask, 0] = weight
+                skinWeights[mask, 1] = 1.0 - weight
+
+            if t == 3:
+                skinC[mask] = gather(base + 4, '<f4', 3)
+                skinR0[mask] = gather(base + 16, '<f4', 3)
+                skinR1[mask] = gather(base + 28, '<f4', 3)
+
+        edge = offsets + type_offset + 1 + np.array(skin_sizes())[types]
+
+        pmx.vertices = VertexArrays(
+            'pmx',
+            positions=gather(offsets, '<f4', 3),
+            normals=gather(offsets + 12, '<f4', 3),
+            uvs=gather(offsets + 24, '<f4', 2),
+            auvs=gather(offsets + 32, '<f4', 4 * metadata.additionalUvNum).reshape(count, metadata.additionalUvNum, 4),
+            types=types,
+            skinIndices=skinIndices,
+            skinWeights=skinWeights,
+            skinC=skinC,
+            skinR0=skinR0,
+            skinR1=skinR1,
+            edgeRatios=gather(edge, '<f4', 1)[:, 0]
+        )
+        dv.skip(offset)
 
 
     def parse_faces(): # Faces
-        def parse_face():
-            p = ddict()
-            p.indices = dv.get_index_array(metadata.vertexIndexSize, 3, True)
-            return p
-
         metadata.faceCount = int(dv.get_uint32() / 3)
-        pmx.faces = []
-        for i in range(metadata.faceCount):
-            pmx.faces.append( parse_face() )
+        indices = dv.get_records(records.faceIndex, metadata.faceCount * 3)
+        pmx.faces = FaceArrays(indices.reshape(-1, 3).copy())
 
 
     def parse_textures(): # Textures
@@ -585,20 +1126,11 @@ def parse_pmx(dv):
 
     def parse_materials(): # Material
         def parse_material():
-            p = ddict()
-            p.name = dv.get_text_buffer()
-            p.englishName = dv.get_text_buffer()
-            p.diffuse = dv.get_float32_array(4)
-            p.specular = dv.get_float32_array(3)
-            p.shininess = dv.get_float32()
-            p.ambient = dv.get_float32_array(3)
-            p.flag = dv.get_uint8()
-            p.edgeColor = dv.get_float32_array(4)
-            p.edgeSize = dv.get_float32()
-            p.textureIndex = dv.get_index(metadata.textureIndexSize)
-            p.envTextureIndex = dv.get_index(metadata.textureIndexSize)
-            p.envFlag = dv.get_uint8()
-            p.toonFlag = dv.get_uint8()
+            name = dv.get_text_buffer()
+            englishName = dv.get_text_buffer()
+            p = dv.get_record(records.material)
+            p.name = name
+            p.englishName = englishName
 
             if p.toonFlag == 0:
                 p.toonIndex = dv.get_index(metadata.textureIndexSize)
@@ -621,27 +1153,25 @@ def parse_pmx(dv):
 
     def parse_bones(): # Bone
         def parse_bone():
-            p = ddict()
-            p.name = dv.get_text_buffer()
-            p.englishName = dv.get_text_buffer()
-            p.position = dv.get_float32_array(3)
-            p.parentIndex = dv.get_index(pmx.metadata.boneIndexSize)
-            p.transformationClass = dv.get_uint32()
-            p.flag = dv.get_uint16()
+            name = dv.get_text_buffer()
+            englishName = dv.get_text_buffer()
+            p = dv.get_record(records.bone)
+            p.name = name
+            p.englishName = englishName
 
             if p.flag & 0x1:
-                p.connectIndex = dv.get_index(pmx.metadata.boneIndexSize)
+                p.connectIndex = dv.get_index(metadata.boneIndexSize)
 
             else:
                 p.offsetPosition = dv.get_float32_array(3)
 
 
             if p.flag & 0x100 or p.flag & 0x200: # 回転、移動付与
-                grant = ddict()
+                grant = Grant()
 
                 grant.isLocal = True if p.flag & 0x80 else False
                 grant.affectRotation = True if p.flag & 0x100 else False
-                grant.affectPosition = True if p.flag & 0x2000 else False
+                grant.affectPosition = True if p.flag & 0x200 else False
                 grant.parentIndex = dv.get_index(metadata.boneIndexSize)
                 grant.ratio = dv.get_float32()
 
@@ -659,26 +1189,17 @@ def parse_pmx(dv):
                 p.key = dv.get_uint32()
 
             if p.flag & 0x20: # IK
-                ik = ddict()
-
-                ik.effector = dv.get_index(metadata.boneIndexSize)
-                ik.target = None
-                ik.iteration = dv.get_uint32()
-                ik.maxAngle = dv.get_float32()
-                ik.linkCount = dv.get_uint32()
-                ik.links = []
-                for i in range(ik.linkCount):
-                    link = ddict()
-                    link.index = dv.get_index(metadata.boneIndexSize)
-                    link.angleLimitation = dv.get_uint8()
+                p.ik = dv.get_record(records.ik)
+                p.ik.target = None
+                p.ik.links = []
+                for i in range(p.ik.linkCount):
+                    l = dv.get_record(records.link)
 
-                    if link.angleLimitation == 1:
-                        link.lowerLimitationAngle = dv.get_float32_array(3)
-                        link.upperLimitationAngle = dv.get_float32_array(3)
+                    if l.angleLimitation == 1:
+                        l.lowerLimitationAngle = dv.get_float32_array(3)
+                        l.upperLimitationAngle = dv.get_float32_array(3)
 
-                    ik.links.append( link )
-
-                p.ik = ik
+                    p.ik.links.append( l )
 
             return p
 
@@ -690,71 +1211,14 @@ def parse_pmx(dv):
 
     def parse_morphs(): # モーフ
         def parse_morph():
-            p = ddict()
+            p = Morph()
             p.name = dv.get_text_buffer()
             p.englishName = dv.get_text_buffer()
             p.panel = dv.get_uint8()
             p.type = dv.get_uint8()
             p.elementCount = dv.get_uint32()
-            p.elements = []
-
-            for i in range(p.elementCount):
-                if p.type == 0: # group morph
-                    m = ddict()
-                    m.index = dv.get_index(metadata.morphIndexSize)
-                    m.ratio = dv.get_float32()
-                    p.elements.append(m)
-
-                elif p.type == 1: # vertex morph
-                    m = ddict()
-                    m.index = dv.get_index(metadata.vertexIndexSize, True)
-                    m.position = dv.get_float32_array(3)
-                    p.elements.append(m)
-
-                elif p.type == 2: # bone morph
-                    m = ddict()
-                    m.index = dv.get_index(metadata.boneIndexSize)
-                    m.position = dv.get_float32_array(3)
-                    m.rotation = dv.get_float32_array(4)
-                    p.elements.append(m)
-
-                elif p.type == 3: # uv morph
-                    m = ddict()
-                    m.index = dv.get_index(metadata.vertexIndexSize, True)
-                    m.uv = dv.get_float32_array(4)
-                    p.elements.append(m)
-
-                elif p.type == 4: # additional uv1
-                    # TODO: implement
-                    pass
-
-                elif p.type == 5: # additional uv2
-                    # TODO: implement
-                    pass
-
-                elif p.type == 6: # additional uv3
-                    # TODO: implement
-                    pass
-
-                elif p.type == 7: # additional uv4
-                    # TODO: implement
-                    pass
-
-                elif p.type == 8: # material morph
-                    m = ddict()
-                    m.index = dv.get_index(metadata.materialIndexSize)
-                    m.type = dv.get_uint8()
-                    m.diffuse = dv.get_float32_array(4)
-                    m.specular = dv.get_float32_array(3)
-                    m.shininess = dv.get_float32()
-                    m.ambient = dv.get_float32_array(3)
-                    m.edgeColor = dv.get_float32_array(4)
-                    m.edgeSize = dv.get_float32()
-                    m.textureColor = dv.get_float32_array(4)
-                    m.sphereTextureColor = dv.get_float32_array(4)
-                    m.toonColor = dv.get_float32_array(4)
-                    p.elements.append(m)
 
+            p.elements = dv.get_record_array(morph_element(p.type), p.elementCount)
             return p
 
         metadata.morphCount = dv.get_uint32()
@@ -789,24 +1253,11 @@ def parse_pmx(dv):
 
     def parse_rigid_bodies(): # 剛体
         def parse_rigid_body():
-            p = ddict()
-            p.name = dv.get_text_buffer()
-            p.englishName = dv.get_text_buffer()
-            p.boneIndex = dv.get_index(metadata.boneIndexSize)
-            p.groupIndex = dv.get_uint8()
-            p.groupTarget = dv.get_uint16()
-            p.shapeType = dv.get_uint8()
-            p.width = dv.get_float32()
-            p.height = dv.get_float32()
-            p.depth = dv.get_float32()
-            p.position = dv.get_float32_array(3)
-            p.rotation = dv.get_float32_array(3)
-            p.weight = dv.get_float32()
-            p.positionDamping = dv.get_float32()
-            p.rotationDamping = dv.get_float32()
-            p.restitution = dv.get_float32()
-            p.friction = dv.get_float32()
-            p.type = dv.get_uint8()
+            name = dv.get_text_buffer()
+            englishName = dv.get_text_buffer()
+            p = dv.get_record(records.rigidBody)
+            p.name = name
+            p.englishName = englishName
             return p
 
         metadata.rigidBodyCount = dv.get_uint32()
@@ -817,20 +1268,11 @@ def parse_pmx(dv):
 
     def parse_constraints(): # ジョイント
         def parse_constraint():
-            p = ddict()
-            p.name = dv.get_text_buffer()
-            p.englishName = dv.get_text_buffer()
-            p.type = dv.get_uint8()
-            p.rigidBodyIndex1 = dv.get_index(metadata.rigidBodyIndexSize)
-            p.rigidBodyIndex2 = dv.get_index(metadata.rigidBodyIndexSize)
-            p.position = dv.get_float32_array(3)
-            p.rotation = dv.get_float32_array(3)
-            p.translationLimitation1 = dv.get_float32_array(3)
-            p.translationLimitation2 = dv.get_float32_array(3)
-            p.rotationLimitation1 = dv.get_float32_array(3)
-            p.rotationLimitation2 = dv.get_float32_array(3)
-            p.springPosition = dv.get_float32_array(3)
-            p.springRotation = dv.get_float32_array(3)
+            name = dv.get_text_buffer()
+            englishName = dv.get_text_buffer()
+            p = dv.get_record(records.constraint)
+            p.name = name
+            p.englishName = englishName
             return p
 
         metadata.constraintCount = dv.get_uint32()
@@ -838,26 +1280,187 @@ def parse_pmx(dv):
         for i in range(metadata.constraintCount):
             pmx.constraints.append( parse_constraint() )
 
+    # skip a section without decoding it, only its count is kept
+    def skip_text():
+        dv.skip(dv.get_uint32())
+
+    def skip_vertices():
+        metadata.vertexCount = dv.get_uint32()
+        dv.skip(walk_vertices(metadata.vertexCount)[3])
+
+    def skip_faces():
+        metadata.faceCount = int(dv.get_uint32() / 3)
+        dv.skip(records.faceIndex.itemsize * 3 * metadata.faceCount)
+
+    def skip_textures():
+        metadata.textureCount = dv.get_uint32()
+        for i in range(metadata.textureCount):
+            skip_text()
+
+    def skip_materials():
+        metadata.materialCount = dv.get_uint32()
+        for i in range(metadata.materialCount):
+            skip_text()
+            skip_text()
+            dv.skip(records.material.size - 1)
+            toonFlag = dv.get_uint8()
+            dv.skip(metadata.textureIndexSize if toonFlag == 0 else 1)
+            skip_text()
+            dv.skip(4)
+
+    def skip_bones():
+        index_size = metadata.boneIndexSize
+        metadata.boneCount = dv.get_uint32()
+        for i in range(metadata.boneCount):
+            skip_text()
+            skip_text()
+            dv.skip(records.bone.size - 2)
+            flag = dv.get_uint16()
+            dv.skip(index_size if flag & 0x1 else 12)
+            if flag & 0x100 or flag & 0x200:
+                dv.skip(index_size + 4)
+            if flag & 0x400:
+                dv.skip(12)
+            if flag & 0x800:
+                dv.skip(24)
+            if flag & 0x2000:
+                dv.skip(4)
+            if flag & 0x20:
+                dv.skip(records.ik.size - 4)
+                for j in range(dv.get_uint32()):
+                    dv.skip(index_size)
+                    if dv.get_uint8() == 1:
+                        dv.skip(24)
+
+    def skip_morphs():
+        metadata.morphCount = dv.get_uint32()
+        for i in range(metadata.morphCount):
+            skip_text()
+            skip_text()
+            dv.skip(1)
+            type = dv.get_uint8()
+            dv.skip(morph_element(type).size * dv.get_uint32())
+
+    def skip_frames():
+        metadata.frameCount = dv.get_uint32()
+        for i in range(metadata.frameCount):
+            skip_text()
+            skip_text()
+            dv.skip(1)
+            for j in range(dv.get_uint32()):
+                target = dv.get_uint8()
+                dv.skip(metadata.boneIndexSize if target == 0 else metadata.morphIndexSize)
+
+    def skip_rigid_bodies():
+        metadata.rigidBodyCount = dv.get_uint32()
+        for i in range(metadata.rigidBodyCount):
+            skip_text()
+            skip_text()
+            dv.skip(records.rigidBody.size)
+
+    def skip_constraints():
+        metadata.constraintCount = dv.get_uint32()
+        for i in range(metadata.constraintCount):
+            skip_text()
+            skip_text()
+            dv.skip(records.constraint.size)
+
+
+    sections = (
+        ('vertices', parse_vertices, skip_vertices),
+        ('faces', parse_faces, skip_faces),
+        ('textures', parse_textures, skip_textures),
+        ('materials', parse_materials, skip_materials),
+        ('bones', parse_bones, skip_bones),
+        ('morphs', parse_morphs, skip_morphs),
+        ('frames', parse_frames, skip_frames),
+        ('rigidBodies', parse_rigid_bodies, skip_rigid_bodies),
+        ('constraints', parse_constraints, skip_constraints)
+    )
 
     parse_header()
-    parse_vertices()
-    parse_faces()
-    parse_textures()
-    parse_materials()
-    parse_bones()
-    parse_morphs()
-    parse_frames()
-    parse_rigid_bodies()
-    parse_constraints()
+    compile_records()
+    if header_only:
+        metadata.vertexCount = dv.get_uint32()
+        return pmx
+
+    for name, parse, skip in sections:
+        if lazy:
+            pmx.defer(name, dv, parse)
+            skip()
+        else:
+            parse()
 
     return pmx
 
 
+VMD_MOTION = Record(
+    MotionKeyframe,
+    ('boneName', 'sjis', 15),
+    ('frameNum', 'I'),
+    ('position', 'f', 3),
+    ('rotation', 'f', 4),
+    ('interpolation', 'bytes', 64)
+)
+
+VMD_MORPH = Record(
+    MorphKeyframe,
+    ('morphName', 'sjis', 15),
+    ('frameNum', 'I'),
+    ('weight', 'f')
+)
+
+VMD_CAMERA = Record(
+    CameraKeyframe,
+    ('frameNum', 'I'),
+    ('distance', 'f'),
+    ('position', 'f', 3),
+    ('rotation', 'f', 3),
+    ('interpolation', 'bytes', 24),
+    ('fov', 'I'),
+    ('perspective', 'B')
+)
+
+# columnar layout of the vmd motion and morph records
+VMD_MOTION_DTYPE = np.dtype([
+    ('boneName', 'S15'),
+    ('frameNum', '<u4'),
+    ('position', '<f4', 3),
+    ('rotation', '<f4', 4),
+    ('interpolation', 'u1', 64)
+])
+
+VMD_MORPH_DTYPE = np.dtype([
+    ('morphName', 'S15'),
+    ('frameNum', '<u4'),
+    ('weight', '<f4')
+])
+
+# replace repeated names by ids into a table of distinct names
+def intern_names(names):
+    unique, inverse = np.unique(names, return_inverse=True)
+    table = []
+    index = {}
+    ids = np.empty(len(unique), np.uint32)
+    for i, name in enumerate(unique):
+        name = decode_sjis(bytes(name))
+        if name not in index:
+            index[name] = len(table)
+            table.append(name)
+        ids[i] = index[name]
+
+    return table, ids[inverse.reshape(-1)]
+
+
 # parse vmd format file
-def parse_vmd(dv):
+#   columnar: motions and morphs are returned as columns of numpy arrays
+#             with the names interned into boneNames / morphNames
+#   header_only: only the header and the keyframe counts are read
+def parse_vmd(dv, columnar=False, header_only=False):
     vmd = ddict()
     metadata = ddict()
     vmd.metadata = metadata
+    vmd.metadata.format = 'vmd'
     vmd.metadata.coordinateSystem = 'left'
 
     def parse_header():
@@ -867,71 +1470,126 @@ def parse_vmd(dv):
 
         metadata.name = dv.get_sjis_strings(20)
 
-    
+    # old files end without the camera section, it has no keyframes then
+    def get_count():
+        if dv.is_empty():
+            return 0
+        return dv.get_uint32()
+
     def parse_motions():
-        def parse_motion():
-            p = ddict()
-            p.boneName = dv.get_sjis_strings(15)
-            p.frameNum = dv.get_uint32()
-            p.position = dv.get_float32_array(3)
-            p.rotation = dv.get_float32_array(4)
-            p.interpolation = dv.get_uint8_array(64)
-            return p
+        metadata.motionCount = get_count()
+        if not columnar:
+            vmd.motions = dv.get_record_array(VMD_MOTION, metadata.motionCount)
+            return
 
-        metadata.motionCount = dv.get_uint32()
-        vmd.motions = []
-        for i in range(metadata.motionCount):
-            vmd.motions.append( parse_motion() )
+        records = dv.get_records(VMD_MOTION_DTYPE, metadata.motionCount)
+        motions = ddict()
+        motions.boneNames, motions.boneId = intern_names(records['boneName'])
+        motions.frameNum = records['frameNum'].copy()
+        motions.position = records['position'].copy()
+        motions.rotation = records['rotation'].copy()
+        motions.interpolation = records['interpolation'].copy()
+        vmd.motions = motions
 
 
     def parse_morphs():
-        def parse_morph():
-            p = ddict()
-            p.morphName = dv.get_sjis_strings(15)
-            p.frameNum = dv.get_uint32()
-            p.weight = dv.get_float32()
-            return p
+        metadata.morphCount = get_count()
+        if not columnar:
+            vmd.morphs = dv.get_record_array(VMD_MORPH, metadata.morphCount)
+            return
 
-        metadata.morphCount = dv.get_uint32()
-        vmd.morphs = []
-        for i in range(metadata.morphCount):
-            vmd.morphs.append( parse_morph() )
+        records = dv.get_records(VMD_MORPH_DTYPE, metadata.morphCount)
+        morphs = ddict()
+        morphs.morphNames, morphs.morphId = intern_names(records['morphName'])
+        morphs.frameNum = records['frameNum'].copy()
+        morphs.weight = records['weight'].copy()
+        vmd.morphs = morphs
 
     def parse_cameras():
-        def parse_camera():
-            p = ddict()
-            p.frameNum = dv.get_uint32()
-            p.distance = dv.get_float32()
-            p.position = dv.get_float32_array(3)
-            p.rotation = dv.get_float32_array(3)
-            p.interpolation = dv.get_uint8_array(24)
-            p.fov = dv.get_uint32()
-            p.perspective = dv.get_uint8()
-            return p
+        metadata.cameraCount = get_count()
+        vmd.cameras = dv.get_record_array(VMD_CAMERA, metadata.cameraCount)
 
-        metadata.cameraCount = dv.get_uint32()
-        vmd.cameras = []
-        for i in range(metadata.cameraCount):
-            vmd.cameras.push( parse_camera() )
+    def skip_keyframes(record):
+        count = get_count()
+        dv.skip(record.size * count)
+        return count
 
     parse_header()
+    if header_only:
+        metadata.motionCount = skip_keyframes(VMD_MOTION)
+        metadata.morphCount = skip_keyframes(VMD_MORPH)
+        metadata.cameraCount = skip_keyframes(VMD_CAMERA)
+        return vmd
+
     parse_motions()
     parse_morphs()
     parse_cameras()
 
     return vmd
 
-    
+
+
+# read the keyframes of a vmd file from a file handle in batches of at
+# most chunk_frames records, so memory use does not depend on file size.
+#   yields ('motions', [...]), ('morphs', [...]) and ('cameras', [...])
+#   bones / morphs: only keyframes with these names are decoded
+def iter_vmd(file, chunk_frames=4096, bones=None, morphs=None):
+    # checked here rather than in the generator, so the call itself fails
+    if chunk_frames <= 0:
+        raise ValueError('chunk_frames must be positive, but %s' % (chunk_frames))
+    return iter_vmd_chunks(file, chunk_frames, bones, morphs)
+
+def iter_vmd_chunks(file, chunk_frames, bones, morphs):
+    def names(filter):
+        if filter is None:
+            return None
+        return set([ name.encode('cp932') for name in filter ])
+
+    sections = (
+        ('motions', VMD_MOTION, names(bones)),
+        ('morphs', VMD_MORPH, names(morphs)),
+        ('cameras', VMD_CAMERA, None)
+    )
+
+    with open(file, 'rb') as f:
+        dv = DataView(f.read(50))
+        magic = dv.get_chars(30)
+        if magic != 'Vocaloid Motion Data 0002':
+            raise ValueError('VMD file magic is not Vocaloid Motion Data 0002, but %s' % (magic))
+
+        for kind, record, filter in sections:
+            data = f.read(4)
+            if not data: # old files end without the camera section
+                return
+
+            count = UINT32.unpack(data)[0]
+            while count > 0:
+                size = min(count, chunk_frames)
+                count -= size
+
+                data = f.read(record.size * size)
+                if len(data) != record.size * size:
+                    raise ValueError('VMD file is truncated in %s.' % (kind))
+
+                values = record.struct.iter_unpack(data)
+                if filter is not None:
+                    values = [ v for v in values if v[0].split(b'\0', 1)[0] in filter ]
+
+                batch = [ record.make(v) for v in values ]
+                if batch:
+                    yield kind, batch
+
 
 def parse_vpd(dv, encode='ms932'):
     import re
-    text = dv.buffer.read().decode(encode)
+    text = bytes(dv.read(dv.length)).decode(encode)
     text = re.sub(';.*', '', text)
     lines = re.split('\r|\n|\r\n', text)
 
     vpd = ddict()
     metadata = ddict()
     vpd.metadata = metadata
+    vpd.metadata.format = 'vpd'
     vpd.bones = []
 
     def check_magic():
@@ -1002,22 +1660,41 @@ def parse_vpd(dv, encode='ms932'):
     return vpd
 
 
-def load(file, format=None, encode='ms932'):
-    with open(file, 'rb') as f:
-        dv = DataView(f.read())
+# lazy: pmd/pmx sections are parsed when first accessed.
+#       the file stays mapped while the model refers to it.
+# .pack files written by mmd.pack.save are mapped and read without parsing.
+# cache_dir: parsed models are kept in this directory (see mmd.cache) and
+#            reused while the file is unchanged, cache_size limits its size.
+#            it takes precedence over lazy, a model missing from the cache
+#            is parsed whole so it can be stored.
+def load(file, format=None, encode='ms932', columnar=False, lazy=False, cache_dir=None, cache_size=1 << 30):
+    if cache_dir:
+        from . import cache
+        model_cache = cache.ModelCache(cache_dir, cache_size)
+        return model_cache.load(file, format=format, encode=encode, columnar=columnar)
 
     if not format:
-        format = file.split('.')[-1].upper()
+        format = file_format(file)
+
+    if 'PACK' == format:
+        from . import pack
+        return pack.load(file)
+
+    dv = DataView.from_file(file)
     
     loaded = None
-    if 'PMD' == format:
-        loaded = parse_pmd(dv)
-    elif 'PMX' == format:
-        loaded = parse_pmx(dv)
-    elif 'VMD' == format:
-        loaded = parse_vmd(dv)
-    elif 'VPD' == format:
-        loaded = parse_vpd(dv, encode)
+    try:
+        if 'PMD' == format:
+            loaded = parse_pmd(dv, lazy)
+        elif 'PMX' == format:
+            loaded = parse_pmx(dv, lazy)
+        elif 'VMD' == format:
+            loaded = parse_vmd(dv, columnar)
+        elif 'VPD' == format:
+            loaded = parse_vpd(dv, encode)
+    finally:
+        if not isinstance(loaded, LazyModel):
+            dv.close()
 
     if not loaded:
         raise ValueError('Unknown format %s.' % (format))
@@ -1026,3 +1703,63 @@ def load(file, format=None, encode='ms932'):
     return loaded
 
 
+def file_format(file):
+    return file.split('.')[-1].upper()
+
+
+# read only the header and the section counts that can be reached
+# cheaply, the rest of the file is never touched
+def probe(file, format=None, encode='ms932'):
+    dv = DataView.from_file(file)
+
+    if not format:
+        format = file_format(file)
+
+    loaded = None
+    try:
+        if 'PMD' == format:
+            loaded = parse_pmd(dv, header_only=True)
+        elif 'PMX' == format:
+            loaded = parse_pmx(dv, header_only=True)
+        elif 'VMD' == format:
+            loaded = parse_vmd(dv, header_only=True)
+        elif 'VPD' == format:
+            loaded = parse_vpd(dv, encode)
+    finally:
+        dv.close()
+
+    if not loaded:
+        raise ValueError('Unknown format %s.' % (format))
+
+    metadata = loaded.metadata
+    metadata.base = os.path.dirname(file)
+    return metadata
+
+
+# catalog entry of one file: probed metadata as a plain dict
+def catalog_entry(file):
+    entry = {'path': file}
+    try:
+        stat = os.stat(file)
+        entry['size'] = stat.st_size
+        entry['mtime'] = stat.st_mtime
+        entry.update(probe(file))
+    except Exception as e:
+        entry['error'] = '%s: %s' % (type(e).__name__, e)
+
+    return entry
+
+
+# probe every pmd/pmx/vmd/vpd file under directory in parallel
+def catalog(directory, workers=None, formats=('PMD', 'PMX', 'VMD', 'VPD')):
+    files = []
+    for root, dirs, names in os.walk(directory):
+        for name in sorted(names):
+            if file_format(name) in formats:
+                files.append(os.path.join(root, name))
+
+    if workers == 1:
+        return [ catalog_entry(file) for file in files ]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(catalog_entry, files, chunksize=64))
@@ -0,0 +1,300 @@
+import numpy as np
+
+from . import loader
+
+
+# pmx morph types
+GROUP = 0
+VERTEX = 1
+BONE = 2
+UV = 3
+ADDITIONAL_UV = (4, 5, 6, 7)
+MATERIAL = 8
+FLIP = 9
+IMPULSE = 10
+
+# nesting of group morphs followed when they are flattened
+GROUP_DEPTH = 16
+
+# columns of the material table, in the order of the material morph values
+MATERIAL_LAYOUT = (
+    ('diffuse', 4),
+    ('specular', 3),
+    ('shininess', 1),
+    ('ambient', 3),
+    ('edgeColor', 4),
+    ('edgeSize', 1),
+    ('textureColor', 4),
+    ('sphereTextureColor', 4),
+    ('toonColor', 4)
+)
+
+# values of the columns the materials do not have (pmd has no edge color,
+# the texture colors are factors applied to the textures)
+MATERIAL_DEFAULTS = {
+    'edgeColor': [0.0, 0.0, 0.0, 1.0],
+    'edgeSize': 1.0,
+    'textureColor': [1.0, 1.0, 1.0, 1.0],
+    'sphereTextureColor': [1.0, 1.0, 1.0, 1.0],
+    'toonColor': [1.0, 1.0, 1.0, 1.0]
+}
+
+# material morph operations (element type)
+MULTIPLY = 0
+ADD = 1
+
+
+# deltas of every morph to one vertex attribute, as a sparse
+# morphs x vertices matrix in csr layout.
+# the elements of morph i are offsets[i]:offsets[i + 1], sorted by vertex.
+class SparseDeltas(object):
+    def __init__(self, morph_count, morphs, indices, values):
+        morphs = np.asarray(morphs, np.int64)
+        order = np.lexsort((indices, morphs))
+        self.indices = np.asarray(indices, np.int64)[order]
+        self.values = np.asarray(values, np.float32)[order]
+        self.offsets = np.searchsorted(morphs[order], np.arange(morph_count + 1))
+        self.counts = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.indices)
+
+    # base (N, ...) plus the deltas of the morphs scaled by weights (M,).
+    # only the elements of the morphs with a weight are touched.
+    def apply(self, weights, base):
+        result = np.array(base, np.float32)
+        active = np.flatnonzero(weights)
+        if not len(active):
+            return result
+
+        counts = self.counts[active]
+        starts = self.offsets[active] - (np.cumsum(counts) - counts)
+        elements = np.arange(counts.sum()) + np.repeat(starts, counts)
+        if not len(elements):
+            return result
+
+        indices = self.indices[elements]
+        deltas = self.values[elements] * np.repeat(np.asarray(weights, np.float32)[active], counts)[:, None]
+
+        flat = result.reshape(len(result), -1)
+        for k in range(deltas.shape[1]):
+            flat[:, k] += np.bincount(indices, deltas[:, k], minlength=len(result))
+        return result
+
+
+# material morph elements of every morph as arrays.
+#   morphs: morph index, targets: material index or -1 for all materials,
+#   types: MULTIPLY or ADD, values: (E, 28) in MATERIAL_LAYOUT order
+class MaterialDeltas(object):
+    def __init__(self, morphs, targets, types, values):
+        self.morphs = np.asarray(morphs, np.int64)
+        self.targets = np.asarray(targets, np.int64)
+        self.types = np.asarray(types, np.uint8)
+        self.values = np.asarray(values, np.float32).reshape(len(self.morphs), -1)
+
+    def __len__(self):
+        return len(self.morphs)
+
+    # material table base (materials, 28) with the morphs applied.
+    # multiply elements scale by lerp(1, value, weight), add elements add
+    # value * weight, the result is base * product + sum.
+    def apply(self, weights, base):
+        weights = np.asarray(weights, np.float32)[self.morphs]
+        elements = np.flatnonzero(weights)
+        if not len(elements):
+            return np.array(base, np.float32)
+
+        w = weights[elements, None]
+        values = self.values[elements]
+        targets = self.targets[elements]
+        multiply = self.types[elements] == MULTIPLY
+        every = targets < 0
+
+        scale = np.ones(base.shape, np.float32)
+        offset = np.zeros(base.shape, np.float32)
+        factors = 1 + (values - 1) * w
+        deltas = values * w
+
+        # elements for all materials are reduced first and broadcast
+        scale *= np.prod(factors[multiply & every], axis=0)
+        offset += np.sum(deltas[~multiply & every], axis=0)
+
+        selected = multiply & ~every
+        np.multiply.at(scale, targets[selected], factors[selected])
+        selected = ~multiply & ~every
+        np.add.at(offset, targets[selected], deltas[selected])
+
+        return base * scale + offset
+
+
+# (materials, 28) table of the material values in MATERIAL_LAYOUT order
+def material_table(materials):
+    table = np.empty((len(materials), sum([ width for name, width in MATERIAL_LAYOUT ])), np.float32)
+    for i, material in enumerate(materials):
+        row = []
+        for name, width in MATERIAL_LAYOUT:
+            value = material.get(name, MATERIAL_DEFAULTS.get(name))
+            row.extend(value if width > 1 else [value])
+        table[i] = row
+    return table
+
+# columns of a material table by name, as views of it
+def material_columns(table):
+    columns = loader.ddict()
+    start = 0
+    for name, width in MATERIAL_LAYOUT:
+        columns[name] = table[:, start] if width == 1 else table[:, start:start + width]
+        start += width
+    return columns
+
+
+# vertex, uv and material morphs of a model compiled once, then evaluated for any
+# weight vector. weights are (M,) arrays in the order of model.morphs or
+# a dict of morph name to weight.
+class Morphs(object):
+    def __init__(self, model):
+        self.model = model
+        self.names = [ morph.name for morph in model.morphs ]
+        self.index = {}
+        for i, name in enumerate(self.names):
+            self.index.setdefault(name, i)
+
+        self.position = None
+        self.uv = None
+        self.additional_uvs = {}
+        self.material = None
+        self.material_base = None
+        self.groups = None
+
+        if model.metadata.format == 'pmd':
+            self.compile_pmd()
+        else:
+            self.compile_pmx()
+
+    def __len__(self):
+        return len(self.names)
+
+    # pmd morphs refer to the vertices through the elements of the
+    # base morph (type 0), their offsets are relative to it
+    def compile_pmd(self):
+        morphs = self.model.morphs
+        base = [ morph for morph in morphs if morph.type == 0 ]
+        if not base:
+            return
+
+        vertices = np.array([ element.index for element in base[0].elements ], np.int64)
+        rows, indices, values = [], [], []
+        for i, morph in enumerate(morphs):
+            if morph.type == 0:
+                continue
+            for element in morph.elements:
+                rows.append(i)
+                indices.append(element.index)
+                values.append(element.position)
+
+        self.position = SparseDeltas(len(morphs), rows, vertices[np.array(indices, np.int64)], np.reshape(values, (len(values), 3)))
+
+    def compile_pmx(self):
+        morphs = self.model.morphs
+        targets = {}
+        groups = []
+        materials = ([], [], [], [])
+        for i, morph in enumerate(morphs):
+            if morph.type == GROUP:
+                groups.extend([ (i, element.index, element.ratio) for element in morph.elements ])
+                continue
+
+            if morph.type == MATERIAL:
+                for element in morph.elements:
+                    materials[0].append(i)
+                    materials[1].append(element.index)
+                    materials[2].append(element.type)
+                    materials[3].append(material_table([element])[0])
+                continue
+
+            if morph.type == VERTEX:
+                name, attribute = VERTEX, 'position'
+            elif morph.type == UV or morph.type in ADDITIONAL_UV:
+                name, attribute = morph.type, 'uv'
+            else:
+                continue
+
+            rows, indices, values = targets.setdefault(name, ([], [], []))
+            for element in morph.elements:
+                rows.append(i)
+                indices.append(element.index)
+                values.append(element[attribute])
+
+        def deltas(name, width):
+            rows, indices, values = targets[name]
+            return SparseDeltas(len(morphs), rows, indices, np.reshape(values, (len(values), -1))[:, :width])
+
+        if VERTEX in targets:
+            self.position = deltas(VERTEX, 3)
+        if UV in targets:
+            self.uv = deltas(UV, 2)
+        for type in ADDITIONAL_UV:
+            if type in targets:
+                self.additional_uvs[type - ADDITIONAL_UV[0]] = deltas(type, 4)
+
+        if materials[0]:
+            self.material = MaterialDeltas(*materials)
+            self.material_base = material_table(self.model.materials)
+
+        if groups:
+            self.groups = flatten_groups(len(morphs), groups)
+
+    # weights of the morphs with the group morphs spread to their members
+    def weights(self, weights):
+        if isinstance(weights, dict):
+            values = np.zeros(len(self), np.float32)
+            for name, weight in weights.items():
+                if name in self.index:
+                    values[self.index[name]] = weight
+            weights = values
+        else:
+            weights = np.asarray(weights, np.float32)
+
+        if self.groups is not None and np.any(weights):
+            weights = weights @ self.groups
+        return weights
+
+    def positions(self, weights):
+        return self.apply(self.position, weights, self.model.vertices.positions)
+
+    def uvs(self, weights):
+        return self.apply(self.uv, weights, self.model.vertices.uvs)
+
+    # additional uv k (0 - 3) of the pmx vertices
+    def auvs(self, weights, k):
+        return self.apply(self.additional_uvs.get(k), weights, self.model.vertices.auvs[:, k])
+
+    # material values with the material morphs applied, a ddict of
+    # (materials, width) arrays named as in MATERIAL_LAYOUT
+    def materials(self, weights):
+        if self.material is None:
+            return material_columns(material_table(self.model.materials))
+        return material_columns(self.material.apply(self.weights(weights), self.material_base))
+
+    def apply(self, deltas, weights, base):
+        if deltas is None:
+            return np.array(base, np.float32)
+        return deltas.apply(self.weights(weights), base)
+
+
+# (M, M) matrix whose row i gives the weight every morph gets from morph i,
+# nested group morphs are followed GROUP_DEPTH levels at most
+def flatten_groups(count, groups):
+    g = np.zeros((count, count), np.float32)
+    for group, member, ratio in groups:
+        if 0 <= member < count:
+            g[group, member] += ratio
+
+    flat = np.eye(count, dtype=np.float32)
+    level = flat
+    for i in range(GROUP_DEPTH):
+        level = level @ g
+        if not np.any(level):
+            break
+        flat += level
+    return flat
@@ -0,0 +1,273 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from . import cache
+from . import loader
+from . import quaternion
+
+
+# the bezier curves are solved by bisection down to 1/256 then refined
+# by newton steps kept inside the bisection bracket
+BISECTION_STEPS = 8
+NEWTON_STEPS = 2
+
+
+# keyframes of one kind grouped by track (bone or morph) and sorted by
+# frame, the bracketing keys of any frame are found with one searchsorted.
+#   ids: track id of every key, frames: frame numbers
+class KeyIndex(object):
+    def __init__(self, ids, frames, track_count):
+        self.order = np.lexsort((frames, ids))
+        self.ids = np.asarray(ids, np.int64)[self.order]
+        self.frames = np.asarray(frames, np.float64)[self.order]
+        self.keys = self.ids * (1 << 32) + np.asarray(frames, np.int64)[self.order]
+        self.starts = np.searchsorted(self.ids, np.arange(track_count))
+        self.ends = np.searchsorted(self.ids, np.arange(track_count), side='right')
+
+    # keys before / after frames (F,) for tracks (T,) and the ratio between
+    # them, (F, T) each. every track has at least one key.
+    def bracket(self, frames, tracks):
+        frames = np.asarray(frames, np.float64)[:, None]
+        last = self.ends[tracks] - 1
+
+        keys = tracks * (1 << 32) + np.floor(frames).astype(np.int64)
+        i0 = np.searchsorted(self.keys, keys, side='right') - 1
+        i0 = np.minimum(np.maximum(i0, self.starts[tracks]), last)
+        i1 = np.minimum(i0 + 1, last)
+
+        # before the first key and after the last one the key is held
+        f0 = self.frames[i0]
+        span = self.frames[i1] - f0
+        ratio = np.minimum(np.maximum((frames - f0) / np.maximum(span, 1), 0.0), 1.0)
+        return i0, i1, ratio
+
+
+# y of the cubic bezier from (0, 0) to (1, 1) with control points
+# (x1, y1), (x2, y2) at x, solved for all curves at once
+def bezier(x, x1, y1, x2, y2):
+    return solve_bezier(x, *bezier_coefficients(x1, y1, x2, y2))
+
+# x(t) = ((a t + b) t + c) t and y(t) = ((d t + e) t + f) t
+def bezier_coefficients(x1, y1, x2, y2):
+    return (
+        3 * x1 - 3 * x2 + 1, 3 * x2 - 6 * x1, 3 * x1,
+        3 * y1 - 3 * y2 + 1, 3 * y2 - 6 * y1, 3 * y1
+    )
+
+def solve_bezier(x, a, b, c, d, e, f):
+    x = np.broadcast_to(np.minimum(np.maximum(x, 0.0), 1.0), np.broadcast(x, a).shape)
+
+    # t is kept in [lo, lo + width] by the bisection
+    lo = np.zeros(x.shape)
+    width = 1.0
+    for i in range(BISECTION_STEPS):
+        width *= 0.5
+        t = lo + width
+        lo += width * (((a * t + b) * t + c) * t < x)
+
+    hi = lo + width
+    t = lo + width * 0.5
+    for i in range(NEWTON_STEPS):
+        error = ((a * t + b) * t + c) * t - x
+        slope = (3 * a * t + 2 * b) * t + c
+        t = np.minimum(np.maximum(t - error / np.maximum(slope, 1e-6), lo), hi)
+
+    return ((d * t + e) * t + f) * t
+
+
+# vmd motion indexed for sampling the pose of every bone at any frame.
+# with a model the bones and morphs are given in the model order,
+# bones and morphs not in the motion stay at rest.
+# each bone is interpolated between the keys around the frame by the
+# bezier curves of the later key and slerp for the rotation.
+class Motion(object):
+    def __init__(self, vmd, model=None):
+        motions = motion_columns(vmd.motions)
+        morphs = morph_columns(vmd.morphs)
+
+        self.boneNames = motions.boneNames
+        self.morphNames = morphs.morphNames
+        self.bones = KeyIndex(motions.boneId, motions.frameNum, len(self.boneNames))
+        self.morphs = KeyIndex(morphs.morphId, morphs.frameNum, len(self.morphNames))
+
+        order = self.bones.order
+        self.positions = np.asarray(motions.position, np.float32)[order]
+        self.rotations = quaternion.normalize(np.asarray(motions.rotation, np.float64)[order])
+        # x1, y1, x2, y2 of the X, Y, Z and rotation curves are the bytes
+        # 0-3, 4-7, 8-11, 12-15 of the interpolation, kept as the
+        # polynomial coefficients (6, K, 4 curves)
+        curves = np.asarray(motions.interpolation, np.float64)[order][:, :16].reshape(-1, 4, 4) / 127
+        self.curves = np.stack(bezier_coefficients(curves[:, 0], curves[:, 1], curves[:, 2], curves[:, 3]))
+        self.weights = np.asarray(morphs.weight, np.float32)[self.morphs.order]
+
+        frames = np.concatenate([self.bones.frames, self.morphs.frames])
+        self.frameCount = int(frames.max()) + 1 if len(frames) else 0
+
+        # track of every output bone / morph, -1 when not in the motion
+        if model:
+            self.boneTracks = track_map(self.boneNames, [ bone.name for bone in model.bones ])
+            self.morphTracks = track_map(self.morphNames, [ morph.name for morph in model.morphs ])
+        else:
+            self.boneTracks = np.arange(len(self.boneNames))
+            self.morphTracks = np.arange(len(self.morphNames))
+
+        self.boneBound = np.flatnonzero(self.boneTracks >= 0)
+        self.morphBound = np.flatnonzero(self.morphTracks >= 0)
+
+    # translations (B, 3) and rotations (B, 4) at frame,
+    # or (F, B, 3) and (F, B, 4) for an array of frames
+    def sample(self, frames):
+        single = np.ndim(frames) == 0
+        frames = np.atleast_1d(frames)
+
+        count = len(self.boneTracks)
+        translations = np.zeros((len(frames), count, 3), np.float32)
+        rotations = np.zeros((len(frames), count, 4), np.float32)
+        rotations[..., 3] = 1
+
+        bound = self.boneBound
+        if len(bound):
+            i0, i1, ratio = self.bones.bracket(frames, self.boneTracks[bound])
+            # the curves of the later key shape the way to it
+            y = solve_bezier(ratio[..., None], *self.curves[:, i1])
+
+            p0 = self.positions[i0]
+            translations[:, bound] = p0 + (self.positions[i1] - p0) * y[..., :3]
+            rotations[:, bound] = quaternion.slerp(self.rotations[i0], self.rotations[i1], y[..., 3])
+
+        if single:
+            return translations[0], rotations[0]
+        return translations, rotations
+
+    # morph weights (M,) at frame, or (F, M) for an array of frames
+    def sample_morphs(self, frames):
+        single = np.ndim(frames) == 0
+        frames = np.atleast_1d(frames)
+
+        weights = np.zeros((len(frames), len(self.morphTracks)), np.float32)
+        bound = self.morphBound
+        if len(bound):
+            i0, i1, ratio = self.morphs.bracket(frames, self.morphTracks[bound])
+            w0 = self.weights[i0]
+            weights[:, bound] = w0 + (self.weights[i1] - w0) * ratio
+
+        if single:
+            return weights[0]
+        return weights
+
+
+# motion sampled at every frame, playback and scrubbing only index the arrays
+#   translations (F, B, 3), rotations (F, B, 4), weights (F, M)
+class BakedMotion(object):
+    def __init__(self, translations, rotations, weights):
+        self.translations = translations
+        self.rotations = rotations
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.translations)
+
+    # translations and rotations of the bones at frame, held after the end
+    def sample(self, frame):
+        frame = min(max(int(frame), 0), len(self) - 1)
+        return self.translations[frame], self.rotations[frame]
+
+    def sample_morphs(self, frame):
+        frame = min(max(int(frame), 0), len(self) - 1)
+        return self.weights[frame]
+
+
+BAKED_ARRAYS = ('translations', 'rotations', 'weights')
+
+# sample motion at every frame into arrays, chunk frames at a time.
+# with directory the arrays are written there as .npy files.
+def bake(motion, directory=None, chunk=1024):
+    count = max(motion.frameCount, 1)
+    shapes = {
+        'translations': (count, len(motion.boneTracks), 3),
+        'rotations': (count, len(motion.boneTracks), 4),
+        'weights': (count, len(motion.morphTracks))
+    }
+
+    arrays = {}
+    for name in BAKED_ARRAYS:
+        if directory:
+            path = os.path.join(directory, name + '.npy')
+            arrays[name] = np.lib.format.open_memmap(path, 'w+', np.float32, shapes[name])
+        else:
+            arrays[name] = np.empty(shapes[name], np.float32)
+
+    for start in range(0, count, chunk):
+        frames = np.arange(start, min(start + chunk, count))
+        arrays['translations'][frames], arrays['rotations'][frames] = motion.sample(frames)
+        arrays['weights'][frames] = motion.sample_morphs(frames)
+
+    for array in arrays.values():
+        if isinstance(array, np.memmap):
+            array.flush()
+
+    return BakedMotion(*[ arrays[name] for name in BAKED_ARRAYS ])
+
+# baked motion of vmd_file applied to model_file, cached in cache_dir by the
+# hashes of both files. the cached arrays are mapped, not read.
+def load_baked(vmd_file, model_file, cache_dir):
+    key = hashlib.sha1(('%s %s' % (cache.file_hash(vmd_file), cache.file_hash(model_file))).encode('ascii')).hexdigest()
+    directory = os.path.join(cache_dir, key)
+
+    if not os.path.isdir(directory):
+        os.makedirs(cache_dir, exist_ok=True)
+        model = loader.load(model_file, lazy=True)
+        motion = Motion(loader.load(vmd_file, columnar=True), model)
+
+        # baked under a temporary name so a broken entry is never read
+        work = tempfile.mkdtemp(dir=cache_dir)
+        try:
+            bake(motion, work)
+            os.rename(work, directory)
+        except OSError:
+            # baked by another process at the same time
+            if not os.path.isdir(directory):
+                raise
+        finally:
+            if os.path.isdir(work):
+                shutil.rmtree(work, ignore_errors=True)
+
+    return BakedMotion(*[ np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in BAKED_ARRAYS ])
+
+
+# index of every name in tracks, -1 for the names not there
+def track_map(tracks, names):
+    index = { name: i for i, name in enumerate(tracks) }
+    return np.array([ index.get(name, -1) for name in names ], np.int64)
+
+# motions of parse_vmd as columns, also when it was not columnar
+def motion_columns(motions):
+    if isinstance(motions, dict):
+        return motions
+
+    columns = loader.ddict()
+    columns.boneNames, columns.boneId = intern([ p.boneName for p in motions ])
+    columns.frameNum = np.array([ p.frameNum for p in motions ], np.uint32)
+    columns.position = np.array([ p.position for p in motions ], np.float32).reshape(-1, 3)
+    columns.rotation = np.array([ p.rotation for p in motions ], np.float32).reshape(-1, 4)
+    columns.interpolation = np.frombuffer(b''.join([ p.interpolation for p in motions ]), np.uint8).reshape(-1, 64)
+    return columns
+
+def morph_columns(morphs):
+    if isinstance(morphs, dict):
+        return morphs
+
+    columns = loader.ddict()
+    columns.morphNames, columns.morphId = intern([ p.morphName for p in morphs ])
+    columns.frameNum = np.array([ p.frameNum for p in morphs ], np.uint32)
+    columns.weight = np.array([ p.weight for p in morphs ], np.float32)
+    return columns
+
+def intern(names):
+    table = list(dict.fromkeys(names))
+    index = { name: i for i, name in enumerate(table) }
+    return table, np.array([ index[name] for name in names ], np.uint32)
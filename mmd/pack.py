@@ -0,0 +1,117 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from . import loader
+
+
+# binary pack of a parsed pmd/pmx model, read back without parsing.
+#   magic       8 bytes
+#   header      version, toc size (uint32)
+#   toc         json: model sections and the place of every array
+#   arrays      raw little endian data, each aligned to ALIGN bytes
+#               from the aligned end of the toc
+# the arrays of a loaded pack are views of the mapped file.
+MAGIC = b'MMDPACK\0'
+VERSION = 1
+HEADER = struct.Struct('<II')
+ALIGN = 16
+
+# sections held as arrays, the others are stored in the toc
+ARRAY_SECTIONS = ('vertices', 'faces')
+
+# model saved as pack to file
+def save(model, file):
+    if isinstance(model, loader.LazyModel):
+        model.resolve()
+
+    if not model.metadata.format in ['pmd', 'pmx']:
+        raise ValueError('ファイルがpmd、pmx形式ではありません')
+
+    arrays = []
+    for name, value in vars(model.vertices).items():
+        if isinstance(value, np.ndarray):
+            arrays.append(('vertices', name, value))
+    arrays.append(('faces', 'indices', model.faces.indices))
+
+    toc = {
+        'model': { name: value for name, value in model.items() if name not in ARRAY_SECTIONS },
+        'vertices': { 'format': model.vertices.format },
+        'arrays': []
+    }
+    toc['model']['metadata'] = dict(model.metadata, base=relative_base(model.metadata.base, file))
+
+    # array offsets are relative to the aligned end of the toc
+    position = 0
+    for section, name, value in arrays:
+        dtype = value.dtype.newbyteorder('<')
+        toc['arrays'].append([section, name, dtype.str, value.shape, position])
+        position = align(position + value.nbytes)
+
+    toc_bytes = json.dumps(toc, ensure_ascii=False, default=encode_entity).encode('utf-8')
+    start = align(len(MAGIC) + HEADER.size + len(toc_bytes))
+
+    with open(file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(VERSION, len(toc_bytes)))
+        f.write(toc_bytes)
+        for (section, name, value), entry in zip(arrays, toc['arrays']):
+            f.write(b'\0' * (start + entry[4] - f.tell()))
+            f.write(np.ascontiguousarray(value, entry[2]).data)
+
+
+# model read from a pack file, vertices and faces are views of the file
+def load(file):
+    dv = loader.DataView.from_file(file)
+
+    try:
+        if bytes(dv.read(len(MAGIC))) != MAGIC:
+            raise ValueError('ファイルがpack形式ではありません')
+
+        version, toc_size = dv.unpack(HEADER)
+        if version != VERSION:
+            raise ValueError('unknown pack version %d.' % (version))
+
+        toc = json.loads(bytes(dv.read(toc_size)).decode('utf-8'), object_hook=decode_entity)
+        start = align(dv.offset)
+
+        arrays = { section: {} for section in ARRAY_SECTIONS }
+        for section, name, dtype, shape, offset in toc['arrays']:
+            dv.seek(start + offset)
+            count = int(np.prod(shape))
+            arrays[section][name] = dv.get_records(dtype, count).reshape(shape)
+    finally:
+        # the mapping stays open while the arrays refer to it
+        dv.close()
+
+    model = toc['model']
+    model.vertices = loader.VertexArrays(toc['vertices']['format'], **arrays['vertices'])
+    model.faces = loader.FaceArrays(arrays['faces']['indices'])
+    model.metadata.base = os.path.normpath(os.path.join(os.path.dirname(file), model.metadata.base))
+    return model
+
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+# textures are found relative to metadata.base, it is kept relative
+# to the pack so that the pack can be moved with them
+def relative_base(base, file):
+    try:
+        return os.path.relpath(os.path.abspath(base), os.path.dirname(os.path.abspath(file)))
+    except ValueError: # another drive
+        return os.path.abspath(base)
+
+# entities are stored as json objects with their class name
+def encode_entity(o):
+    if isinstance(o, loader.Entity):
+        return dict(o.items(), __entity__=type(o).__name__)
+    raise TypeError('%s is not serializable.' % (type(o).__name__))
+
+def decode_entity(o):
+    if '__entity__' in o:
+        cls = getattr(loader, o.pop('__entity__'))
+        return cls(**o)
+    return loader.ddict(o)
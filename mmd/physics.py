@@ -0,0 +1,494 @@
+import time
+
+import numpy as np
+
+from . import loader
+from . import quaternion
+from . import skeleton
+
+
+# rigid body shapes
+SPHERE = 0
+BOX = 1
+CAPSULE = 2
+
+# rigid body types: moved by the bone, simulated, simulated but kept at
+# the position of the bone
+STATIC = 0
+DYNAMIC = 1
+ALIGNED = 2
+
+# gravity in mmd units (about 8 cm)
+GRAVITY = (0.0, -98.0, 0.0)
+
+# phases of the timing report
+PHASES = ('kinematic', 'integrate', 'joints', 'collisions', 'bones')
+
+
+# position based physics of the rigid bodies and joints of a model, for
+# hair and skirt chains without an external engine.
+# every body is simulated by its center, a body hanging from a joint takes
+# its rotation from the body above it. joints keep the distance of the
+# bodies within the translation limits and their direction within the
+# rotation limits, their springs pull back to the rest pose.
+# update runs fixed steps of substeps for the time elapsed and works on the
+# state of skeleton.Skeleton.pose, for a batch of poses (P) at once.
+class Physics(object):
+    def __init__(self, model, sk, step=1.0 / 60, substeps=2, iterations=4, max_steps=4, gravity=GRAVITY):
+        self.skeleton = sk
+        self.step = step
+        self.substeps = substeps
+        self.iterations = iterations
+        self.maxSteps = max_steps
+        self.gravity = np.array(gravity, np.float32)
+
+        # read as attributes so lazy models parse the sections,
+        # old pmd files have neither
+        bodies = model.rigidBodies if 'rigidBodies' in model else []
+        count = len(bodies)
+
+        self.bones = np.array([ body.boneIndex for body in bodies ], np.int64).reshape(-1)
+        self.bones[(self.bones < 0) | (self.bones >= len(sk))] = -1
+        self.kinds = np.array([ body.type for body in bodies ], np.int64).reshape(-1)
+        self.shapes = np.array([ body.shapeType for body in bodies ], np.int64).reshape(-1)
+        self.sizes = np.array([ (body.width, body.height, body.depth) for body in bodies ], np.float32).reshape(-1, 3)
+        masses = np.array([ body.weight for body in bodies ], np.float32).reshape(-1)
+        # dynamic and aligned bodies are moved by the solver, static ones are anchors
+        self.inverseMasses = np.where((self.kinds != STATIC) & (masses > 0), 1 / np.maximum(masses, 1e-6), 0).astype(np.float32)
+        self.damping = np.array([ body.positionDamping for body in bodies ], np.float32).reshape(-1)
+        self.groups = np.array([ 1 << body.groupIndex for body in bodies ], np.int64).reshape(-1)
+        self.masks = np.array([ body.groupTarget for body in bodies ], np.int64).reshape(-1)
+
+        # rest transforms of the bodies, pmd positions are relative to the bone
+        # (bodies without a bone keep theirs)
+        attached = self.bones >= 0
+        positions = np.array([ body.position for body in bodies ], np.float32).reshape(-1, 3)
+        if model.metadata.format == 'pmd':
+            positions[attached] += sk.positions[self.bones[attached]]
+        self.rest = np.tile(np.eye(4, dtype=np.float32), (count, 1, 1))
+        self.rest[:, :3, :3] = euler_matrix(np.array([ body.rotation for body in bodies ], np.float32).reshape(-1, 3))
+        self.rest[:, :3, 3] = positions
+
+        # the bodies relative to their bones, whose rest globals only translate
+        self.offsets = self.rest.copy()
+        self.offsets[attached, :3, 3] -= sk.positions[self.bones[attached]]
+        self.inverseOffsets = np.linalg.inv(self.offsets)
+
+        # bounding sphere radius of every shape for the broad phase
+        self.radii = np.where(self.shapes == BOX, np.linalg.norm(self.sizes, axis=-1),
+            self.sizes[:, 0] + np.where(self.shapes == CAPSULE, self.sizes[:, 1] * 0.5, 0))
+
+        self.dynamic = np.flatnonzero(self.inverseMasses > 0)
+        self.placed = np.flatnonzero(self.inverseMasses == 0)
+        self.compile_joints(model.constraints if 'constraints' in model else [])
+        self.compile_pairs()
+        self.compile_bones()
+
+        self.positions = None
+        self.timings = loader.ddict([ (phase, 0.0) for phase in PHASES ])
+        self.steps = 0
+
+    def __len__(self):
+        return len(self.kinds)
+
+    # joint arrays, the first body (a) is the one the second (b) hangs from:
+    #   lengths, slack: rest distance of the bodies and its allowed change
+    #   cones: allowed angle of b from its rest direction seen from a
+    #   jointOffsets, jointRotations: b relative to a at rest
+    #   stretch, bend: spring stiffness of the distance and the direction
+    def compile_joints(self, joints):
+        count = len(self)
+        rows = []
+        for joint in joints:
+            a, b = joint.rigidBodyIndex1, joint.rigidBodyIndex2
+            if not (0 <= a < count and 0 <= b < count) or a == b:
+                continue
+            if self.kinds[a] != STATIC and self.kinds[b] == STATIC:
+                a, b = b, a
+            rows.append((a, b, joint))
+
+        self.jointA = np.array([ a for a, b, joint in rows ], np.int64)
+        self.jointB = np.array([ b for a, b, joint in rows ], np.int64)
+
+        def column(name):
+            return np.array([ joint[name] for a, b, joint in rows ], np.float32).reshape(-1, 3)
+
+        translations = np.maximum(np.abs(column('translationLimitation1')), np.abs(column('translationLimitation2')))
+        rotations = np.maximum(np.abs(column('rotationLimitation1')), np.abs(column('rotationLimitation2')))
+        self.slack = np.linalg.norm(translations, axis=-1)
+        self.cones = np.minimum(rotations.max(axis=-1, initial=0), np.pi)
+        self.stretch = np.linalg.norm(column('springPosition'), axis=-1)
+        self.bend = np.linalg.norm(column('springRotation'), axis=-1)
+
+        ra = self.rest[self.jointA]
+        rb = self.rest[self.jointB]
+        offsets = rb[:, :3, 3] - ra[:, :3, 3]
+        self.lengths = np.linalg.norm(offsets, axis=-1)
+        self.jointOffsets = np.einsum('jik,ji->jk', ra[:, :3, :3], offsets)
+        self.jointRotations = quaternion.multiply(conjugate(quaternion.from_matrix(ra[:, :3, :3])), quaternion.from_matrix(rb[:, :3, :3]))
+
+        # joints colored so that no two of a color share a body, each color
+        # is solved at once (gauss-seidel by color)
+        colors = np.zeros(len(rows), np.int64)
+        used = [ set() for i in range(count) ]
+        for k, (a, b, joint) in enumerate(rows):
+            color = 0
+            while color in used[a] or color in used[b]:
+                color += 1
+            colors[k] = color
+            used[a].add(color)
+            used[b].add(color)
+        self.colors = [ np.flatnonzero(colors == color) for color in range(colors.max(initial=-1) + 1) ]
+
+        # every simulated body turns with the first joint it hangs from,
+        # parents before children
+        self.anchors = np.full(count, -1, np.int64)
+        parents = np.full(count, -1, np.int64)
+        for k in range(len(rows) - 1, -1, -1):
+            b = self.jointB[k]
+            if self.kinds[b] != STATIC:
+                self.anchors[b] = k
+                parents[b] = self.jointA[k]
+        hanging = np.flatnonzero(parents >= 0)
+        self.levels = skeleton.group_by(hanging, skeleton.tree_depths(parents)[hanging])
+
+    # pairs of bodies that may collide: each one is in a group of the mask of
+    # the other, one of them is dynamic and no joint joins them.
+    # a box comes first in its pair, the pairs are kept by kind:
+    # sphere / capsule pairs, box and sphere / capsule, two boxes
+    def compile_pairs(self):
+        i, j = np.triu_indices(len(self), 1)
+        collide = ((self.groups[i] & self.masks[j]) != 0) & ((self.groups[j] & self.masks[i]) != 0)
+        collide &= (self.inverseMasses[i] + self.inverseMasses[j]) > 0
+        joined = set(zip(np.minimum(self.jointA, self.jointB).tolist(), np.maximum(self.jointA, self.jointB).tolist()))
+        collide &= np.array([ pair not in joined for pair in zip(i.tolist(), j.tolist()) ], bool).reshape(-1)
+        i, j = i[collide], j[collide]
+
+        swap = (self.shapes[j] == BOX) & (self.shapes[i] != BOX)
+        i, j = np.where(swap, j, i), np.where(swap, i, j)
+        boxes = (self.shapes[i] == BOX).astype(np.int64) + (self.shapes[j] == BOX)
+        self.pairs = [ (i[boxes == k], j[boxes == k]) for k in range(3) ]
+
+    # bones moved by the simulated bodies, and the bones below them that
+    # are evaluated before physics, which follow them by tree depth
+    def compile_bones(self):
+        sk = self.skeleton
+        self.driven = np.flatnonzero((self.kinds != STATIC) & (self.bones >= 0))
+        moved = np.zeros(len(sk), bool)
+        moved[self.bones[self.driven]] = True
+
+        following = np.zeros(len(sk), bool)
+        for bone in np.argsort(sk.depths, kind='stable'):
+            parent = sk.parents[bone]
+            if parent >= 0 and (moved[parent] or following[parent]) and not moved[bone]:
+                following[bone] = True
+        following &= (sk.flags & skeleton.AFTER_PHYSICS) == 0
+
+        bones = np.flatnonzero(following)
+        self.followers = skeleton.group_by(bones, sk.depths[bones])
+
+    # advance the simulation by elapsed seconds on state, the globals of the
+    # bones of the simulated bodies and of the bones below them are replaced
+    def update(self, state, elapsed):
+        start = time.perf_counter()
+        positions, orientations = self.kinematic(state)
+        if self.positions is None or self.positions.shape != positions.shape:
+            self.reset(positions, orientations)
+        previous = self.targets
+        self.targets = (positions, orientations)
+        self.timings.kinematic += time.perf_counter() - start
+
+        # fixed steps, the time left over is kept for the next update,
+        # unless the simulation falls behind
+        self.time += elapsed
+        steps = min(int(self.time / self.step), self.maxSteps)
+        self.time = self.time - steps * self.step if steps < self.maxSteps else 0.0
+
+        total = steps * self.substeps
+        for n in range(total):
+            self.substep(previous, self.targets, (n + 1) / total, self.step / self.substeps)
+        self.steps += steps
+
+        start = time.perf_counter()
+        self.write_bones(state)
+        self.timings.bones += time.perf_counter() - start
+
+    # positions and orientations (P, R, ...) of the bodies placed by their bones
+    def kinematic(self, state):
+        transforms = np.broadcast_to(self.rest, (len(state.globals),) + self.rest.shape).copy()
+        attached = self.bones >= 0
+        transforms[:, attached] = state.globals[:, self.bones[attached]] @ self.offsets[attached]
+        return transforms[..., :3, 3], quaternion.from_matrix(transforms[..., :3, :3]).astype(np.float32)
+
+    # bodies at positions and orientations at rest
+    def reset(self, positions, orientations):
+        self.positions = positions.copy()
+        self.orientations = orientations.copy()
+        self.velocities = np.zeros(positions.shape, np.float32)
+        self.targets = (positions, orientations)
+        self.time = 0.0
+
+    def substep(self, previous, targets, ratio, h):
+        start = time.perf_counter()
+        x = self.positions
+        v = self.velocities
+        dynamic = self.dynamic
+        placed = self.placed
+
+        v[:, dynamic] += self.gravity * h
+        v[:, dynamic] *= ((1 - self.damping[dynamic]) ** h)[:, None]
+        last = x[:, dynamic]
+        x[:, dynamic] += v[:, dynamic] * h
+
+        # anchors move from the last targets to the new ones over the step
+        p0, q0 = previous
+        p1, q1 = targets
+        x[:, placed] = p0[:, placed] + (p1[:, placed] - p0[:, placed]) * ratio
+        self.orientations[:, placed] = quaternion.slerp(q0[:, placed], q1[:, placed], ratio)
+        integrated = time.perf_counter()
+        self.timings.integrate += integrated - start
+
+        for i in range(self.iterations):
+            self.solve_joints(h)
+        self.update_orientations()
+        solved = time.perf_counter()
+        self.timings.joints += solved - integrated
+
+        self.solve_collisions()
+        self.timings.collisions += time.perf_counter() - solved
+
+        v[:, dynamic] = (x[:, dynamic] - last) / h
+
+    # hanging bodies turn with their parent body and the direction to it
+    def update_orientations(self):
+        x = self.positions
+        q = self.orientations
+        for bodies in self.levels:
+            k = self.anchors[bodies]
+            a = self.jointA[k]
+            rest = rotate(q[:, a], self.jointOffsets[k])
+            turn = arc(rest, x[:, bodies] - x[:, a])
+            q[:, bodies] = quaternion.multiply(quaternion.multiply(turn, q[:, a]), self.jointRotations[k])
+
+    def solve_joints(self, h):
+        for joints in self.colors:
+            self.solve_joint_color(joints, h)
+
+    def solve_joint_color(self, joints, h):
+        x = self.positions
+        a, b = self.jointA[joints], self.jointB[joints]
+        wa = self.inverseMasses[a]
+        wb = self.inverseMasses[b]
+        w = wa + wb
+        rest_length = self.lengths[joints]
+        slack = self.slack[joints]
+        cone = self.cones[joints]
+
+        offset = x[:, b] - x[:, a]
+        length = np.linalg.norm(offset, axis=-1)
+        direction = offset / np.maximum(length, 1e-6)[..., None]
+        rest = rotate(self.orientations[:, a], self.jointOffsets[joints])
+        rest /= np.maximum(np.linalg.norm(rest, axis=-1, keepdims=True), 1e-6)
+
+        # the direction is turned back inside the cone of the rotation limits
+        angle = np.arccos(np.minimum(np.maximum(np.sum(direction * rest, axis=-1), -1.0), 1.0))
+        limited = np.minimum(angle, cone)
+        sin = np.maximum(np.sin(angle), 1e-6)[..., None]
+        inside = (angle - limited < 1e-6)[..., None]
+        direction = np.where(inside, direction,
+            (rest * np.sin(angle - limited)[..., None] + direction * np.sin(limited)[..., None]) / sin)
+
+        # the springs pull the direction and the length back to rest (xpbd)
+        bend = spring_ratio(self.bend[joints], w, h)[..., None]
+        direction = direction + (rest - direction) * bend
+        direction /= np.maximum(np.linalg.norm(direction, axis=-1, keepdims=True), 1e-6)
+
+        length = np.minimum(np.maximum(length, rest_length - slack), rest_length + slack)
+        length = length + (rest_length - length) * spring_ratio(self.stretch[joints], w, h)
+
+        correction = (direction * length[..., None] - offset) / np.maximum(w, 1e-6)[:, None]
+        x[:, a] -= correction * wa[:, None]
+        x[:, b] += correction * wb[:, None]
+
+    def solve_collisions(self):
+        x = self.positions
+        delta = np.zeros(x.shape, np.float32)
+        counts = np.zeros(x.shape[:2], np.float32)
+
+        for kind, (i, j) in enumerate(self.pairs):
+            # broad phase on the bounding spheres
+            near = np.linalg.norm(x[:, j] - x[:, i], axis=-1) < self.radii[i] + self.radii[j]
+            keep = np.flatnonzero(np.any(near, axis=0))
+            if not len(keep):
+                continue
+            i, j = i[keep], j[keep]
+
+            if kind == 0:
+                normals, depths = self.round_contacts(i, j)
+            else:
+                normals, depths = self.box_contacts(i, j, kind == 2)
+
+            touching = depths > 0
+            wi = self.inverseMasses[i]
+            wj = self.inverseMasses[j]
+            share = (1 / np.maximum(wi + wj, 1e-6))
+            push = normals * (np.maximum(depths, 0) * share)[..., None]
+            np.add.at(delta, (slice(None), i), -push * wi[:, None])
+            np.add.at(delta, (slice(None), j), push * wj[:, None])
+            np.add.at(counts, (slice(None), i), touching)
+            np.add.at(counts, (slice(None), j), touching)
+
+        x += delta / np.maximum(counts, 1)[..., None]
+
+    # segments (P, K, 3) x 2 and radii of spheres and capsules,
+    # capsules lie along their local y
+    def segments(self, bodies):
+        center = self.positions[:, bodies]
+        half = self.sizes[bodies, 1] * 0.5 * (self.shapes[bodies] == CAPSULE)
+        axis = quaternion.to_matrix(self.orientations[:, bodies])[..., :, 1] * half[:, None]
+        return center - axis, center + axis, self.sizes[bodies, 0]
+
+    # normals from i to j and penetration depths of sphere / capsule pairs
+    def round_contacts(self, i, j):
+        p1, q1, ri = self.segments(i)
+        p2, q2, rj = self.segments(j)
+        ci, cj = closest_segment_points(p1, q1, p2, q2)
+        return separation(cj - ci, ri + rj)
+
+    # i are boxes, j spheres / capsules or boxes taken as the sphere
+    # inside them
+    def box_contacts(self, i, j, boxes):
+        center = self.positions[:, i]
+        rotation = quaternion.to_matrix(self.orientations[:, i])
+        extents = self.sizes[i]
+
+        if boxes:
+            point = self.positions[:, j]
+            radius = self.sizes[j].min(axis=-1)
+        else:
+            p, q, radius = self.segments(j)
+            point = closest_point(p, q, center)
+
+        local = np.einsum('pkji,pkj->pki', rotation, point - center)
+        clamped = np.minimum(np.maximum(local, -extents), extents)
+        normals, depths = separation(local - clamped, radius)
+
+        # a point inside the box leaves by the nearest face
+        room = extents - np.abs(local)
+        face = np.argmin(room, axis=-1)
+        inside = np.all(room > 0, axis=-1)
+        exit = np.zeros(local.shape, np.float32)
+        np.put_along_axis(exit, face[..., None], np.where(np.take_along_axis(local, face[..., None], -1) < 0, -1.0, 1.0), -1)
+        normals = np.where(inside[..., None], exit, normals)
+        depths = np.where(inside, radius + np.take_along_axis(room, face[..., None], -1)[..., 0], depths)
+
+        return np.einsum('pkij,pkj->pki', rotation, normals), depths
+
+    # globals of the bones of the simulated bodies, aligned bodies keep the
+    # position of their bone
+    def write_bones(self, state):
+        bodies = self.driven
+        if not len(bodies):
+            return
+
+        bones = self.bones[bodies]
+        transforms = np.tile(np.eye(4, dtype=np.float32), (len(self.positions), len(bodies), 1, 1))
+        transforms[..., :3, :3] = quaternion.to_matrix(self.orientations[:, bodies])
+        transforms[..., :3, 3] = self.positions[:, bodies]
+        globals = transforms @ self.inverseOffsets[bodies]
+
+        aligned = self.kinds[bodies] == ALIGNED
+        globals[:, aligned, :3, 3] = state.globals[:, bones[aligned], :3, 3]
+        state.globals[:, bones] = globals
+
+        for level in self.followers:
+            self.skeleton.update_globals(state, level)
+
+    # time spent in each phase, in total and per fixed step
+    def report(self):
+        steps = max(self.steps, 1)
+        lines = [ '%d steps' % self.steps ]
+        for phase in PHASES:
+            total = self.timings[phase] * 1000
+            lines.append('%-10s %10.3f ms %8.3f ms/step' % (phase, total, total / steps))
+        return '\n'.join(lines)
+
+
+# rotation matrices of mmd euler angles (..., 3), applied z, x then y
+def euler_matrix(angles):
+    x, y, z = np.moveaxis(angles, -1, 0)
+    cx, sx = np.cos(x), np.sin(x)
+    cy, sy = np.cos(y), np.sin(y)
+    cz, sz = np.cos(z), np.sin(z)
+    m = np.stack([
+        cy * cz + sy * sx * sz, sy * sx * cz - cy * sz, sy * cx,
+        cx * sz, cx * cz, -sx,
+        cy * sx * sz - sy * cz, sy * sz + cy * sx * cz, cy * cx
+    ], axis=-1)
+    return m.reshape(angles.shape[:-1] + (3, 3))
+
+def conjugate(q):
+    return q * np.array([-1, -1, -1, 1], np.float32)
+
+# vectors v (..., 3) rotated by q
+def rotate(q, v):
+    u = q[..., :3]
+    t = 2 * cross(u, v)
+    return v + q[..., 3:] * t + cross(u, t)
+
+def cross(a, b):
+    ax, ay, az = a[..., 0], a[..., 1], a[..., 2]
+    bx, by, bz = b[..., 0], b[..., 1], b[..., 2]
+    return np.stack([ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx], axis=-1)
+
+# shortest rotations (..., 4) from directions u to v
+def arc(u, v):
+    u = quaternion.normalize(u)
+    v = quaternion.normalize(v)
+    q = np.concatenate([cross(u, v), 1 + np.sum(u * v, axis=-1, keepdims=True)], axis=-1)
+    # opposite directions turn half around an axis normal to u
+    opposite = q[..., 3:] < 1e-6
+    if np.any(opposite):
+        normal = cross(u, np.where(np.abs(u[..., :1]) < 0.9, [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]))
+        q = np.where(opposite, np.concatenate([normal, np.zeros(q[..., 3:].shape)], axis=-1), q)
+    return quaternion.normalize(q).astype(np.float32)
+
+# part of the way back to rest a spring of stiffness k takes in a substep
+# h for the inverse mass w, 0 without a spring
+def spring_ratio(k, w, h):
+    kh = k * w * h * h
+    return kh / (kh + 1)
+
+# unit normals along d (P, K, 3) and how much shorter d is than reach
+def separation(d, reach):
+    distance = np.linalg.norm(d, axis=-1)
+    normals = np.where(distance[..., None] > 1e-6, d / np.maximum(distance, 1e-6)[..., None], [0.0, 1.0, 0.0])
+    return normals, reach - distance
+
+# closest points of the segments p to q and the points c
+def closest_point(p, q, c):
+    d = q - p
+    t = np.sum((c - p) * d, axis=-1) / np.maximum(np.sum(d * d, axis=-1), 1e-12)
+    return p + d * np.minimum(np.maximum(t, 0.0), 1.0)[..., None]
+
+# closest points of the segments p1 to q1 and p2 to q2
+def closest_segment_points(p1, q1, p2, q2):
+    d1 = q1 - p1
+    d2 = q2 - p2
+    r = p1 - p2
+    a = np.sum(d1 * d1, axis=-1)
+    e = np.sum(d2 * d2, axis=-1)
+    f = np.sum(d2 * r, axis=-1)
+    c = np.sum(d1 * r, axis=-1)
+    b = np.sum(d1 * d2, axis=-1)
+
+    denominator = a * e - b * b
+    s = np.where(denominator > 1e-12, (b * f - c * e) / np.maximum(denominator, 1e-12), 0.0)
+    s = np.minimum(np.maximum(s, 0.0), 1.0)
+    t = (b * s + f) / np.maximum(e, 1e-12)
+
+    # t outside the second segment is clamped and s found again
+    s = np.where(t < 0, -c / np.maximum(a, 1e-12), np.where(t > 1, (b - c) / np.maximum(a, 1e-12), s))
+    s = np.minimum(np.maximum(s, 0.0), 1.0)
+    t = np.minimum(np.maximum(t, 0.0), 1.0)
+    return p1 + d1 * s[..., None], p2 + d2 * t[..., None]
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+# quaternion operations on arrays of quaternions (..., 4).
+# quaternions are (x, y, z, w) like in the pmx / vmd files,
+# matrices rotate column vectors.
+
+def normalize(q):
+    return q / np.maximum(np.linalg.norm(q, axis=-1, keepdims=True), 1e-12)
+
+# rotation matrices (..., 3, 3)
+def to_matrix(q):
+    x, y, z, w = np.moveaxis(q, -1, 0)
+    m = np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+        2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+        2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)
+    ], axis=-1)
+    return m.reshape(q.shape[:-1] + (3, 3))
+
+# quaternions of rotation matrices (..., 3, 3), the largest of w, x, y, z
+# is computed from the diagonal to keep the precision
+def from_matrix(m):
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+
+    candidates = np.stack([
+        np.stack([m21 - m12, m02 - m20, m10 - m01, 1 + m00 + m11 + m22], axis=-1),
+        np.stack([1 + m00 - m11 - m22, m01 + m10, m02 + m20, m21 - m12], axis=-1),
+        np.stack([m01 + m10, 1 - m00 + m11 - m22, m12 + m21, m02 - m20], axis=-1),
+        np.stack([m02 + m20, m12 + m21, 1 - m00 - m11 + m22, m10 - m01], axis=-1)
+    ], axis=-2)
+
+    diagonal = np.stack([m00 + m11 + m22, m00, m11, m22], axis=-1)
+    best = np.argmax(diagonal, axis=-1)[..., None, None]
+    q = np.take_along_axis(candidates, best, axis=-2)[..., 0, :]
+    return normalize(q)
+
+def multiply(a, b):
+    ax, ay, az, aw = np.moveaxis(a, -1, 0)
+    bx, by, bz, bw = np.moveaxis(b, -1, 0)
+    return np.stack([
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+        aw * bw - ax * bx - ay * by - az * bz
+    ], axis=-1)
+
+# spherical interpolation from a to b by t (...), along the shorter arc
+def slerp(a, b, t):
+    t = np.asarray(t)[..., None]
+    dot = np.sum(a * b, axis=-1, keepdims=True)
+    b = np.where(dot < 0, -b, b)
+    dot = np.minimum(np.abs(dot), 1.0)
+
+    theta = np.arccos(dot)
+    sin = np.sin(theta)
+    # nearly the same rotation, linear interpolation is enough
+    near = sin < 1e-6
+    sin = np.where(near, 1.0, sin)
+    s0 = np.where(near, 1 - t, np.sin((1 - t) * theta) / sin)
+    s1 = np.where(near, t, np.sin(t * theta) / sin)
+    return normalize(s0 * a + s1 * b)
@@ -0,0 +1,221 @@
+import numpy as np
+
+from . import loader
+from . import quaternion
+
+
+# pmx bone flags
+CONNECT = 0x1
+ROTATABLE = 0x2
+MOVABLE = 0x4
+VISIBLE = 0x8
+CONTROLLABLE = 0x10
+IK = 0x20
+LOCAL_GRANT = 0x80
+GRANT_ROTATION = 0x100
+GRANT_TRANSLATION = 0x200
+FIX_AXIS = 0x400
+LOCAL_AXIS = 0x800
+AFTER_PHYSICS = 0x1000
+EXTERNAL_PARENT = 0x2000
+
+
+# bone hierarchy of a model with the evaluation order computed once.
+# bones are evaluated in stages of the same (after physics, deform layer),
+# inside a stage level by level of the tree depth, so all bones of a
+# level are one batched matrix product.
+# poses are local translations (P, B, 3) and rotations (P, B, 4) from the
+# rest pose, as given by motion.Motion.sample, or (B, 3) / (B, 4).
+class Skeleton(object):
+    def __init__(self, model):
+        bones = model.bones
+        count = len(bones)
+        self.names = [ bone.name for bone in bones ]
+
+        self.parents = np.array([ bone.parentIndex for bone in bones ], np.int64).reshape(-1)
+        self.parents[(self.parents < 0) | (self.parents >= count)] = -1
+        self.positions = np.array([ bone.position for bone in bones ], np.float32).reshape(-1, 3)
+        self.depths = tree_depths(self.parents)
+        # bones of a parent loop are taken as roots where the loop is entered
+        self.parents[self.depths == 0] = -1
+
+        # rest offset of each bone from its parent
+        self.offsets = self.positions.copy()
+        child = self.parents >= 0
+        self.offsets[child] -= self.positions[self.parents[child]]
+
+        self.flags = np.array([ bone.get('flag', 0) for bone in bones ], np.int64)
+        self.layers = np.array([ bone.get('transformationClass', 0) for bone in bones ], np.int64)
+
+        # grant (付与): part of the rotation / translation of another bone
+        # is added to the bone by ratio
+        self.grantParents = np.full(count, -1, np.int64)
+        self.grantRatios = np.zeros(count, np.float32)
+        for i, bone in enumerate(bones):
+            grant = bone.get('grant')
+            if grant and 0 <= grant.parentIndex < count and grant.parentIndex != i:
+                self.grantParents[i] = grant.parentIndex
+                self.grantRatios[i] = grant.ratio
+
+        self.grantDepths = tree_depths(self.grantParents)
+        self.stages = self.evaluation_stages()
+
+    def __len__(self):
+        return len(self.names)
+
+    # stages of the same (after physics, deform layer) in evaluation order,
+    #   levels: bones of the same tree depth, parents before children
+    #   grants: bones with a grant, grant parents before them
+    def evaluation_stages(self):
+        stages = []
+        after = (self.flags & AFTER_PHYSICS) != 0
+        keys = sorted(set(zip(after.tolist(), self.layers.tolist())))
+        for after_physics, layer in keys:
+            bones = np.flatnonzero((after == after_physics) & (self.layers == layer))
+
+            stage = loader.ddict()
+            stage.afterPhysics = after_physics
+            stage.layer = layer
+            stage.bones = bones
+            stage.levels = group_by(bones, self.depths[bones])
+
+            granted = bones[self.grantParents[bones] >= 0]
+            stage.grants = group_by(granted, self.grantDepths[granted])
+            stages.append(stage)
+
+        return stages
+
+    # global matrices (P, B, 4, 4) of the poses, (B, 4, 4) for a single pose.
+    # with ik (an ik.IKSolver) its chains are solved in their stages,
+    # with physics (a physics.Physics) it is advanced by elapsed seconds
+    # between the stages before and after physics.
+    def pose(self, translations, rotations, ik=None, physics=None, elapsed=0.0):
+        state = self.state(translations, rotations)
+        simulated = physics is None
+        for stage in self.stages:
+            if stage.afterPhysics and not simulated:
+                physics.update(state, elapsed)
+                simulated = True
+            self.update_stage(state, stage, ik)
+
+        if not simulated:
+            physics.update(state, elapsed)
+
+        if state.single:
+            return state.globals[0]
+        return state.globals
+
+    # working arrays of a batch of poses
+    def state(self, translations, rotations):
+        translations = np.asarray(translations, np.float32)
+        rotations = np.asarray(rotations, np.float32)
+        single = translations.ndim == 2
+        if single:
+            translations = translations[None]
+            rotations = rotations[None]
+
+        count = len(translations)
+        state = loader.ddict()
+        state.single = single
+        state.translations = translations
+        state.rotations = rotations
+        # rotations added by the ik solver, the grants and their translations
+        state.ikRotations = identity_quaternions((count, len(self)))
+        state.grantRotations = identity_quaternions((count, len(self)))
+        state.grantTranslations = np.zeros((count, len(self), 3), np.float32)
+
+        state.locals = np.tile(np.eye(4, dtype=np.float32), (count, len(self), 1, 1))
+        state.globals = state.locals.copy()
+        state.globals[..., :3, 3] = self.positions
+        return state
+
+    def update_stage(self, state, stage, ik=None):
+        for bones in stage.grants:
+            self.update_grants(state, bones)
+
+        self.update_locals(state, stage.bones)
+        for bones in stage.levels:
+            self.update_globals(state, bones)
+
+        if ik:
+            ik.solve(state, stage)
+
+    # grant of the bones from their grant parents. a grant parent that has
+    # a grant itself passes on only its granted part, unless it is local.
+    def update_grants(self, state, bones):
+        parents = self.grantParents[bones]
+        ratios = self.grantRatios[bones]
+        flags = self.flags[bones]
+        local = (flags & LOCAL_GRANT) != 0
+        chained = ~local & (self.grantParents[parents] >= 0)
+
+        rotate = (flags & GRANT_ROTATION) != 0
+        if np.any(rotate):
+            source = np.where(chained[:, None], state.grantRotations[:, parents], state.rotations[:, parents])
+            source = quaternion.multiply(state.ikRotations[:, parents], source)
+            identity = identity_quaternions(source.shape[:-1])
+            q = quaternion.slerp(identity, source, ratios)
+            state.grantRotations[:, bones[rotate]] = q[:, rotate]
+
+        translate = (flags & GRANT_TRANSLATION) != 0
+        if np.any(translate):
+            source = np.where(chained[:, None], state.grantTranslations[:, parents], state.translations[:, parents])
+            state.grantTranslations[:, bones[translate]] = (source * ratios[:, None])[:, translate]
+
+    # local matrices of the bones from the pose, ik and grants
+    def update_locals(self, state, bones):
+        q = quaternion.multiply(state.ikRotations[:, bones], state.rotations[:, bones])
+        q = quaternion.multiply(q, state.grantRotations[:, bones])
+
+        local = state.locals[:, bones]
+        local[..., :3, :3] = quaternion.to_matrix(q)
+        local[..., :3, 3] = self.offsets[bones] + state.translations[:, bones] + state.grantTranslations[:, bones]
+        state.locals[:, bones] = local
+
+    # globals of the bones of one tree depth from their parents,
+    # depth 0 holds only roots
+    def update_globals(self, state, bones):
+        parents = self.parents[bones]
+        if parents[0] < 0:
+            state.globals[:, bones] = state.locals[:, bones]
+        else:
+            state.globals[:, bones] = state.globals[:, parents] @ state.locals[:, bones]
+
+    # skinning matrices (global x inverse bind) for skinning.Skin,
+    # the bind pose only moves each bone to its rest position
+    def skinning_matrices(self, globals):
+        matrices = np.array(globals, np.float32)
+        matrices[..., :3, 3] -= np.einsum('...ij,...j->...i', matrices[..., :3, :3], self.positions)
+        return matrices
+
+
+def identity_quaternions(shape):
+    q = np.zeros(tuple(shape) + (4,), np.float32)
+    q[..., 3] = 1
+    return q
+
+# depth of every node of a forest given by parents (-1 for roots),
+# nodes in a loop are taken as roots
+def tree_depths(parents):
+    depths = np.full(len(parents), -1, np.int64)
+    for i in range(len(parents)):
+        path = []
+        node = i
+        while node >= 0 and depths[node] < 0 and node not in path:
+            path.append(node)
+            node = parents[node]
+
+        depth = depths[node] if node >= 0 and depths[node] >= 0 else -1
+        for node in reversed(path):
+            depth += 1
+            depths[node] = depth
+
+    return depths
+
+# items split into arrays of the same key, in the order of the keys
+def group_by(items, keys):
+    order = np.argsort(keys, kind='stable')
+    items = items[order]
+    keys = keys[order]
+    splits = np.flatnonzero(np.diff(keys)) + 1
+    return [ group for group in np.split(items, splits) if len(group) ]
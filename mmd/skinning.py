@@ -0,0 +1,122 @@
+import numpy as np
+
+from . import quaternion
+
+
+# linear blend skinning of the vertices of a model on the cpu.
+# the bone weights are packed once, deform then moves every vertex for
+# an array of skinning matrices (bone world matrix x inverse bind matrix).
+#   matrices: (B, 4, 4) or a batch of poses (P, B, 4, 4),
+#             column vectors, the translation is matrices[..., :3, 3]
+# pmx SDEF vertices are deformed apart from the others, see deform_sdef.
+class Skin(object):
+    def __init__(self, vertices):
+        count = len(vertices)
+        self.positions = np.ascontiguousarray(vertices.positions, np.float32)
+        self.normals = np.ascontiguousarray(vertices.normals, np.float32)
+
+        # pmd has 2 weights per vertex, pmx is already padded to 4
+        self.indices = np.zeros((count, 4), np.int32)
+        self.weights = np.zeros((count, 4), np.float32)
+        width = vertices.skinIndices.shape[1]
+        self.indices[:, :width] = vertices.skinIndices
+        self.weights[:, :width] = vertices.skinWeights
+
+        sdef = np.zeros(count, bool)
+        if vertices.format == 'pmx':
+            sdef = vertices.types == 3
+        self.sdef = self.prepare_sdef(vertices, np.flatnonzero(sdef))
+
+        # vertices with a weight in each slot, BDEF1 vertices only
+        # appear in the first one
+        self.slots = []
+        for k in range(4):
+            rows = np.flatnonzero(self.weights[:, k] * ~sdef)
+            if len(rows) == len(self.weights):
+                rows = slice(None)
+            self.slots.append((rows, self.indices[rows, k], self.weights[rows, k, None, None]))
+
+    # SDEF parameters of the rows, the rotation center C and the points
+    # R0, R1 are corrected so that their weighted mean is C.
+    # the halfway points between C and R0 / R1 are used in deform_sdef.
+    def prepare_sdef(self, vertices, rows):
+        if not len(rows):
+            return None
+
+        w0 = self.weights[rows, 0, None]
+        w1 = 1 - w0
+        c = vertices.skinC[rows].astype(np.float32)
+        r0 = vertices.skinR0[rows]
+        r1 = vertices.skinR1[rows]
+        rw = r0 * w0 + r1 * w1
+        r0 = c + r0 - rw
+        r1 = c + r1 - rw
+
+        return (rows, self.indices[rows, 0], self.indices[rows, 1], w0, c, (c + r0) * 0.5, (c + r1) * 0.5)
+
+    def __len__(self):
+        return len(self.positions)
+
+    # per vertex blend of the matrices, (P, N, 3, 4)
+    def blend(self, matrices):
+        blended = np.zeros((len(matrices), len(self), 3, 4), np.float32)
+        for rows, bones, weights in self.slots:
+            blended[:, rows] += weights * matrices[:, bones, :3]
+        return blended
+
+    # skinned positions (N, 3) or (P, N, 3) for a batch of poses,
+    # with normals also the skinned normals are returned.
+    # chunk poses are blended at a time to bound the memory.
+    def deform(self, matrices, normals=False, chunk=16):
+        matrices = np.asarray(matrices, np.float32)
+        single = matrices.ndim == 3
+        if single:
+            matrices = matrices[None]
+
+        positions = np.empty((len(matrices), len(self), 3), np.float32)
+        skinned_normals = np.empty_like(positions) if normals else None
+
+        for start in range(0, len(matrices), chunk):
+            end = start + chunk
+            blended = self.blend(matrices[start:end])
+            positions[start:end] = np.einsum('pnij,nj->pni', blended[..., :3], self.positions) + blended[..., 3]
+            if normals:
+                skinned_normals[start:end] = rotate_normals(blended, self.normals)
+
+            if self.sdef is not None:
+                self.deform_sdef(matrices[start:end], positions[start:end], skinned_normals[start:end] if normals else None)
+
+        if single:
+            positions = positions[0]
+            skinned_normals = skinned_normals[0] if normals else None
+
+        if normals:
+            return positions, skinned_normals
+        return positions
+
+
+    # SDEF: the vertex is rotated around C by the slerp of the two bone
+    # rotations and moved by the blend of the bones applied to the halfway
+    # points, so the joint keeps its volume instead of collapsing.
+    # positions / normals (P, N, 3) are overwritten at the SDEF rows.
+    def deform_sdef(self, matrices, positions, normals=None):
+        rows, bones0, bones1, w0, c, cr0, cr1 = self.sdef
+        m0 = matrices[:, bones0]
+        m1 = matrices[:, bones1]
+
+        rotations = quaternion.from_matrix(matrices[..., :3, :3])
+        q = quaternion.slerp(rotations[:, bones0], rotations[:, bones1], 1 - w0[:, 0])
+        r = quaternion.to_matrix(q).astype(np.float32)
+
+        p0 = np.einsum('psij,sj->psi', m0[..., :3, :3], cr0) + m0[..., :3, 3]
+        p1 = np.einsum('psij,sj->psi', m1[..., :3, :3], cr1) + m1[..., :3, 3]
+        positions[:, rows] = np.einsum('psij,sj->psi', r, self.positions[rows] - c) + p0 * w0 + p1 * (1 - w0)
+
+        if normals is not None:
+            normals[:, rows] = quaternion.normalize(np.einsum('psij,sj->psi', r, self.normals[rows]))
+
+
+def rotate_normals(blended, normals):
+    n = np.einsum('pnij,nj->pni', blended[..., :3], normals)
+    n /= np.maximum(np.linalg.norm(n, axis=-1, keepdims=True), 1e-12)
+    return n
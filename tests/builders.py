@@ -0,0 +1,235 @@
+import random
+import struct
+
+import numpy as np
+
+from mmd import loader
+
+
+# small pmd / pmx / vmd files for the tests, the same arguments always
+# give the same bytes.
+# the models have a leg ik chain (センター, 左足, 左ひざ, 左足首, 左足ＩＫ),
+# three rigid bodies on the first bones and joints between them.
+
+LEG_BONES = ('センター', '左足', '左ひざ', '左足首', '左足ＩＫ')
+
+
+def sjis(s, n):
+    b = s.encode('cp932')
+    return (b + b'\0' + b'\xfd' * n)[:n]
+
+def floats(*values):
+    return struct.pack('<%df' % len(values), *values)
+
+def text(s):
+    b = s.encode('utf-16-le')
+    return struct.pack('<I', len(b)) + b
+
+def index(size, value, unsigned=False):
+    c = { 1: 'b', 2: 'h', 4: 'i' }[size]
+    if unsigned and size != 4:
+        c = c.upper()
+    return struct.pack('<' + c, value)
+
+
+def make_pmd(path, vertices=50, physics=True, seed=1):
+    rng = random.Random(seed)
+    def values(n):
+        return [ round(rng.uniform(-5, 5), 3) for i in range(n) ]
+
+    b = b'Pmd' + floats(1.0) + sjis('テストモデル', 20) + sjis('コメント', 256)
+    b += struct.pack('<I', vertices)
+    for i in range(vertices):
+        b += floats(*values(3)) + floats(*values(3)) + floats(rng.random(), rng.random())
+        b += struct.pack('<HHBB', rng.randrange(4), rng.randrange(4), rng.randrange(101), rng.randrange(2))
+
+    faces = [ rng.randrange(vertices) for i in range(90) ] if vertices else []
+    b += struct.pack('<I', len(faces)) + struct.pack('<%dH' % len(faces), *faces)
+
+    counts = [10, 15, 5] if faces else [0, 0, 0]
+    names = ['tex0.bmp', '', 'tex1.bmp*sph.sph']
+    b += struct.pack('<I', 3)
+    for i in range(3):
+        b += floats(*values(4)) + floats(1.5) + floats(*values(3)) + floats(*values(3))
+        b += struct.pack('<bBI', i - 1, 1, counts[i] * 3) + sjis(names[i], 20)
+
+    b += struct.pack('<H', len(LEG_BONES))
+    for i, name in enumerate(LEG_BONES):
+        b += sjis(name, 20) + struct.pack('<hhBh', i - 1 if i < 4 else -1, -1, 0, 0) + floats(0, 10 - 2 * i, 0)
+
+    b += struct.pack('<H', 1)
+    b += struct.pack('<HHBHf', 4, 3, 2, 40, 0.5) + struct.pack('<HH', 2, 1)
+
+    # base morph and two morphs relative to it
+    morphs = [ (0, [ (i, values(3)) for i in range(min(4, vertices)) ]) ]
+    if vertices:
+        morphs += [ (1 + k, [ (i + k, values(3)) for i in range(2) ]) for k in range(2) ]
+    b += struct.pack('<H', len(morphs))
+    for k, (type, elements) in enumerate(morphs):
+        b += sjis('base' if not type else 'm%d' % (k - 1), 20) + struct.pack('<IB', len(elements), type)
+        for i, position in elements:
+            b += struct.pack('<I', i) + floats(*position)
+
+    b += struct.pack('<B', 2) + struct.pack('<HH', 1, 2)
+    b += struct.pack('<B', 2) + sjis('frame0', 50) + sjis('frame1', 50)
+    b += struct.pack('<I', 2) + struct.pack('<hB', 1, 1) + struct.pack('<hB', 2, 2)
+
+    b += struct.pack('<B', 1) + sjis('TestModel', 20) + sjis('comment', 256)
+    for name in LEG_BONES:
+        b += sjis('e' + str(len(name)), 20)
+    for i in range(len(morphs) - 1):
+        b += sjis('em%d' % i, 20)
+    b += sjis('ef0', 50) + sjis('ef1', 50)
+    for i in range(10):
+        b += sjis('toon%02d.bmp' % (i + 1), 100)
+
+    if physics:
+        b += struct.pack('<I', 2)
+        for i in range(2):
+            b += sjis('rb%d' % i, 20) + struct.pack('<hBHB', i, i, 0xffff, i) + floats(1, 2, 3)
+            b += floats(*values(3)) + floats(*values(3)) + floats(1, .5, .5, 0, .5) + struct.pack('<B', i)
+        b += struct.pack('<I', 1)
+        b += sjis('joint', 20) + struct.pack('<II', 0, 1) + floats(*values(24))
+
+    with open(path, 'wb') as f:
+        f.write(b)
+    return path
+
+
+def make_pmx(path, vertices=60, vertex_index=2, bone_index=2, additional_uvs=1, seed=1):
+    rng = random.Random(seed)
+    def values(n):
+        return [ round(rng.uniform(-5, 5), 3) for i in range(n) ]
+
+    b = b'PMX ' + floats(2.0) + struct.pack('<9B', 8, 0, additional_uvs, vertex_index, 1, 1, bone_index, 1, 1)
+    b += text('モデル') + text('model') + text('コメント\r\n') + text('comment')
+
+    # BDEF1, BDEF2, BDEF4 and SDEF in turn
+    b += struct.pack('<I', vertices)
+    for i in range(vertices):
+        b += floats(*values(3)) + floats(*values(3)) + floats(rng.random(), rng.random())
+        for k in range(additional_uvs):
+            b += floats(*values(4))
+        type = i % 4
+        b += struct.pack('<B', type)
+        if type == 0:
+            b += index(bone_index, rng.randrange(5))
+        elif type == 1:
+            b += index(bone_index, rng.randrange(5)) + index(bone_index, rng.randrange(5)) + floats(rng.random())
+        elif type == 2:
+            b += b''.join([ index(bone_index, rng.randrange(5)) for k in range(4) ]) + floats(.4, .3, .2, .1)
+        else:
+            b += index(bone_index, 1) + index(bone_index, 2) + floats(rng.random()) + floats(*values(9))
+        b += floats(1.0)
+
+    faces = [ rng.randrange(vertices) for i in range(120) ] if vertices else []
+    b += struct.pack('<I', len(faces)) + b''.join([ index(vertex_index, v, True) for v in faces ])
+
+    textures = ['tex/a.png', 'b.png', 'toon.bmp']
+    b += struct.pack('<I', len(textures)) + b''.join([ text(t) for t in textures ])
+
+    counts = [20, 10, 10] if faces else [0, 0, 0]
+    b += struct.pack('<I', 3)
+    for i in range(3):
+        b += text('mat%d' % i) + text('') + floats(*values(4)) + floats(*values(3)) + floats(5.0) + floats(*values(3))
+        b += struct.pack('<B', 1) + floats(*values(4)) + floats(1.0)
+        b += index(1, i - 1 if i else 0) + index(1, -1) + struct.pack('<BB', 0, i % 2)
+        b += index(1, 2) if i % 2 == 0 else struct.pack('<b', 3)
+        b += text('memo') + struct.pack('<I', counts[i] * 3)
+
+    # the last bone gets half the rotation and translation of 左足
+    bones = [ (name, parent, flag) for name, parent, flag in zip(LEG_BONES, (-1, 0, 1, 2, 0), (0x7, 0x3, 0x802, 0x403, 0x26)) ]
+    bones.append(('付与', 0, 0x2 | 0x100 | 0x200 | 0x2000))
+    b += struct.pack('<I', len(bones))
+    for i, (name, parent, flag) in enumerate(bones):
+        b += text(name) + text('') + floats(0, 10 - 2 * i, 0) + index(bone_index, parent)
+        b += struct.pack('<IH', 0 if i != 5 else 1, flag)
+        b += index(bone_index, -1) if flag & 0x1 else floats(0, -1, 0)
+        if flag & 0x300:
+            b += index(bone_index, 1) + floats(0.5)
+        if flag & 0x400:
+            b += floats(1, 0, 0)
+        if flag & 0x800:
+            b += floats(1, 0, 0) + floats(0, 0, 1)
+        if flag & 0x2000:
+            b += struct.pack('<I', 7)
+        if flag & 0x20:
+            b += index(bone_index, 3) + struct.pack('<I', 40) + floats(2.0) + struct.pack('<I', 2)
+            b += index(bone_index, 2) + struct.pack('<B', 1) + floats(-3.14, 0, 0) + floats(-0.01, 0, 0)
+            b += index(bone_index, 1) + struct.pack('<B', 0)
+
+    morphs = [ (0, [ index(1, 1) + floats(0.5), index(1, 2) + floats(1.0) ]) ]
+    if vertices:
+        morphs.append((1, [ index(vertex_index, i, True) + floats(*values(3)) for i in (3, 1, 2) ]))
+        morphs.append((3, [ index(vertex_index, i, True) + floats(*values(4)) for i in (0, 5) ]))
+    morphs.append((2, [ index(bone_index, 1) + floats(*values(3)) + floats(0, 0, 0, 1) ]))
+    morphs.append((8, [ index(1, m) + struct.pack('<B', t) + floats(*values(28)) for m, t in ((0, 0), (-1, 1)) ]))
+    b += struct.pack('<I', len(morphs))
+    for i, (type, elements) in enumerate(morphs):
+        b += text('morph%d' % i) + text('') + struct.pack('<BBI', 1, type, len(elements)) + b''.join(elements)
+
+    b += struct.pack('<I', 2)
+    b += text('Root') + text('Root') + struct.pack('<BI', 1, 1) + struct.pack('<B', 0) + index(bone_index, 0)
+    b += text('表情') + text('Exp') + struct.pack('<BI', 1, 2) + struct.pack('<B', 1) + index(1, 0) + struct.pack('<B', 1) + index(1, 1)
+
+    b += struct.pack('<I', 3)
+    for i in range(3):
+        b += text('rb%d' % i) + text('') + index(bone_index, i) + struct.pack('<BHB', i, 0xfffe, i) + floats(1, 2, 3)
+        b += floats(*values(3)) + floats(*values(3)) + floats(1, .5, .5, 0, .5) + struct.pack('<B', i % 3)
+    b += struct.pack('<I', 2)
+    for i in range(2):
+        b += text('j%d' % i) + text('') + struct.pack('<B', 0) + index(1, i) + index(1, i + 1) + floats(*values(24))
+
+    with open(path, 'wb') as f:
+        f.write(b)
+    return path
+
+
+def make_vmd(path, motions=200, morphs=30, cameras=0, seed=1):
+    rng = random.Random(seed)
+    def values(n):
+        return [ round(rng.uniform(-5, 5), 3) for i in range(n) ]
+
+    b = sjis('Vocaloid Motion Data 0002', 30) + sjis('テストモデル', 20)
+    names = LEG_BONES + ('右足',)
+    b += struct.pack('<I', motions)
+    for i in range(motions):
+        interpolation = bytes([ rng.randrange(128) for k in range(64) ])
+        b += sjis(names[i % len(names)], 15) + struct.pack('<I', rng.randrange(100))
+        b += floats(*values(3)) + floats(0, 0, 0.1, 0.99) + interpolation
+
+    morph_names = ['あ', 'い', 'う']
+    b += struct.pack('<I', morphs)
+    for i in range(morphs):
+        b += sjis(morph_names[i % 3], 15) + struct.pack('<I', rng.randrange(100)) + floats(rng.random())
+
+    b += struct.pack('<I', cameras)
+    for i in range(cameras):
+        b += struct.pack('<I', i * 10) + floats(-45) + floats(*values(3)) + floats(*values(3))
+        b += bytes(range(24)) + struct.pack('<IB', 30, 0)
+
+    with open(path, 'wb') as f:
+        f.write(b)
+    return path
+
+
+# sections of two models compared by value, arrays element-wise
+def assert_same_model(a, b):
+    assert sorted(a.keys()) == sorted(b.keys())
+    for name in a.keys():
+        assert_same(a[name], b[name])
+
+def assert_same(a, b):
+    if isinstance(a, np.ndarray):
+        np.testing.assert_array_equal(a, b)
+    elif isinstance(a, (loader.VertexArrays, loader.FaceArrays)):
+        assert type(a) is type(b)
+        for name, value in vars(a).items():
+            assert_same(value, vars(b)[name])
+    elif isinstance(a, dict):
+        assert sorted(a.keys()) == sorted(b.keys())
+        for name in a.keys():
+            if name != 'metadata':
+                assert_same(a[name], b[name])
+    else:
+        assert a == b
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import builders
+
+
+@pytest.fixture
+def pmd_file(tmp_path):
+    return builders.make_pmd(str(tmp_path / 'model.pmd'))
+
+@pytest.fixture
+def pmx_file(tmp_path):
+    return builders.make_pmx(str(tmp_path / 'model.pmx'))
+
+@pytest.fixture
+def vmd_file(tmp_path):
+    return builders.make_vmd(str(tmp_path / 'motion.vmd'))
@@ -0,0 +1,215 @@
+import os
+import threading
+
+import pytest
+
+from mmd import assets
+from mmd import loader
+
+
+# in memory stand-in for the panda3d vfs the store writes to
+class MemoryVfs(object):
+    def __init__(self):
+        self.files = {}
+
+    def writeFile(self, path, data, auto_wrap):
+        self.files[path] = data
+        return True
+
+    def deleteFile(self, path):
+        del self.files[path]
+        return True
+
+def write(path, data):
+    with open(str(path), 'wb') as f:
+        f.write(data)
+    return str(path)
+
+@pytest.fixture
+def store():
+    return assets.TextureStore('/textures', budget=25, vfs=MemoryVfs())
+
+
+def test_same_contents_are_kept_once(tmp_path, store):
+    a = store.acquire(write(tmp_path / 'a.PNG', b'x' * 10))
+    b = store.acquire(write(tmp_path / 'b.png', b'x' * 10))
+
+    assert a is b
+    assert a.refs == 2
+    assert a.path == '/textures/%s.png' % (a.hash)
+    assert store.vfs.files == {a.path: b'x' * 10}
+    assert store.size == 10
+
+def test_known_file_is_not_read_again(tmp_path, store, monkeypatch):
+    file = write(tmp_path / 'a.png', b'x' * 10)
+    entry = store.acquire(file)
+
+    def fail(*args):
+        raise AssertionError('read again')
+    monkeypatch.setattr(assets, 'open', fail, raising=False)
+
+    assert store.acquire(file) is entry
+    assert entry.refs == 2
+
+def test_changed_file(tmp_path, store):
+    file = write(tmp_path / 'a.png', b'x' * 10)
+    first = store.acquire(file)
+    write(file, b'y' * 12)
+
+    second = store.acquire(file)
+
+    assert second is not first
+    assert store.size == 22
+
+def test_missing_file(tmp_path, store):
+    with pytest.raises(OSError):
+        store.acquire(str(tmp_path / 'missing.png'))
+    assert store.size == 0
+
+def test_release_keeps_within_budget(tmp_path, store):
+    entry = store.acquire(write(tmp_path / 'a.png', b'a' * 10))
+
+    store.release(entry.hash)
+
+    assert entry.refs == 0
+    assert entry.hash in store.entries
+    assert entry.path in store.vfs.files
+
+def test_least_recently_used_are_evicted(tmp_path, store):
+    a = store.acquire(write(tmp_path / 'a.png', b'a' * 10))
+    b = store.acquire(write(tmp_path / 'b.png', b'b' * 10))
+    store.release(a.hash)
+    store.release(b.hash)
+    # a is used again, b is now the least recently used
+    store.release(store.acquire(str(tmp_path / 'a.png')).hash)
+
+    c = store.acquire(write(tmp_path / 'c.png', b'c' * 10))
+
+    assert list(store.entries) == [a.hash, c.hash]
+    assert sorted(store.vfs.files) == sorted([a.path, c.path])
+    assert store.size == 20
+
+def test_referenced_are_not_evicted(tmp_path, store):
+    entries = [ store.acquire(write(tmp_path / ('%d.png' % i), bytes([i]) * 10)) for i in range(3) ]
+
+    # over budget, but every texture is still used
+    assert store.size == 30
+    assert len(store.vfs.files) == 3
+
+    store.release(entries[1].hash)
+
+    assert entries[1].hash not in store.entries
+    assert store.size == 20
+
+def test_files_of_evicted_textures_are_pruned(tmp_path):
+    store = assets.TextureStore('/textures', budget=0, vfs=MemoryVfs())
+    for i in range(4):
+        store.release(store.acquire(write(tmp_path / ('%d.png' % i), bytes([i]) * 10)).hash)
+
+    assert store.entries == {}
+    assert store.vfs.files == {}
+    assert store.files == {}
+
+def test_texture_names(pmd_file, pmx_file):
+    assert assets.texture_names(loader.load(pmd_file)) == ['tex0.bmp', 'tex1.bmp', 'sph.sph']
+    model = loader.load(pmx_file)
+    assert assets.texture_names(model) == ['tex/a.png', 'b.png', 'toon.bmp']
+    assert assets.texture_file(model, 'b.png') == os.path.join(model.metadata.base, 'b.png')
+
+
+# assets without the panda3d multifile, counting how often it is made
+class FakeAssets(assets.ModelAssets):
+    made = 0
+    fail = False
+
+    def make_multifile(self):
+        FakeAssets.made += 1
+        if FakeAssets.fail:
+            raise IOError('multifile error')
+        self.multifile = True
+
+@pytest.fixture
+def asset_loader(store):
+    FakeAssets.made = 0
+    FakeAssets.fail = False
+    store.budget = 1 << 20
+    asset_loader = assets.AssetLoader(workers=2, store=store, assets=FakeAssets)
+    yield asset_loader
+    asset_loader.shutdown()
+
+# callback recording the future, the callbacks run after result() returns
+class Callback(object):
+    def __init__(self):
+        self.futures = []
+        self.event = threading.Event()
+
+    def __call__(self, future):
+        self.futures.append(future)
+        self.event.set()
+
+    def wait(self):
+        assert self.event.wait(10)
+        return self.futures
+
+def textures(directory):
+    for name in ('tex0.bmp', 'tex1.bmp', 'sph.sph'):
+        write(directory / name, name.encode('ascii'))
+
+def test_load(tmp_path, pmd_file, asset_loader):
+    textures(tmp_path)
+    done = Callback()
+
+    future = asset_loader.load(pmd_file, callback=done)
+    result = future.result(timeout=10)
+
+    assert isinstance(result, FakeAssets)
+    assert result.multifile is True
+    assert FakeAssets.made == 1
+    assert done.wait() == [future]
+    assert sorted(result.textures) == ['sph.sph', 'tex0.bmp', 'tex1.bmp']
+    # the egg refers to the textures in the store
+    assert '<Texture> 0 { "%s"}' % (result.textures['tex0.bmp'].path) in result.egg
+    assert all([ entry.refs == 1 for entry in asset_loader.store.entries.values() ])
+
+    result.release()
+    assert all([ entry.refs == 0 for entry in asset_loader.store.entries.values() ])
+
+def test_missing_texture(tmp_path, pmd_file, asset_loader):
+    textures(tmp_path)
+    os.remove(str(tmp_path / 'sph.sph'))
+
+    future = asset_loader.load(pmd_file)
+
+    with pytest.raises(OSError):
+        future.result(timeout=10)
+    # the textures read are given back
+    assert len(asset_loader.store.entries) == 2
+    assert all([ entry.refs == 0 for entry in asset_loader.store.entries.values() ])
+    assert FakeAssets.made == 0
+
+def test_multifile_error(tmp_path, pmd_file, asset_loader):
+    textures(tmp_path)
+    FakeAssets.fail = True
+
+    with pytest.raises(IOError):
+        asset_loader.load(pmd_file).result(timeout=10)
+    assert all([ entry.refs == 0 for entry in asset_loader.store.entries.values() ])
+
+def test_parse_error(tmp_path, vmd_file, asset_loader):
+    done = Callback()
+
+    future = asset_loader.load(vmd_file, callback=done)
+
+    with pytest.raises(ValueError):
+        future.result(timeout=10)
+    assert done.wait() == [future]
+    assert asset_loader.store.entries == {}
+
+def test_pmx(tmp_path, pmx_file, asset_loader):
+    (tmp_path / 'tex').mkdir()
+    for name in ('tex/a.png', 'b.png', 'toon.bmp'):
+        write(tmp_path / name, name.encode('ascii'))
+
+    result = asset_loader.load(pmx_file).result(timeout=10)
+
+    assert '<Texture> 2 { "%s"}' % (result.textures['b.png'].path) in result.egg
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+
+import builders
+from mmd import cache
+from mmd import loader
+
+
+def test_cache_hit(tmp_path, pmx_file):
+    model_cache = cache.ModelCache(str(tmp_path / 'cache'))
+    assert model_cache.get(pmx_file) is None
+
+    model = model_cache.load(pmx_file)
+    cached = model_cache.get(pmx_file)
+
+    assert cached is not None
+    np.testing.assert_array_equal(cached.vertices.positions, model.vertices.positions)
+    assert [ bone.name for bone in cached.bones ] == [ bone.name for bone in model.bones ]
+    assert len(cached.rigidBodies) == 3
+
+def test_cache_options_are_separate(tmp_path, vmd_file):
+    model_cache = cache.ModelCache(str(tmp_path / 'cache'))
+    model_cache.load(vmd_file)
+
+    assert model_cache.get(vmd_file, columnar=True) is None
+    assert model_cache.get(vmd_file) is not None
+
+def test_load_with_cache_dir_ignores_lazy(tmp_path, pmd_file):
+    model = loader.load(pmd_file, lazy=True, cache_dir=str(tmp_path / 'cache'))
+
+    assert not isinstance(model, loader.LazyModel)
+    assert len(model.bones) == 5
+
+def test_cache_invalidated_by_changes(tmp_path):
+    file = builders.make_pmx(str(tmp_path / 'm.pmx'))
+    model_cache = cache.ModelCache(str(tmp_path / 'cache'))
+    model_cache.load(file)
+
+    # same size, different contents and mtime
+    stat = os.stat(file)
+    builders.make_pmx(file, seed=2)
+    assert os.stat(file).st_size == stat.st_size
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert model_cache.get(file) is None
+
+    model = model_cache.load(file)
+    np.testing.assert_array_equal(model.vertices.positions, loader.load(file).vertices.positions)
+
+    # touched only, the entry stays valid
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    assert model_cache.get(file) is not None
+
+    # different size
+    builders.make_pmx(file, vertices=10)
+    assert model_cache.get(file) is None
+
+def test_cache_eviction(tmp_path):
+    files = [ builders.make_pmx(str(tmp_path / ('m%d.pmx' % i)), seed=i) for i in range(3) ]
+    directory = str(tmp_path / 'cache')
+    model_cache = cache.ModelCache(directory)
+    for i, file in enumerate(files):
+        model_cache.load(file)
+        path = model_cache.path(file, {})
+        os.utime(path + '.json', (i, i))
+
+    sizes = [ os.path.getsize(name) for name in (tmp_path / 'cache').iterdir() ]
+    model_cache.max_size = sum(sizes) - 1
+    model_cache.evict()
+
+    # the least recently used entry goes first
+    assert model_cache.get(files[0]) is None
+    assert model_cache.get(files[1]) is not None
+    assert model_cache.get(files[2]) is not None
+
+    model_cache.clear()
+    assert os.listdir(directory) == []
+
+def test_file_unchanged(tmp_path):
+    file = builders.make_pmd(str(tmp_path / 'm.pmd'))
+    stat = os.stat(file)
+    info = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': cache.file_hash(file)}
+    assert cache.file_unchanged(file, info)
+
+    # touched: the contents decide and the new mtime is taken
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.file_unchanged(file, info)
+    assert info['mtime'] == stat.st_mtime_ns + 10 ** 9
+
+    builders.make_pmd(file, seed=2)
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(file) == info['size']
+    assert not cache.file_unchanged(file, info)
@@ -0,0 +1,177 @@
+import io
+import json
+import os
+
+import pytest
+
+import builders
+from mmd import converter
+from mmd import loader
+
+
+def test_convert_file(tmp_path, pmd_file):
+    egg_file = str(tmp_path / 'm.egg')
+    converter.convert_file(pmd_file, egg_file)
+
+    with open(egg_file) as f:
+        egg = f.read()
+    assert egg == converter.convert(pmd_file)
+    assert egg.count('<Vertex>') == 50
+    assert egg.count('<Polygon>') == 30
+    assert '<Texture> 2 { "tex1.bmp"}' in egg
+
+def test_convert_pmx(pmx_file):
+    egg = converter.convert_model(loader.load(pmx_file), textures={'b.png': '/store/b.png'})
+
+    # materials 0 and 1 use texture 0, material 2 texture 1
+    assert '<Texture> 0 { "tex/a.png"}' in egg
+    assert '<Texture> 1 { "tex/a.png"}' in egg
+    assert '<Texture> 2 { "/store/b.png"}' in egg
+    assert egg.count('<Vertex>') == 60
+    assert egg.count('<TRef> { 2 }') == 10
+
+def test_material_textures(pmd_file, pmx_file):
+    model = loader.load(pmx_file)
+    model.materials[1].textureIndex = -1
+
+    assert converter.material_textures(model) == ['tex/a.png', None, 'b.png']
+    assert converter.material_textures(loader.load(pmd_file)) == ['tex0.bmp', None, 'tex1.bmp']
+
+def test_convert_zero_vertices(tmp_path):
+    file = builders.make_pmd(str(tmp_path / 'm.pmd'), vertices=0)
+    egg = converter.convert(file)
+
+    assert '<Vertex>' not in egg
+    assert '<Polygon>' not in egg
+
+def test_convert_batch_keeps_extension(tmp_path):
+    source = tmp_path / 'models'
+    source.mkdir()
+    builders.make_pmd(str(source / 'm.pmd'))
+    with open(str(source / 'm.pmx'), 'wb') as f:
+        f.write(b'PMX broken')
+    output_dir = str(tmp_path / 'egg')
+
+    results = converter.convert_batch([str(source)], output_dir, workers=1)
+    statuses = dict([ (os.path.basename(result['egg']), result['status']) for result in results ])
+
+    # the broken m.pmx does not remove the egg of m.pmd
+    assert statuses == {'m.pmd.egg': 'convert', 'm.pmx.egg': 'error'}
+    assert sorted(os.listdir(output_dir)) == [converter.MANIFEST, 'm.pmd.egg']
+    with open(os.path.join(output_dir, converter.MANIFEST)) as f:
+        assert list(json.load(f)) == ['m.pmd.egg']
+
+def test_convert_batch_pmd_and_pmx(tmp_path):
+    source = tmp_path / 'models'
+    source.mkdir()
+    builders.make_pmd(str(source / 'm.pmd'))
+    builders.make_pmx(str(source / 'm.pmx'))
+    output_dir = str(tmp_path / 'egg')
+
+    results = converter.convert_batch([str(source)], output_dir, workers=1)
+
+    assert [ result['status'] for result in results ] == ['convert', 'convert']
+    with open(os.path.join(output_dir, converter.MANIFEST)) as f:
+        manifest = json.load(f)
+    assert sorted(manifest) == ['m.pmd.egg', 'm.pmx.egg']
+    with open(os.path.join(output_dir, 'm.pmx.egg')) as f:
+        assert f.read().count('<Vertex>') == 60
+
+def test_convert_batch_skips_unchanged(tmp_path):
+    source = tmp_path / 'models'
+    (source / 'sub').mkdir(parents=True)
+    builders.make_pmd(str(source / 'a.pmd'))
+    builders.make_pmd(str(source / 'sub' / 'b.pmd'), seed=2)
+    output_dir = str(tmp_path / 'egg')
+
+    results = converter.convert_batch([str(source)], output_dir, workers=1)
+    assert [ result['status'] for result in results ] == ['convert', 'convert']
+    assert os.path.exists(os.path.join(output_dir, 'sub', 'b.pmd.egg'))
+
+    builders.make_pmd(str(source / 'a.pmd'), vertices=10)
+    results = converter.convert_batch([str(source)], output_dir, workers=1)
+    statuses = dict([ (os.path.basename(result['file']), result['status']) for result in results ])
+    assert statuses == {'a.pmd': 'convert', 'b.pmd': 'skip'}
+
+    results = converter.convert_batch([str(source)], output_dir, workers=1, force=True)
+    assert [ result['status'] for result in results ] == ['convert', 'convert']
+
+def test_convert_batch_reports_clash(tmp_path):
+    for name in ('a', 'b'):
+        (tmp_path / name).mkdir()
+        builders.make_pmd(str(tmp_path / name / 'm.pmd'))
+    output_dir = str(tmp_path / 'egg')
+
+    results = converter.convert_batch([str(tmp_path / 'a'), str(tmp_path / 'b')], output_dir, workers=1)
+
+    assert [ result['status'] for result in results ] == ['error', 'convert']
+    assert results[0]['file'] == str(tmp_path / 'b' / 'm.pmd')
+    assert 'm.pmd.egg' in results[0]['error']
+    with open(os.path.join(output_dir, converter.MANIFEST)) as f:
+        assert json.load(f)['m.pmd.egg']['file'] == str(tmp_path / 'a' / 'm.pmd')
+
+
+def test_write_egg_in_chunks(pmd_file):
+    model = loader.load(pmd_file)
+    f = io.StringIO()
+
+    converter.write_egg(model, f, chunk_size=64)
+
+    assert f.getvalue() == converter.convert_model(model)
+
+@pytest.mark.parametrize('precision', [3, 6])
+def test_vertex_pool(pmd_file, precision):
+    vertices = loader.load(pmd_file).vertices
+
+    egg = converter.convert(pmd_file, precision=precision)
+
+    # the bulk formatting gives the text of one vertex at a time
+    f = '%%.%df' % precision
+    expected = ''
+    for i in range(len(vertices)):
+        p, n, uv = vertices.positions[i], vertices.normals[i], vertices.uvs[i]
+        expected += '  <Vertex> %d {\n' % (i)
+        expected += '    %s\n' % (' '.join([ f % v for v in p ]))
+        expected += '    <Normal> { %s }\n' % (' '.join([ f % v for v in n ]))
+        expected += '    <UV> { %s %s }\n' % (f % uv[0], f % (1 - uv[1]))
+        expected += '  }\n'
+    assert '<VertexPool> mmd {\n' + expected + '}\n' in egg
+
+def test_group_per_material(pmd_file):
+    model = loader.load(pmd_file)
+    indices = model.faces.indices
+
+    egg = converter.convert_model(model)
+
+    # faces 0-9 with material 0 (tex0.bmp), 10-24 with 1 (no texture), 25-29 with 2
+    groups = egg.split('  <Group> material')[1:]
+    assert [ group.split(' ', 1)[0] for group in groups ] == ['0', '1', '2']
+    assert [ group.count('<Polygon>') for group in groups ] == [10, 15, 5]
+    assert groups[0].count('<TRef> { 0 }') == 10
+    assert '<TRef>' not in groups[1]
+    assert '<VertexRef> { %d %d %d <Ref> { mmd } }' % tuple(indices[25]) in groups[2]
+
+def test_empty_materials_are_skipped(pmd_file):
+    model = loader.load(pmd_file)
+    model.materials[1].faceCount = 0
+    model.materials[2].faceCount += 15
+
+    egg = converter.convert_model(model)
+
+    assert 'material1' not in egg
+    assert egg.count('<Polygon>') == 30
+
+def test_too_many_material_faces(pmd_file):
+    model = loader.load(pmd_file)
+    model.materials[2].faceCount += 1
+
+    with pytest.raises(ValueError, match='多く'):
+        converter.convert_model(model)
+
+def test_too_few_material_faces(pmd_file):
+    model = loader.load(pmd_file)
+    model.materials[2].faceCount -= 1
+
+    # the trailing faces would be dropped from the egg
+    with pytest.raises(ValueError, match='少な'):
+        converter.convert_model(model)
@@ -0,0 +1,106 @@
+import struct
+
+import numpy as np
+import pytest
+
+from mmd import loader
+
+
+def test_from_file(tmp_path):
+    file = str(tmp_path / 'data.bin')
+    with open(file, 'wb') as f:
+        f.write(struct.pack('<bHif', -3, 500, -70000, 1.5) + 'テスト'.encode('cp932') + b'\0\xfd')
+
+    dv = loader.DataView.from_file(file)
+
+    assert (dv.get_int8(), dv.get_uint16(), dv.get_int32(), dv.get_float32()) == (-3, 500, -70000, 1.5)
+    assert dv.get_sjis_strings(8) == 'テスト'
+    assert dv.is_empty()
+    dv.close()
+
+def test_empty_file(tmp_path):
+    file = str(tmp_path / 'empty.bin')
+    open(file, 'wb').close()
+
+    dv = loader.DataView.from_file(file)
+
+    assert dv.is_empty()
+    with pytest.raises(ValueError):
+        dv.read(1)
+    dv.close()
+
+def test_read_over_end():
+    dv = loader.DataView(b'\1\2\3')
+
+    with pytest.raises(ValueError):
+        dv.read(4)
+    assert dv.offset == 0
+    assert bytes(dv.read(3)) == b'\1\2\3'
+
+def test_indices():
+    dv = loader.DataView(struct.pack('<bBhHi', -1, 255, -1, 65535, -1))
+
+    assert dv.get_index(1) == -1
+    assert dv.get_index(1, unsigned=True) == 255
+    assert dv.get_index(2) == -1
+    assert dv.get_index(2, unsigned=True) == 65535
+    assert dv.get_index(4, unsigned=True) == -1
+    with pytest.raises(KeyError):
+        dv.get_index(3)
+
+def test_unicode_strings():
+    # the terminator is looked for at even offsets only
+    data = 'aĀ'.encode('utf-16-le') + b'\0\0' + b'xx'
+    dv = loader.DataView(struct.pack('<I', len(data)) + data)
+
+    assert dv.get_text_buffer() == 'aĀ'
+
+def test_records_are_views(tmp_path):
+    values = np.arange(12, dtype='<f4')
+    file = str(tmp_path / 'data.bin')
+    with open(file, 'wb') as f:
+        f.write(b'\0' * 4 + values.tobytes())
+
+    dv = loader.DataView.from_file(file)
+    dv.skip(4)
+    records = dv.get_records('<f4', 12)
+
+    np.testing.assert_array_equal(records, values)
+    assert not records.flags.owndata
+    # the mapping outlives close while the array refers to it
+    dv.close()
+    np.testing.assert_array_equal(records, values)
+
+
+def test_record():
+    record = loader.Record(loader.MorphKeyframe, ('morphName', 'sjis', 15), ('frameNum', 'I'), ('weight', 'f'))
+    data = ('あ'.encode('cp932') + b'\0' * 13) + struct.pack('<If', 7, 0.5)
+
+    keyframe = loader.DataView(data * 2).get_record_array(record, 2)
+
+    assert record.size == 23
+    assert keyframe == [loader.MorphKeyframe(morphName='あ', frameNum=7, weight=0.5)] * 2
+
+def test_record_arrays():
+    record = loader.Record(loader.ddict, ('position', 'f', 3), ('flag', 'B'), ('raw', 'bytes', 2))
+    dv = loader.DataView(struct.pack('<3fB2s', 1, 2, 3, 9, b'ab'))
+
+    value = dv.get_record(record)
+
+    assert value == {'position': [1.0, 2.0, 3.0], 'flag': 9, 'raw': b'ab'}
+    assert dv.is_empty()
+
+
+def test_entity():
+    keyframe = loader.MorphKeyframe(morphName='あ', frameNum=1)
+
+    assert keyframe.keys() == ['morphName', 'frameNum']
+    assert keyframe['frameNum'] == 1
+    assert keyframe.get('weight', 0.5) == 0.5
+    assert 'weight' not in keyframe
+    with pytest.raises(KeyError):
+        keyframe['weight']
+    keyframe['weight'] = 1.0
+    assert keyframe == {'morphName': 'あ', 'frameNum': 1, 'weight': 1.0}
+    with pytest.raises(AttributeError):
+        keyframe.other = 1
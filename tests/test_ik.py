@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+import builders
+from mmd import ik
+from mmd import loader
+from mmd import quaternion
+from mmd import skeleton
+
+
+def solve(file, goals):
+    model = loader.load(file)
+    sk = skeleton.Skeleton(model)
+    solver = ik.IKSolver(model, sk)
+    translations = np.zeros((len(goals), len(sk), 3), np.float32)
+    translations[:, 4] = goals
+    return sk.pose(translations, skeleton.identity_quaternions((len(goals), len(sk))), ik=solver)
+
+@pytest.fixture(params=['pmd', 'pmx'])
+def model_file(request, tmp_path):
+    make = builders.make_pmd if request.param == 'pmd' else builders.make_pmx
+    return make(str(tmp_path / ('m.' + request.param)))
+
+
+def test_chains(model_file):
+    model = loader.load(model_file)
+    solver = ik.IKSolver(model, skeleton.Skeleton(model))
+
+    assert len(solver) == 1
+    chain = solver.chains[0]
+    assert (chain.goal, chain.effector, chain.links.tolist(), chain.path.tolist()) == (4, 3, [2, 1], [1, 2, 3])
+    # the knee turns around x only
+    assert chain.axes.tolist() == [0, -1]
+
+def test_reaches_goal(model_file):
+    goals = np.array([(0, 2.5, 1), (0.5, 3, 0.5), (-0.5, 4, 1.5)], np.float32)
+
+    globals = solve(model_file, goals)
+
+    np.testing.assert_allclose(globals[:, 3, :3, 3], goals + (0, 2, 0), atol=1e-3)
+    # the bones keep their lengths
+    np.testing.assert_allclose(np.linalg.norm(globals[:, 2, :3, 3] - globals[:, 1, :3, 3], axis=-1), 2, rtol=1e-5)
+    np.testing.assert_allclose(np.linalg.norm(globals[:, 3, :3, 3] - globals[:, 2, :3, 3], axis=-1), 2, rtol=1e-5)
+
+def test_knee_limit(model_file):
+    # in front, behind and out of reach
+    globals = solve(model_file, np.array([(0, 2.5, 1), (0, 2.5, -1), (0, 0, 0)], np.float32))
+
+    knees = np.linalg.inv(globals[:, 1]) @ globals[:, 2]
+    # rotations around x only, by a negative angle
+    np.testing.assert_allclose(knees[:, :3, 0], np.tile([1, 0, 0], (3, 1)), atol=1e-5)
+    assert np.all(knees[:, 2, 1] < 0)
+    # the knee bends backwards only, the goal behind is not reached
+    assert np.linalg.norm(globals[1, 3, :3, 3] - (0, 4.5, -1)) > 0.1
+
+def test_batch_equals_single(pmx_file):
+    goals = np.array([(0, 2.5, 1), (0.5, 3, 0.5)], np.float32)
+
+    globals = solve(pmx_file, goals)
+
+    # a batch iterates until all of its poses are solved, so a pose may
+    # take a few more steps than alone
+    for p in range(2):
+        np.testing.assert_allclose(globals[p], solve(pmx_file, goals[p:p + 1])[0], atol=1e-3)
+
+def test_invalid_chains(pmx_file):
+    model = loader.load(pmx_file)
+    sk = skeleton.Skeleton(model)
+    solver = ik.IKSolver(model, sk)
+
+    # links that are not above the effector, out of range bones, no links
+    solver.add_chain(4, 3, [5], [None], 10, 1.0)
+    solver.add_chain(4, 30, [2], [None], 10, 1.0)
+    solver.add_chain(4, 3, [], [], 10, 1.0)
+
+    assert len(solver) == 1
+
+def test_limit_euler():
+    lower = np.array([-0.5, -0.2, 0.0], np.float32)
+    upper = np.array([0.5, 0.2, 0.0], np.float32)
+    rng = np.random.default_rng(1)
+    q = quaternion.normalize(rng.normal(size=(100, 4))).astype(np.float32)
+
+    limited = ik.limit_euler(q, lower, upper)
+
+    m = quaternion.to_matrix(limited)
+    x = np.arctan2(-m[:, 1, 2], m[:, 2, 2])
+    y = np.arcsin(np.clip(m[:, 0, 2], -1, 1))
+    z = np.arctan2(-m[:, 0, 1], m[:, 0, 0])
+    assert np.all((x >= -0.5 - 1e-5) & (x <= 0.5 + 1e-5))
+    assert np.all((y >= -0.2 - 1e-5) & (y <= 0.2 + 1e-5))
+    np.testing.assert_allclose(z, 0, atol=1e-5)
+    # rotations inside the limits are kept
+    inside = ik.limit_euler(limited, lower, upper)
+    np.testing.assert_allclose(np.abs(np.sum(inside * limited, axis=-1)), 1, atol=1e-5)
+
+def test_grant_of_link_in_same_layer(pmx_file):
+    goals = np.array([(0, 2.5, 1), (0.5, 3, 0.5)], np.float32)
+    expected = solve(pmx_file, goals)
+
+    model = loader.load(pmx_file)
+    # 付与 takes half the rotation of 左足, a link of the leg chain
+    model.bones[5].transformationClass = 0
+    sk = skeleton.Skeleton(model)
+    translations = np.zeros((2, len(sk), 3), np.float32)
+    translations[:, 4] = goals
+    globals = sk.pose(translations, skeleton.identity_quaternions((2, len(sk))), ik=ik.IKSolver(model, sk))
+
+    assert len(sk.stages) == 1
+    np.testing.assert_allclose(globals, expected, atol=1e-5)
+    assert not np.allclose(globals[:, 5, :3, :3], np.eye(3), atol=1e-2)
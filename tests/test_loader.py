@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import builders
+from mmd import loader
+
+
+@pytest.mark.parametrize('additional_uvs', [0, 1, 3])
+def test_pmx_vertices(tmp_path, additional_uvs):
+    file = builders.make_pmx(str(tmp_path / 'm.pmx'), additional_uvs=additional_uvs)
+    vertices = loader.load(file).vertices
+
+    assert len(vertices) == 60
+    assert vertices.positions.shape == (60, 3)
+    assert vertices.auvs.shape == (60, additional_uvs, 4)
+    assert vertices.types.tolist() == [0, 1, 2, 3] * 15
+    np.testing.assert_allclose(vertices.skinWeights.sum(axis=1), 1.0, rtol=1e-6)
+
+@pytest.mark.parametrize('additional_uvs', [0, 2])
+def test_pmx_zero_vertices(tmp_path, additional_uvs):
+    file = builders.make_pmx(str(tmp_path / 'm.pmx'), vertices=0, additional_uvs=additional_uvs)
+    model = loader.load(file)
+
+    assert len(model.vertices) == 0
+    assert model.vertices.positions.shape == (0, 3)
+    assert model.vertices.auvs.shape == (0, additional_uvs, 4)
+    assert len(model.faces.indices) == 0
+    assert len(model.bones) == 6
+
+def test_pmd_zero_vertices(tmp_path):
+    file = builders.make_pmd(str(tmp_path / 'm.pmd'), vertices=0)
+    model = loader.load(file)
+
+    assert len(model.vertices) == 0
+    assert model.vertices.positions.shape == (0, 3)
+    assert len(model.bones) == 5
+
+def test_pmd_vertices(pmd_file):
+    vertices = loader.load(pmd_file).vertices
+
+    assert vertices.positions.shape == (50, 3)
+    assert vertices.skinIndices.shape == (50, 2)
+    np.testing.assert_allclose(vertices.skinWeights.sum(axis=1), 1.0, rtol=1e-6)
+    # a vertex still reads like the record it was before
+    assert list(vertices[0].position) == vertices.positions[0].tolist()
+
+
+@pytest.mark.parametrize('make', [builders.make_pmd, builders.make_pmx])
+def test_lazy_equals_eager(tmp_path, make):
+    file = make(str(tmp_path / ('m.' + make.__name__[-3:])))
+    eager = loader.load(file)
+    lazy = loader.load(file, lazy=True)
+
+    assert isinstance(lazy, loader.LazyModel)
+    assert lazy.sections
+    builders.assert_same_model(eager, lazy)
+    assert not lazy.sections
+
+def test_lazy_model_acts_as_dict(pmx_file):
+    model = loader.load(pmx_file, lazy=True)
+    count = len(model)
+
+    # get and in see sections not parsed yet, only get parses them
+    assert 'rigidBodies' in model
+    assert 'rigidBodies' in model.sections
+    assert len(model.get('rigidBodies')) == 3
+    assert 'rigidBodies' not in model.sections
+    assert model.get('nothing', 1) == 1
+    assert 'nothing' not in model
+    assert len(model) == count
+
+    # iterating gives every section
+    assert set(model) == set(loader.load(pmx_file).keys())
+    assert not model.sections
+
+def test_lazy_pmd_without_physics(tmp_path):
+    file = builders.make_pmd(str(tmp_path / 'm.pmd'), physics=False)
+    model = loader.load(file, lazy=True)
+
+    assert 'rigidBodies' not in model
+    assert model.get('rigidBodies') is None
+    builders.assert_same_model(loader.load(file), model)
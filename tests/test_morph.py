@@ -0,0 +1,119 @@
+import numpy as np
+
+import builders
+from mmd import loader
+from mmd import morph
+
+
+# base plus the deltas of elements, one element at a time
+def reference(base, elements, weight, attribute, width, vertices=None):
+    result = np.array(base, np.float64)
+    for element in elements:
+        index = element.index if vertices is None else vertices[element.index]
+        result[index] += weight * np.array(element[attribute][:width])
+    return result
+
+def test_pmd_vertex_morphs(pmd_file):
+    model = loader.load(pmd_file)
+    morphs = morph.Morphs(model)
+    base = [ element.index for element in model.morphs[0].elements ]
+
+    positions = morphs.positions([0, 0.5, 1.0])
+
+    expected = reference(model.vertices.positions, model.morphs[1].elements, 0.5, 'position', 3, base)
+    expected = reference(expected, model.morphs[2].elements, 1.0, 'position', 3, base)
+    np.testing.assert_allclose(positions, expected, atol=1e-5)
+    np.testing.assert_allclose(morphs.positions({'m1': 1.0, 'unknown': 1.0}),
+        reference(model.vertices.positions, model.morphs[2].elements, 1.0, 'position', 3, base), atol=1e-5)
+
+def test_pmx_vertex_and_uv_morphs(pmx_file):
+    model = loader.load(pmx_file)
+    morphs = morph.Morphs(model)
+    vertices = model.vertices
+
+    np.testing.assert_allclose(morphs.positions({'morph1': 0.25}),
+        reference(vertices.positions, model.morphs[1].elements, 0.25, 'position', 3), atol=1e-5)
+    np.testing.assert_allclose(morphs.uvs({'morph2': 0.5}),
+        reference(vertices.uvs, model.morphs[2].elements, 0.5, 'uv', 2), atol=1e-5)
+    # uv morphs do not move the vertices
+    np.testing.assert_array_equal(morphs.positions({'morph2': 1.0}), vertices.positions)
+
+def test_group_morphs(pmx_file):
+    model = loader.load(pmx_file)
+    morphs = morph.Morphs(model)
+
+    weights = morphs.weights({'morph0': 0.8})
+
+    np.testing.assert_allclose(weights[:3], [0.8, 0.4, 0.8])
+    np.testing.assert_allclose(morphs.positions({'morph0': 0.8}), morphs.positions({'morph1': 0.4}), atol=1e-6)
+
+def test_nested_group_morphs():
+    groups = [ (0, 1, 0.5), (1, 2, 0.5), (2, 0, 1.0) ]
+
+    flat = morph.flatten_groups(3, groups)
+
+    # the cycle stops after GROUP_DEPTH levels
+    g = np.array([[0, 0.5, 0], [0, 0, 0.5], [1, 0, 0]])
+    expected = sum([ np.linalg.matrix_power(g, k) for k in range(morph.GROUP_DEPTH + 1) ])
+    np.testing.assert_allclose(flat, expected, rtol=1e-5)
+    np.testing.assert_allclose(morph.flatten_groups(3, groups[:2])[0], [1, 0.5, 0.25])
+
+def test_zero_weights(pmx_file):
+    model = loader.load(pmx_file)
+    morphs = morph.Morphs(model)
+
+    positions = morphs.positions(np.zeros(len(morphs)))
+
+    np.testing.assert_array_equal(positions, model.vertices.positions)
+    assert positions is not model.vertices.positions
+
+def test_zero_vertices(tmp_path):
+    model = loader.load(builders.make_pmx(str(tmp_path / 'm.pmx'), vertices=0))
+    morphs = morph.Morphs(model)
+
+    assert morphs.positions({'morph0': 1.0}).shape == (0, 3)
+    assert morphs.uvs({'morph0': 1.0}).shape == (0, 2)
+
+def test_sparse_deltas():
+    deltas = morph.SparseDeltas(3, [2, 0, 2, 0], [4, 1, 0, 1], [[1.0], [2.0], [3.0], [4.0]])
+
+    assert deltas.offsets.tolist() == [0, 2, 2, 4]
+    np.testing.assert_allclose(deltas.apply([1.0, 5.0, 0.5], np.zeros((5, 1)))[:, 0], [1.5, 6.0, 0, 0, 0.5])
+
+
+def test_material_morphs(pmx_file):
+    model = loader.load(pmx_file)
+    morphs = morph.Morphs(model)
+    base = morph.material_table(model.materials)
+
+    columns = morphs.materials({'morph4': 0.5})
+
+    # element 0 multiplies material 0, element 1 adds to every material
+    multiply, add = [ morph.material_table([element])[0] for element in model.morphs[4].elements ]
+    expected = base.copy()
+    expected[0] *= 1 + (multiply - 1) * 0.5
+    expected += add * 0.5
+    np.testing.assert_allclose(np.concatenate([ np.reshape(columns[name], (3, -1)) for name, width in morph.MATERIAL_LAYOUT ], axis=1),
+        expected, rtol=1e-5, atol=1e-5)
+
+    unchanged = morphs.materials({'morph4': 0.0})
+    np.testing.assert_array_equal(unchanged.diffuse, [ material.diffuse for material in model.materials ])
+    np.testing.assert_array_equal(unchanged.shininess, [ material.shininess for material in model.materials ])
+
+def test_material_deltas_many_targets():
+    base = np.ones((2, 3), np.float32)
+    deltas = morph.MaterialDeltas([0, 0, 1, 1], [0, 0, -1, 1], [morph.MULTIPLY, morph.MULTIPLY, morph.ADD, morph.ADD],
+        np.array([[2.0] * 3, [3.0] * 3, [1.0] * 3, [4.0] * 3]))
+
+    result = deltas.apply([1.0, 0.5], base)
+
+    # both multiply elements of material 0 apply, and the adds to all / to 1
+    np.testing.assert_allclose(result, [[6.5] * 3, [3.5] * 3])
+
+def test_pmd_materials(pmd_file):
+    model = loader.load(pmd_file)
+    columns = morph.Morphs(model).materials({})
+
+    np.testing.assert_allclose(columns.diffuse, [ material.diffuse for material in model.materials ])
+    np.testing.assert_allclose(columns.edgeColor, [morph.MATERIAL_DEFAULTS['edgeColor']] * 3)
+    np.testing.assert_allclose(columns.edgeSize, 1.0)
@@ -0,0 +1,186 @@
+import numpy as np
+import pytest
+
+import builders
+from mmd import loader
+from mmd import motion
+
+
+LINEAR = [20, 20, 107, 107] * 4
+
+# columnar vmd of keys (bone, frame, position, rotation, curve bytes)
+# and morph keys (morph, frame, weight)
+def make_vmd(keys, morph_keys=()):
+    vmd = loader.ddict()
+    m = vmd.motions = loader.ddict()
+    m.boneNames, m.boneId = motion.intern([ key[0] for key in keys ])
+    m.frameNum = np.array([ key[1] for key in keys ], np.uint32)
+    m.position = np.array([ key[2] for key in keys ], np.float32).reshape(-1, 3)
+    m.rotation = np.array([ key[3] for key in keys ], np.float32).reshape(-1, 4)
+    m.interpolation = np.zeros((len(keys), 64), np.uint8)
+    for i, key in enumerate(keys):
+        m.interpolation[i, :16] = np.array(key[4]).reshape(4, 4).T.ravel()
+
+    m = vmd.morphs = loader.ddict()
+    m.morphNames, m.morphId = motion.intern([ key[0] for key in morph_keys ])
+    m.frameNum = np.array([ key[1] for key in morph_keys ], np.uint32)
+    m.weight = np.array([ key[2] for key in morph_keys ], np.float32)
+    return vmd
+
+def axis_rotation(angle):
+    return [0.0, np.sin(angle * 0.5), 0.0, np.cos(angle * 0.5)]
+
+def same_rotations(a, b, atol=1e-5):
+    # q and -q are the same rotation
+    dot = np.abs(np.sum(np.asarray(a) * np.asarray(b), axis=-1))
+    np.testing.assert_allclose(dot, 1.0, atol=atol)
+
+KEYS = [
+    ('a', 10, (1, 2, 3), axis_rotation(0.0), LINEAR),
+    ('a', 0, (0, 0, 0), axis_rotation(1.0), LINEAR),
+    ('b', 5, (4, 0, 0), axis_rotation(0.5), LINEAR),
+    ('a', 30, (-1, 0, 2), axis_rotation(2.0), LINEAR),
+]
+
+
+def test_keys():
+    m = motion.Motion(make_vmd(KEYS))
+
+    for name, frame, position, rotation, curve in KEYS:
+        translations, rotations = m.sample(frame)
+        bone = m.boneNames.index(name)
+        np.testing.assert_allclose(translations[bone], position, atol=1e-5)
+        same_rotations(rotations[bone], rotation)
+
+def test_linear_between_keys():
+    m = motion.Motion(make_vmd(KEYS))
+
+    translations, rotations = m.sample([5, 20])
+
+    np.testing.assert_allclose(translations[:, 0], [(0.5, 1, 1.5), (0, 1, 2.5)], atol=1e-3)
+    same_rotations(rotations[:, 0], [axis_rotation(0.5), axis_rotation(1.0)], atol=1e-4)
+
+def test_held_outside_keys():
+    m = motion.Motion(make_vmd(KEYS))
+
+    translations, rotations = m.sample([0, 40])
+
+    # b has one key, held at every frame
+    np.testing.assert_allclose(translations[:, 1], [(4, 0, 0), (4, 0, 0)])
+    np.testing.assert_allclose(translations[1, 0], (-1, 0, 2))
+    assert m.frameCount == 31
+
+def test_model_order():
+    model = loader.ddict()
+    model.bones = [ loader.ddict(name=name) for name in ('c', 'b', 'a') ]
+    model.morphs = [ loader.ddict(name='x') ]
+
+    m = motion.Motion(make_vmd(KEYS), model)
+    translations, rotations = m.sample(10)
+
+    # c is not in the motion and stays at rest
+    np.testing.assert_allclose(translations, [(0, 0, 0), (4, 0, 0), (1, 2, 3)])
+    np.testing.assert_allclose(rotations[0], (0, 0, 0, 1))
+    np.testing.assert_allclose(m.sample_morphs(10), [0])
+
+def test_morph_weights():
+    m = motion.Motion(make_vmd([], [('x', 0, 0.0), ('x', 10, 1.0), ('y', 4, 0.5)]))
+
+    weights = m.sample_morphs([0, 2.5, 10, 20])
+
+    np.testing.assert_allclose(weights, [(0, 0.5), (0.25, 0.5), (1, 0.5), (1, 0.5)])
+
+@pytest.mark.parametrize('x1, y1, x2, y2', [(0.2, 0.9, 0.3, 0.1), (1.0, 0.0, 0.0, 1.0), (0.5, 0.5, 0.5, 0.5)])
+def test_bezier(x1, y1, x2, y2):
+    t = np.linspace(0, 1, 100001)
+    a, b, c, d, e, f = motion.bezier_coefficients(x1, y1, x2, y2)
+    x = ((a * t + b) * t + c) * t
+    y = ((d * t + e) * t + f) * t
+
+    # the 1/256 bisection bounds the error where x(t) is flat
+    samples = np.linspace(0, 1, 101)
+    np.testing.assert_allclose(motion.bezier(samples, x1, y1, x2, y2), np.interp(samples, x, y), atol=2e-3)
+
+def test_curves_of_the_later_key():
+    ease = [127, 0, 0, 127] * 4
+    m = motion.Motion(make_vmd([('a', 0, (0, 0, 0), axis_rotation(0), LINEAR), ('a', 10, (10, 0, 0), axis_rotation(0), ease)]))
+
+    translations, rotations = m.sample(5)
+
+    expected = motion.bezier(0.5, 1.0, 0.0, 0.0, 1.0) * 10
+    np.testing.assert_allclose(translations[0, 0], expected, atol=1e-4)
+
+def test_records_equal_columns(pmx_file, vmd_file):
+    frames = np.arange(0, 100, 0.5)
+    model = loader.load(pmx_file)
+    records = motion.Motion(loader.load(vmd_file), model)
+    columns = motion.Motion(loader.load(vmd_file, columnar=True), model)
+
+    for a, b in zip(records.sample(frames), columns.sample(frames)):
+        np.testing.assert_array_equal(a, b)
+    np.testing.assert_array_equal(records.sample_morphs(frames), columns.sample_morphs(frames))
+
+def test_empty_motion():
+    m = motion.Motion(make_vmd([]))
+    translations, rotations = m.sample([0, 1])
+
+    assert m.frameCount == 0
+    assert translations.shape == (2, 0, 3)
+
+
+def test_bake_equals_sample(tmp_path):
+    m = motion.Motion(make_vmd(KEYS, [('x', 0, 0.0), ('x', 10, 1.0)]))
+
+    baked = motion.bake(m, chunk=7)
+    stored = motion.bake(m, str(tmp_path), chunk=7)
+
+    assert len(baked) == 31
+    translations, rotations = m.sample(np.arange(31))
+    for b in (baked, stored):
+        np.testing.assert_array_equal(b.translations, translations)
+        np.testing.assert_array_equal(b.rotations, rotations)
+        np.testing.assert_array_equal(b.weights, m.sample_morphs(np.arange(31)))
+    assert sorted([ path.name for path in tmp_path.iterdir() ]) == ['rotations.npy', 'translations.npy', 'weights.npy']
+
+    # frames are held outside the motion
+    np.testing.assert_array_equal(baked.sample(100)[0], translations[-1])
+    np.testing.assert_array_equal(baked.sample(-1)[1], rotations[0])
+    np.testing.assert_array_equal(baked.sample_morphs(4.6), m.sample_morphs(4))
+
+def test_bake_empty_motion():
+    baked = motion.bake(motion.Motion(make_vmd([])))
+
+    assert len(baked) == 1
+    assert baked.translations.shape == (1, 0, 3)
+
+def test_load_baked(tmp_path, pmx_file, vmd_file):
+    cache_dir = str(tmp_path / 'baked')
+
+    baked = motion.load_baked(vmd_file, pmx_file, cache_dir)
+
+    m = motion.Motion(loader.load(vmd_file), loader.load(pmx_file))
+    frames = np.arange(m.frameCount)
+    translations, rotations = m.sample(frames)
+    np.testing.assert_allclose(baked.translations, translations)
+    np.testing.assert_allclose(baked.rotations, rotations)
+    assert isinstance(baked.translations, np.memmap)
+
+    # the second load maps the same entry
+    entries = list((tmp_path / 'baked').iterdir())
+    assert len(entries) == 1
+    mtime = entries[0].stat().st_mtime_ns
+    again = motion.load_baked(vmd_file, pmx_file, cache_dir)
+    np.testing.assert_array_equal(again.rotations, baked.rotations)
+    assert list((tmp_path / 'baked').iterdir()) == entries
+    assert entries[0].stat().st_mtime_ns == mtime
+
+def test_load_baked_changed_motion(tmp_path, pmx_file):
+    cache_dir = str(tmp_path / 'baked')
+    vmd_file = builders.make_vmd(str(tmp_path / 'm.vmd'))
+    first = np.array(motion.load_baked(vmd_file, pmx_file, cache_dir).translations)
+
+    builders.make_vmd(vmd_file, seed=2)
+    second = motion.load_baked(vmd_file, pmx_file, cache_dir)
+
+    assert len(list((tmp_path / 'baked').iterdir())) == 2
+    assert not np.array_equal(first, second.translations[:len(first)])
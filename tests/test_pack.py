@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+
+import builders
+from mmd import loader
+from mmd import pack
+
+
+@pytest.mark.parametrize('make, vertices', [
+    (builders.make_pmd, 50), (builders.make_pmd, 0), (builders.make_pmx, 60), (builders.make_pmx, 0)
+])
+def test_round_trip(tmp_path, make, vertices):
+    file = make(str(tmp_path / 'm.model'), vertices=vertices)
+    model = loader.load(file, format=make.__name__[-3:].upper())
+    (tmp_path / 'packs').mkdir()
+    pack_file = str(tmp_path / 'packs' / 'm.pack')
+    pack.save(model, pack_file)
+
+    packed = loader.load(pack_file)
+
+    builders.assert_same_model(model, packed)
+    assert packed.metadata.base == str(tmp_path)
+    # the arrays are read from the file without copying
+    assert not packed.vertices.positions.flags.owndata
+
+def test_lazy_model(tmp_path, pmx_file):
+    pack_file = str(tmp_path / 'm.pack')
+    pack.save(loader.load(pmx_file, lazy=True), pack_file)
+
+    builders.assert_same_model(loader.load(pmx_file), loader.load(pack_file))
+
+def test_arrays_aligned(tmp_path, pmx_file):
+    pack_file = str(tmp_path / 'm.pack')
+    pack.save(loader.load(pmx_file), pack_file)
+    model = pack.load(pack_file)
+
+    for value in list(vars(model.vertices).values()) + [model.faces.indices]:
+        if isinstance(value, np.ndarray):
+            assert value.ctypes.data % pack.ALIGN == 0
+
+def test_not_a_pack(tmp_path, pmx_file):
+    with pytest.raises(ValueError):
+        pack.load(pmx_file)
+
+    with pytest.raises(ValueError):
+        pack.save(loader.load(builders.make_vmd(str(tmp_path / 'm.vmd'))), str(tmp_path / 'm.pack'))
+    assert not os.path.exists(str(tmp_path / 'm.pack'))
@@ -0,0 +1,151 @@
+import numpy as np
+import pytest
+
+import builders
+from mmd import loader
+from mmd import physics
+from mmd import skeleton
+
+
+def simulate(model, frames, poses=1):
+    sk = skeleton.Skeleton(model)
+    phys = physics.Physics(model, sk)
+    translations = np.zeros((poses, len(sk), 3), np.float32)
+    rotations = skeleton.identity_quaternions((poses, len(sk)))
+    for i in range(frames):
+        sk.pose(translations, rotations, physics=phys, elapsed=1.0 / 60)
+    return phys
+
+# the bodies of the model set to (kind, shape, size, position, group, mask)
+def set_bodies(model, bodies):
+    for body, (kind, shape, size, position, group, mask) in zip(model.rigidBodies, bodies):
+        body.type = kind
+        body.shapeType = shape
+        body.width, body.height, body.depth = size
+        body.position = list(position)
+        body.rotation = [0.0, 0.0, 0.0]
+        body.groupIndex = group
+        body.groupTarget = mask
+        body.positionDamping = 0.0
+    del model.rigidBodies[len(bodies):]
+
+def set_joint(joint, slack=0.0, cone=np.pi):
+    joint.translationLimitation1 = [-slack, 0.0, 0.0]
+    joint.translationLimitation2 = [slack, 0.0, 0.0]
+    joint.rotationLimitation1 = [-cone, -cone, -cone]
+    joint.rotationLimitation2 = [cone, cone, cone]
+    joint.springPosition = [0.0, 0.0, 0.0]
+    joint.springRotation = [0.0, 0.0, 0.0]
+
+
+def test_lazy_model(pmx_file):
+    sk = skeleton.Skeleton(loader.load(pmx_file))
+    eager = physics.Physics(loader.load(pmx_file), sk)
+    lazy = physics.Physics(loader.load(pmx_file, lazy=True), sk)
+
+    assert len(lazy) == len(eager) == 3
+    assert len(lazy.jointA) == len(eager.jointA) == 2
+    np.testing.assert_array_equal(lazy.rest, eager.rest)
+    np.testing.assert_array_equal(lazy.lengths, eager.lengths)
+
+def test_pmd_positions_relative_to_bones(pmd_file):
+    model = loader.load(pmd_file)
+    model.rigidBodies[0].boneIndex = -1
+    phys = physics.Physics(model, skeleton.Skeleton(model))
+
+    # the body without a bone is not moved by the position of bone 0
+    np.testing.assert_allclose(phys.rest[0, :3, 3], model.rigidBodies[0].position)
+    np.testing.assert_allclose(phys.rest[1, :3, 3], np.add(model.rigidBodies[1].position, model.bones[1].position))
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_pmd_without_physics(tmp_path, lazy):
+    file = builders.make_pmd(str(tmp_path / 'm.pmd'), physics=False)
+    phys = simulate(loader.load(file, lazy=lazy), 2)
+
+    assert len(phys) == 0
+    assert phys.steps == 2
+
+def test_joints_keep_their_length(pmx_file):
+    model = loader.load(pmx_file)
+    set_bodies(model, [
+        (physics.STATIC, physics.SPHERE, (0.5, 0, 0), (0, 10, 0), 0, 0),
+        (physics.DYNAMIC, physics.SPHERE, (0.5, 0, 0), (2, 10, 0), 1, 0),
+        (physics.DYNAMIC, physics.SPHERE, (0.5, 0, 0), (4, 10, 0), 2, 0),
+    ])
+    for joint in model.constraints:
+        set_joint(joint)
+
+    phys = simulate(model, 60, poses=2)
+    x = phys.positions
+
+    # the chain swings down from the fixed body
+    assert np.all(x[:, 2, 1] < 8)
+    lengths = np.linalg.norm(x[:, phys.jointB] - x[:, phys.jointA], axis=-1)
+    np.testing.assert_allclose(lengths, 2.0, atol=0.1)
+    np.testing.assert_allclose(x[0], x[1])
+
+def test_aligned_chain(pmx_file):
+    model = loader.load(pmx_file)
+    set_bodies(model, [
+        (physics.STATIC, physics.SPHERE, (0.5, 0, 0), (0, 10, 0), 0, 0),
+        (physics.ALIGNED, physics.SPHERE, (0.5, 0, 0), (2, 10, 0), 1, 0),
+        (physics.ALIGNED, physics.SPHERE, (0.5, 0, 0), (4, 10, 0), 2, 0),
+    ])
+    for joint in model.constraints:
+        set_joint(joint)
+    sk = skeleton.Skeleton(model)
+    phys = physics.Physics(model, sk)
+    translations = np.zeros((len(sk), 3), np.float32)
+    rotations = skeleton.identity_quaternions((len(sk),))
+    for i in range(60):
+        globals = sk.pose(translations, rotations, physics=phys, elapsed=1.0 / 60)
+
+    # simulated like dynamic bodies
+    x = phys.positions
+    assert np.all(x[:, 2, 1] < 8)
+    np.testing.assert_allclose(np.linalg.norm(x[:, phys.jointB] - x[:, phys.jointA], axis=-1), 2.0, atol=0.1)
+    # their bones turn but keep the position of the bone
+    np.testing.assert_allclose(globals[1:3, :3, 3], [ bone.position for bone in model.bones[1:3] ], atol=1e-5)
+    assert not np.allclose(globals[2, :3, :3], np.eye(3), atol=1e-2)
+
+def test_joint_slack(pmx_file):
+    model = loader.load(pmx_file)
+    set_bodies(model, [
+        (physics.STATIC, physics.SPHERE, (0.5, 0, 0), (0, 10, 0), 0, 0),
+        (physics.DYNAMIC, physics.SPHERE, (0.5, 0, 0), (0, 8, 0), 1, 0),
+    ])
+    set_joint(model.constraints[0], slack=1.0)
+    del model.constraints[1:]
+
+    phys = simulate(model, 60)
+    length = np.linalg.norm(phys.positions[0, 1] - phys.positions[0, 0])
+    assert 2.9 < length < 3.1
+
+@pytest.mark.parametrize('mask, height', [(0xffff, 2.0), (0xfffe, None)])
+def test_sphere_on_box(pmx_file, mask, height):
+    model = loader.load(pmx_file)
+    set_bodies(model, [
+        (physics.STATIC, physics.BOX, (5, 1, 5), (0, 0, 0), 0, 0xffff),
+        (physics.DYNAMIC, physics.SPHERE, (1, 0, 0), (0, 4, 0), 1, mask),
+    ])
+    model.constraints = []
+
+    phys = simulate(model, 120)
+    y = phys.positions[0, 1, 1]
+
+    if height is None:
+        # the box is not in the groups the sphere collides with
+        assert y < -5
+    else:
+        assert abs(y - height) < 0.05
+        np.testing.assert_allclose(phys.positions[0, 1, [0, 2]], 0, atol=1e-4)
+
+def test_static_bodies_follow_bones(pmx_file):
+    model = loader.load(pmx_file)
+    sk = skeleton.Skeleton(model)
+    phys = physics.Physics(model, sk)
+    translations = np.zeros((len(sk), 3), np.float32)
+    translations[0] = (1, 2, 3)
+    sk.pose(translations, skeleton.identity_quaternions((len(sk),)), physics=phys, elapsed=1.0 / 60)
+
+    np.testing.assert_allclose(phys.positions[0, 0], np.add(model.rigidBodies[0].position, (1, 2, 3)), atol=1e-5)
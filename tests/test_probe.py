@@ -0,0 +1,79 @@
+import os
+
+import builders
+from mmd import loader
+
+
+def test_probe_pmd(tmp_path):
+    file = builders.make_pmd(str(tmp_path / 'm.pmd'))
+    metadata = loader.probe(file)
+    model = loader.load(file)
+
+    assert metadata.format == 'pmd'
+    assert metadata.modelName == model.metadata.modelName
+    assert metadata.vertexCount == len(model.vertices)
+    assert metadata.faceCount == len(model.faces)
+    assert metadata.boneCount == len(model.bones)
+    assert metadata.rigidBodyCount == len(model.rigidBodies)
+    assert metadata.constraintCount == len(model.constraints)
+
+def test_probe_pmx(pmx_file):
+    metadata = loader.probe(pmx_file)
+
+    assert metadata.format == 'pmx'
+    assert metadata.modelName == 'モデル'
+    assert metadata.additionalUvNum == 1
+    assert metadata.vertexCount == 60
+
+def test_probe_vmd(tmp_path):
+    file = builders.make_vmd(str(tmp_path / 'm.vmd'), cameras=3)
+    metadata = loader.probe(file)
+    vmd = loader.load(file)
+
+    assert metadata.name == 'テストモデル'
+    assert metadata.motionCount == len(vmd.motions) == 200
+    assert metadata.morphCount == len(vmd.morphs) == 30
+    assert metadata.cameraCount == len(vmd.cameras) == 3
+
+def test_probe_zero_counts(tmp_path):
+    metadata = loader.probe(builders.make_vmd(str(tmp_path / 'm.vmd'), motions=0, morphs=0))
+    assert (metadata.motionCount, metadata.morphCount, metadata.cameraCount) == (0, 0, 0)
+
+    metadata = loader.probe(builders.make_pmd(str(tmp_path / 'm.pmd'), vertices=0))
+    assert (metadata.vertexCount, metadata.faceCount) == (0, 0)
+
+def test_probe_vmd_without_cameras(tmp_path):
+    file = builders.make_vmd(str(tmp_path / 'm.vmd'))
+    with open(file, 'rb') as f:
+        data = f.read()
+    # old files end right after the morphs
+    with open(file, 'wb') as f:
+        f.write(data[:-4])
+
+    metadata = loader.probe(file)
+    vmd = loader.load(file)
+    assert (metadata.motionCount, metadata.morphCount, metadata.cameraCount) == (200, 30, 0)
+    assert (len(vmd.motions), len(vmd.morphs), len(vmd.cameras)) == (200, 30, 0)
+    assert vmd.metadata.cameraCount == 0
+
+    entries = loader.catalog(str(tmp_path), workers=1)
+    assert 'error' not in entries[0]
+    assert entries[0]['cameraCount'] == 0
+
+def test_catalog(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    builders.make_pmd(str(tmp_path / 'a.pmd'))
+    builders.make_vmd(str(tmp_path / 'sub' / 'b.vmd'))
+    with open(str(tmp_path / 'c.pmx'), 'wb') as f:
+        f.write(b'PMX broken')
+    with open(str(tmp_path / 'notes.txt'), 'w') as f:
+        f.write('not a model')
+
+    entries = loader.catalog(str(tmp_path), workers=1)
+    entries = dict([ (os.path.relpath(entry['path'], str(tmp_path)), entry) for entry in entries ])
+
+    assert sorted(entries) == ['a.pmd', 'c.pmx', os.path.join('sub', 'b.vmd')]
+    assert entries['a.pmd']['vertexCount'] == 50
+    assert entries['a.pmd']['size'] == os.path.getsize(str(tmp_path / 'a.pmd'))
+    assert entries[os.path.join('sub', 'b.vmd')]['motionCount'] == 200
+    assert 'error' in entries['c.pmx']
@@ -0,0 +1,114 @@
+import numpy as np
+
+from mmd import loader
+from mmd import quaternion
+from mmd import skeleton
+
+
+def random_pose(shape, seed=1):
+    rng = np.random.default_rng(seed)
+    translations = rng.uniform(-1, 1, shape + (3,)).astype(np.float32)
+    rotations = quaternion.normalize(rng.normal(size=shape + (4,))).astype(np.float32)
+    return translations, rotations
+
+def matrix(translation, rotation):
+    m = np.eye(4)
+    m[:3, :3] = quaternion.to_matrix(np.asarray(rotation, np.float64))
+    m[:3, 3] = translation
+    return m
+
+# globals of one pose bone by bone through the parents, grants included
+def reference(model, translations, rotations):
+    bones = model.bones
+    positions = np.array([ bone.position for bone in bones ])
+    globals = {}
+
+    def evaluate(i):
+        if i in globals:
+            return globals[i]
+        bone = bones[i]
+        t = translations[i].astype(np.float64)
+        q = rotations[i].astype(np.float64)
+        grant = bone.get('grant')
+        if grant:
+            ratio = grant.ratio
+            if bone.flag & skeleton.GRANT_ROTATION:
+                q = quaternion.multiply(q, quaternion.slerp(np.array([0, 0, 0, 1.0]), rotations[grant.parentIndex], ratio))
+            if bone.flag & skeleton.GRANT_TRANSLATION:
+                t = t + translations[grant.parentIndex] * ratio
+
+        offset = positions[i] - (positions[bone.parentIndex] if bone.parentIndex >= 0 else 0)
+        local = matrix(offset + t, q)
+        globals[i] = local if bone.parentIndex < 0 else evaluate(bone.parentIndex) @ local
+        return globals[i]
+
+    return np.array([ evaluate(i) for i in range(len(bones)) ])
+
+
+def test_rest_pose(pmx_file):
+    model = loader.load(pmx_file)
+    sk = skeleton.Skeleton(model)
+    translations = np.zeros((len(sk), 3), np.float32)
+
+    globals = sk.pose(translations, skeleton.identity_quaternions((len(sk),)))
+
+    np.testing.assert_allclose(globals[:, :3, 3], [ bone.position for bone in model.bones ])
+    np.testing.assert_allclose(sk.skinning_matrices(globals), np.tile(np.eye(4), (len(sk), 1, 1)), atol=1e-6)
+
+def test_pmx_reference(pmx_file):
+    model = loader.load(pmx_file)
+    sk = skeleton.Skeleton(model)
+    translations, rotations = random_pose((len(sk),))
+
+    globals = sk.pose(translations, rotations)
+
+    np.testing.assert_allclose(globals, reference(model, translations, rotations), atol=1e-5)
+
+def test_pmd_reference(pmd_file):
+    model = loader.load(pmd_file)
+    sk = skeleton.Skeleton(model)
+    translations, rotations = random_pose((len(sk),))
+
+    np.testing.assert_allclose(sk.pose(translations, rotations), reference(model, translations, rotations), atol=1e-5)
+
+def test_batch_equals_single(pmx_file):
+    sk = skeleton.Skeleton(loader.load(pmx_file))
+    translations, rotations = random_pose((4, len(sk)))
+
+    globals = sk.pose(translations, rotations)
+
+    assert globals.shape == (4, len(sk), 4, 4)
+    for p in range(4):
+        np.testing.assert_allclose(globals[p], sk.pose(translations[p], rotations[p]), atol=1e-6)
+
+def test_stages(pmx_file):
+    model = loader.load(pmx_file)
+    model.bones[4].flag |= skeleton.AFTER_PHYSICS
+    sk = skeleton.Skeleton(model)
+
+    # the grant bone is in deform layer 1, the ik bone after physics
+    assert [ (stage.afterPhysics, stage.layer, stage.bones.tolist()) for stage in sk.stages ] == [
+        (False, 0, [0, 1, 2, 3]), (False, 1, [5]), (True, 0, [4])
+    ]
+    assert [ level.tolist() for level in sk.stages[0].levels ] == [[0], [1], [2], [3]]
+    assert [ grants.tolist() for grants in sk.stages[1].grants ] == [[5]]
+
+def test_tree_depths():
+    parents = np.array([-1, 0, 1, 0, 5, 4])
+
+    # the loop of 4 and 5 is entered at 5, which is taken as a root
+    assert skeleton.tree_depths(parents).tolist() == [0, 1, 2, 1, 1, 0]
+
+def test_parent_loop(pmx_file):
+    model = loader.load(pmx_file)
+    model.bones[1].parentIndex = 2
+    sk = skeleton.Skeleton(model)
+    translations, rotations = random_pose((len(sk),))
+
+    globals = sk.pose(translations, rotations)
+
+    # 2 is a root at its rest position, 1 hangs from it
+    assert sk.parents.tolist() == [-1, 2, -1, 2, 0, 0]
+    np.testing.assert_allclose(globals[2], matrix(model.bones[2].position + translations[2], rotations[2]), atol=1e-6)
+    local = matrix(np.subtract(model.bones[1].position, model.bones[2].position) + translations[1], rotations[1])
+    np.testing.assert_allclose(globals[1], globals[2] @ local, atol=1e-5)
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+import builders
+from mmd import loader
+from mmd import quaternion
+from mmd import skinning
+
+
+# random rigid matrices (..., 4, 4)
+def rigid_matrices(shape, seed=1):
+    rng = np.random.default_rng(seed)
+    m = np.tile(np.eye(4, dtype=np.float32), shape + (1, 1))
+    m[..., :3, :3] = quaternion.to_matrix(quaternion.normalize(rng.normal(size=shape + (4,))))
+    m[..., :3, 3] = rng.uniform(-5, 5, shape + (3,))
+    return m
+
+# linear blend of one vertex at a time
+def reference(vertices, matrices):
+    positions = np.zeros((len(vertices), 3))
+    for n in range(len(vertices)):
+        for bone, weight in zip(vertices.skinIndices[n], vertices.skinWeights[n]):
+            positions[n] += weight * (matrices[bone, :3, :3] @ vertices.positions[n] + matrices[bone, :3, 3])
+    return positions
+
+def test_pmd_linear_blend(pmd_file):
+    vertices = loader.load(pmd_file).vertices
+    matrices = rigid_matrices((5,))
+
+    skin = skinning.Skin(vertices)
+
+    np.testing.assert_allclose(skin.deform(matrices), reference(vertices, matrices), atol=1e-4)
+
+def test_pmx_linear_blend(pmx_file):
+    vertices = loader.load(pmx_file).vertices
+    matrices = rigid_matrices((6,))
+    bdef = vertices.types != 3
+
+    positions = skinning.Skin(vertices).deform(matrices)
+
+    np.testing.assert_allclose(positions[bdef], reference(vertices, matrices)[bdef], atol=1e-4)
+
+@pytest.mark.parametrize('make', [builders.make_pmd, builders.make_pmx])
+def test_identity(tmp_path, make):
+    vertices = loader.load(make(str(tmp_path / ('m.' + make.__name__[-3:])))).vertices
+    skin = skinning.Skin(vertices)
+
+    positions, normals = skin.deform(np.tile(np.eye(4, dtype=np.float32), (6, 1, 1)), normals=True)
+
+    np.testing.assert_allclose(positions, vertices.positions, atol=1e-5)
+    expected = vertices.normals / np.linalg.norm(vertices.normals, axis=-1, keepdims=True)
+    np.testing.assert_allclose(normals, expected, atol=1e-5)
+
+def test_batch_equals_single(pmx_file):
+    skin = skinning.Skin(loader.load(pmx_file).vertices)
+    matrices = rigid_matrices((5, 6))
+
+    positions, normals = skin.deform(matrices, normals=True, chunk=2)
+
+    assert positions.shape == (5, 60, 3)
+    for p in range(5):
+        single = skin.deform(matrices[p], normals=True)
+        np.testing.assert_allclose(positions[p], single[0], atol=1e-5)
+        np.testing.assert_allclose(normals[p], single[1], atol=1e-5)
+    np.testing.assert_allclose(np.linalg.norm(normals, axis=-1), 1.0, atol=1e-5)
+
+def test_zero_vertices(tmp_path):
+    vertices = loader.load(builders.make_pmx(str(tmp_path / 'm.pmx'), vertices=0)).vertices
+    skin = skinning.Skin(vertices)
+
+    assert len(skin) == 0
+    assert skin.deform(rigid_matrices((2, 6))).shape == (2, 0, 3)
+
+
+def test_sdef_rigid(pmx_file):
+    vertices = loader.load(pmx_file).vertices
+    sdef = vertices.types == 3
+    matrix = rigid_matrices(())
+
+    # every bone moved alike moves the SDEF vertices rigidly too
+    positions = skinning.Skin(vertices).deform(np.tile(matrix, (6, 1, 1)))
+
+    expected = vertices.positions[sdef] @ matrix[:3, :3].T + matrix[:3, 3]
+    np.testing.assert_allclose(positions[sdef], expected, atol=1e-4)
+
+def test_sdef_translation(pmx_file):
+    vertices = loader.load(pmx_file).vertices
+    sdef = vertices.types == 3
+    matrices = np.tile(np.eye(4, dtype=np.float32), (6, 1, 1))
+    matrices[:, :3, 3] = np.random.default_rng(1).uniform(-5, 5, (6, 3))
+
+    # without rotations SDEF is the linear blend
+    positions = skinning.Skin(vertices).deform(matrices)
+
+    np.testing.assert_allclose(positions[sdef], reference(vertices, matrices)[sdef], atol=1e-4)
+
+def test_sdef_reference(pmx_file):
+    vertices = loader.load(pmx_file).vertices
+    matrices = rigid_matrices((6,))
+    rotations = quaternion.from_matrix(matrices[:, :3, :3])
+
+    positions = skinning.Skin(vertices).deform(matrices)
+
+    # one vertex at a time, as the SDEF of the pmx specification
+    for n in np.flatnonzero(vertices.types == 3):
+        b0, b1 = vertices.skinIndices[n, :2]
+        w0 = vertices.skinWeights[n, 0]
+        c, r0, r1 = vertices.skinC[n], vertices.skinR0[n], vertices.skinR1[n]
+        rw = r0 * w0 + r1 * (1 - w0)
+        cr0 = (c + c + r0 - rw) * 0.5
+        cr1 = (c + c + r1 - rw) * 0.5
+        q = quaternion.slerp(rotations[b0], rotations[b1], 1 - w0)
+        expected = quaternion.to_matrix(q) @ (vertices.positions[n] - c)
+        expected += (matrices[b0, :3, :3] @ cr0 + matrices[b0, :3, 3]) * w0
+        expected += (matrices[b1, :3, :3] @ cr1 + matrices[b1, :3, 3]) * (1 - w0)
+        np.testing.assert_allclose(positions[n], expected, atol=1e-4)
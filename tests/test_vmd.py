@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import builders
+from mmd import loader
+
+
+def test_iter_vmd_equals_parse(vmd_file):
+    vmd = loader.load(vmd_file)
+    chunks = {}
+    for kind, batch in loader.iter_vmd(vmd_file, chunk_frames=7):
+        assert 0 < len(batch) <= 7
+        chunks.setdefault(kind, []).extend(batch)
+
+    assert chunks['motions'] == vmd.motions
+    assert chunks['morphs'] == vmd.morphs
+    assert 'cameras' not in chunks
+
+def test_iter_vmd_filters(vmd_file):
+    motions = [ m for kind, batch in loader.iter_vmd(vmd_file, bones=['左ひざ']) if kind == 'motions' for m in batch ]
+
+    assert motions
+    assert all([ m.boneName == '左ひざ' for m in motions ])
+    assert len(motions) == len([ m for m in loader.load(vmd_file).motions if m.boneName == '左ひざ' ])
+
+@pytest.mark.parametrize('chunk_frames', [0, -1])
+def test_iter_vmd_rejects_chunk_frames(vmd_file, chunk_frames):
+    with pytest.raises(ValueError):
+        loader.iter_vmd(vmd_file, chunk_frames=chunk_frames)
+
+def test_iter_vmd_truncated(tmp_path):
+    file = builders.make_vmd(str(tmp_path / 'm.vmd'))
+    with open(file, 'rb') as f:
+        data = f.read()
+    with open(file, 'wb') as f:
+        f.write(data[:-100])
+
+    with pytest.raises(ValueError):
+        list(loader.iter_vmd(file))
+
+
+@pytest.mark.parametrize('motions, morphs', [(200, 30), (0, 0)])
+def test_columnar_equals_records(tmp_path, motions, morphs):
+    file = builders.make_vmd(str(tmp_path / 'm.vmd'), motions=motions, morphs=morphs)
+    records = loader.load(file)
+    columns = loader.load(file, columnar=True)
+
+    m = columns.motions
+    assert len(m.frameNum) == motions
+    assert [ m.boneNames[i] for i in m.boneId ] == [ r.boneName for r in records.motions ]
+    assert m.frameNum.tolist() == [ r.frameNum for r in records.motions ]
+    np.testing.assert_array_equal(m.position, np.array([ r.position for r in records.motions ], np.float32).reshape(-1, 3))
+    np.testing.assert_array_equal(m.rotation, np.array([ r.rotation for r in records.motions ], np.float32).reshape(-1, 4))
+    assert [ bytes(row) for row in m.interpolation ] == [ bytes(r.interpolation) for r in records.motions ]
+
+    m = columns.morphs
+    assert [ m.morphNames[i] for i in m.morphId ] == [ r.morphName for r in records.morphs ]
+    assert m.frameNum.tolist() == [ r.frameNum for r in records.morphs ]
+    np.testing.assert_array_equal(m.weight, np.array([ r.weight for r in records.morphs ], np.float32))